@@ -45,6 +45,21 @@ REST_FRAMEWORK = {
     'DATETIME_FORMAT': '%s'
 }
 
+# Micro-batching of concurrent recommendation requests (product.recommender)
+RECOMMENDER_BATCH_WINDOW_MS = float(os.environ.get('RECOMMENDER_BATCH_WINDOW_MS', 3))
+RECOMMENDER_MAX_BATCH_SIZE  = int(os.environ.get('RECOMMENDER_MAX_BATCH_SIZE', 32))
+
+# Serve the recommenders from a compressed embedding store (float16, int8 or pq),
+# written by `python manage.py compress_embeddings`
+EMBEDDING_CODEC = os.environ.get('EMBEDDING_CODEC') or None
+# Content similarity in a reduced space (e.g. pca_128), written by
+# `python manage.py fit_reduction`
+CONTENT_REDUCTION = os.environ.get('CONTENT_REDUCTION') or None
+# Encoder of the books added since the store was built (`ingest_embeddings`)
+EMBEDDING_ENCODER = os.environ.get(
+    'EMBEDDING_ENCODER', 'product.recommenders.encoders.HashingEncoder'
+)
+
 CORS_ALLOW_ALL_HOST = True
 CORS_ALLOW_ALL_ORIGINS = True
 
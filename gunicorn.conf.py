@@ -0,0 +1,24 @@
+"""
+Gunicorn settings (Procfile).
+
+The app and the recommender data are loaded in the master before the
+workers are forked, so the workers share one copy of them.
+"""
+import os
+
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+preload_app = True
+
+
+def when_ready(server):
+    from product.recommenders.preload import log_memory, warm_up
+
+    warm_up()
+    log_memory("master", server.log)
+
+
+def post_worker_init(worker):
+    from product.recommenders.preload import log_memory
+
+    log_memory("worker", worker.log)
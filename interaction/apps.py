@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class InteractionConfig(AppConfig):
     name = 'interaction'
+
+    def ready(self):
+        from . import signals
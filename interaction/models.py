@@ -1,15 +1,47 @@
 from django.db import models
 
+import numpy as np
+
 # Create your models here.
 from utils.model import BaseModel
 from user_account.models import User
 from product.models import Book
 
+CATEGORY_SIZE = 100
+
+
 class Interaction(BaseModel):
     user = models.ForeignKey(to=User,on_delete=models.CASCADE)
     book = models.ForeignKey(to=Book, on_delete=models.CASCADE)
     rating = models.IntegerField()
     content = models.TextField()
     header = models.TextField()
-    
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored book, so the profile can be fixed if it changes
+        instance._loaded_book_id = instance.__dict__.get('book_id')
+        return instance
+
+
+class UserProfile(BaseModel):
+    """
+    Number of interactions of a user per category cf_index, the user input of BCFNet
+    """
+
+    user = models.OneToOneField(to=User, on_delete=models.CASCADE, related_name='profile')
+
+    # CATEGORY_SIZE int32 counts
+    categories = models.BinaryField(default=bytes(CATEGORY_SIZE * 4))
+
+    @property
+    def histogram(self):
+        return np.frombuffer(bytes(self.categories), dtype=np.int32)
+
+    @histogram.setter
+    def histogram(self, value):
+        self.categories = np.asarray(value, dtype=np.int32).tobytes()
+
+    def __str__(self):
+        return str(self.user)
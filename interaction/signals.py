@@ -0,0 +1,36 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from utils.services import recommendation as recommendation_services
+
+from .models import Interaction
+
+
+@receiver(post_save, sender=Interaction)
+def update_profile_on_save(sender, instance, created, **kwargs):
+    previous_book_id = getattr(instance, '_loaded_book_id', None)
+    if created:
+        recommendation_services.update_user_profile(instance.user_id, added=instance.book_id)
+    elif previous_book_id is None:
+        # Saved without being loaded first, the previous book is unknown
+        recommendation_services.rebuild_user_profile(instance.user_id)
+    elif previous_book_id != instance.book_id:
+        recommendation_services.update_user_profile(
+            instance.user_id, added=instance.book_id, removed=previous_book_id
+        )
+    instance._loaded_book_id = instance.book_id
+
+
+@receiver(pre_delete, sender=Interaction)
+def count_categories_on_delete(sender, instance, **kwargs):
+    # Deleting the book also deletes its categories before post_delete
+    instance._removed_counts = recommendation_services.get_book_category_counts(
+        instance.book_id
+    )
+
+
+@receiver(post_delete, sender=Interaction)
+def update_profile_on_delete(sender, instance, **kwargs):
+    recommendation_services.remove_from_user_profile(
+        instance.user_id, instance._removed_counts
+    )
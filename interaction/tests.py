@@ -1,3 +1,189 @@
+import json
+from unittest import mock
+
 from django.test import TestCase
 
+from product.models import Book, Category
+from user_account.models import User
+from utils.fields.status import StatusChoices
+from utils.services import recommendation as recommendation_services
+
+from .models import Interaction, UserProfile
+from .serializer import InteractionSerializer
+
 # Create your tests here.
+
+
+class ListInteractionTest(TestCase):
+    def test_query_count(self):
+        book = Book.objects.create(name="book")
+        for count in (1, 5):
+            for i in range(count):
+                user = User.objects.create(email=f"{count}.{i}@b.c", name=str(i))
+                Interaction.objects.create(
+                    user=user, book=book, rating=5, content="", header=""
+                )
+            # The count, then the page with its users in a single query
+            with self.assertNumQueries(2):
+                response = self.client.get("/api/interaction/list", {"uid": book.uid})
+            data = response.json()["data"]
+            self.assertEqual(data["totalRows"], Interaction.objects.count())
+        self.assertEqual(data["content"][0]["name"], "0")
+
+    def test_pages(self):
+        book = Book.objects.create(name="book")
+        for i in range(5):
+            user = User.objects.create(email=f"{i}@b.c", name=str(i))
+            Interaction.objects.create(
+                user=user, book=book, rating=5, content="", header=""
+            )
+        url = "/api/interaction/list"
+
+        data = self.client.get(url, {"uid": book.uid, "page": 2, "page_size": 2})
+        data = data.json()["data"]
+        self.assertEqual(
+            {key: value for key, value in data.items() if key != "content"},
+            {"totalRows": 5, "totalPages": 3, "currentPage": 2, "pageSize": 2},
+        )
+        self.assertEqual([review["name"] for review in data["content"]], ["2", "3"])
+
+        # page_size=0 streams every row, 2 at a time here
+        with mock.patch("utils.viewset.STREAM_CHUNK_SIZE", 2):
+            response = self.client.get(url, {"uid": book.uid, "page_size": 0})
+            self.assertTrue(response.streaming)
+            data = json.loads(b"".join(response.streaming_content))
+        self.assertEqual(data["error_code"], 0)
+        self.assertEqual(data["data"]["pageSize"], 6)
+        self.assertEqual(
+            [review["name"] for review in data["data"]["content"]],
+            ["0", "1", "2", "3", "4"],
+        )
+
+    def test_stream_errors(self):
+        book = Book.objects.create(name="book")
+        for i in range(5):
+            user = User.objects.create(email=f"{i}@b.c", name=str(i))
+            Interaction.objects.create(
+                user=user, book=book, rating=5, content="", header=""
+            )
+        url = "/api/interaction/list"
+
+        def broken(name):
+            def get_name(serializer, instance):
+                if instance.user.name == name:
+                    raise ValueError("broken row")
+                return instance.user.name
+
+            return mock.patch.object(InteractionSerializer, "get_name", get_name)
+
+        with mock.patch("utils.viewset.STREAM_CHUNK_SIZE", 2):
+            # In the first chunk, the view answers with its error response
+            with broken("1"):
+                response = self.client.get(url, {"uid": book.uid, "page_size": 0})
+            self.assertFalse(response.streaming)
+            self.assertIsNone(response.json()["data"])
+
+            # After the response started, the body is cut short
+            with broken("3"):
+                response = self.client.get(url, {"uid": book.uid, "page_size": 0})
+                self.assertTrue(response.streaming)
+                with self.assertRaisesMessage(ValueError, "broken row"):
+                    b"".join(response.streaming_content)
+
+
+class RecommendationCacheTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        self.user = User.objects.create(
+            email="a@b.c", name="a", status=StatusChoices.ACTIVE
+        )
+        self.book = Book.objects.create(name="book")
+
+    def test_rating_invalidates(self):
+        version = recommendation_services.get_interaction_version(self.user.pk)
+        recommendation_services.set_recommendation(self.user.pk, ["x"], version)
+        self.assertEqual(recommendation_services.get_recommendation(self.user.pk), ["x"])
+
+        self.client.force_login(self.user)
+        response = self.client.post(
+            "/api/interaction/rate", {"uid": str(self.book.uid), "rate": 5}
+        )
+        self.assertEqual(response.json()["error_code"], 0)
+        self.assertIsNone(recommendation_services.get_recommendation(self.user.pk))
+
+    def test_rating_while_computing(self):
+        # A rating arrives between the version read and the write
+        version = recommendation_services.get_interaction_version(self.user.pk)
+        recommendation_services.bump_interaction_version(self.user.pk)
+        recommendation_services.set_recommendation(self.user.pk, ["x"], version)
+        self.assertIsNone(recommendation_services.get_recommendation(self.user.pk))
+
+
+class ProfileSignalTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email="a@b.c", name="a")
+        categories = [
+            Category.objects.create(name=str(i), cf_index=i) for i in range(3)
+        ]
+        self.first = Book.objects.create(name="first")
+        self.first.categories.add(categories[0], categories[1])
+        self.second = Book.objects.create(name="second")
+        self.second.categories.add(categories[2])
+        self.uncategorized = Book.objects.create(name="uncategorized")
+
+    def assertProfileRebuilt(self):
+        histogram = UserProfile.objects.get(user=self.user).histogram.copy()
+        rebuilt = recommendation_services.rebuild_user_profile(self.user.pk)
+        self.assertEqual(histogram.tolist(), rebuilt.histogram.tolist())
+        return histogram
+
+    def _rate(self, book):
+        return Interaction.objects.create(
+            user=self.user, book=book, rating=5, content="", header=""
+        )
+
+    def test_signals(self):
+        interaction = self._rate(self.first)
+        self.assertEqual(self.assertProfileRebuilt()[:3].tolist(), [1, 1, 0])
+
+        interaction = Interaction.objects.get(pk=interaction.pk)
+        interaction.book = self.second
+        interaction.save()
+        self.assertEqual(self.assertProfileRebuilt()[:3].tolist(), [0, 0, 1])
+
+        self._rate(self.first)
+        interaction.delete()
+        self.assertEqual(self.assertProfileRebuilt()[:3].tolist(), [1, 1, 0])
+
+    def test_book_without_categories(self):
+        # The first rating builds the profile from every interaction
+        self._rate(self.uncategorized)
+        self.assertEqual(self.assertProfileRebuilt().sum(), 0)
+        self._rate(self.first)
+        interaction = self._rate(self.uncategorized)
+        self.assertEqual(self.assertProfileRebuilt()[:3].tolist(), [1, 1, 0])
+        interaction.delete()
+        self.assertEqual(self.assertProfileRebuilt()[:3].tolist(), [1, 1, 0])
+
+    def test_delete_book(self):
+        other = Book.objects.create(name="other")
+        other.categories.add(*self.first.categories.all()[:1])
+        self._rate(self.first)
+        self._rate(other)
+        self.assertEqual(self.assertProfileRebuilt()[:3].tolist(), [2, 1, 0])
+        # The categories of the book are deleted before its interactions
+        other.delete()
+        self.assertEqual(self.assertProfileRebuilt()[:3].tolist(), [1, 1, 0])
+
+    def test_delete_user(self):
+        from django.db import connection
+
+        self._rate(self.first)
+        self._rate(self.second)
+        user_id = self.user.pk
+        self.user.delete()
+        self.assertFalse(UserProfile.objects.filter(user_id=user_id).exists())
+        self.assertFalse(Interaction.objects.filter(user_id=user_id).exists())
+        connection.check_constraints()
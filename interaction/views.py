@@ -8,6 +8,7 @@ from rest_framework import (
 )
 from . import serializer, models, filter as interaction_filter
 from utils import viewset
+from utils.services import recommendation as recommendation_services
 
 
 from django.http import JsonResponse
@@ -27,12 +28,13 @@ class GetInteractionOfProduct(viewsets.GenericViewSet):
         uid = request.GET.get("uid", None)
 
         try:
-            data = models.Interaction.objects.filter(book__uid=uid)
-            data = serializer.InteractionSerializer(data, many=True).data
+            data = models.Interaction.objects.filter(book__uid=uid).select_related(
+                "user"
+            )
             # pagination = viewset.pagination.LargeResultsSetPagination().paginate_queryset(data, request).get_paginated_response()
-            data = viewset.paginate_data(request, data)
-
-            return JsonResponse({"data": data, "error_code": 0})
+            return viewset.paginate_queryset(
+                request, data.order_by("id"), serializer.InteractionSerializer
+            )
         except Exception as e:
             print(f"Exception while filtering: {e}")
         return JsonResponse({"data": None, "error_code": 0})
@@ -66,6 +68,7 @@ class GetInteractionOfProduct(viewsets.GenericViewSet):
             interaction.content = content
             interaction.header = header
             interaction.save()
+            recommendation_services.bump_interaction_version(user.pk)
 
             return JsonResponse(
                 {
@@ -88,6 +91,7 @@ class GetInteractionOfProduct(viewsets.GenericViewSet):
                 content=content,
                 header=header,
             )
+            recommendation_services.bump_interaction_version(user.pk)
             return JsonResponse(
                 {
                     "data": serializer.InteractionSerializer(interaction).data,
@@ -1,23 +1,48 @@
 from rest_framework import filters
 
-# from .recommenders.CB_model import cb
 
+class ContentFilter(filters.BaseFilterBackend):
+    """
+    Rank books by content similarity to the `id` book.
 
-# class ContentFilter(filters.BaseFilterBackend):
-#     def filter_queryset(self, request, queryset, view):
-#         from .models import Book
+    Served from the related table (`build_related_table`) when it exists,
+    otherwise the books of the same categories are scored on the fly.
+    """
 
-#         book_id = request.GET.get("id", None)
+    related_limit = 96
 
-#         base_book = Book.objects.filter(uid=book_id)
+    def filter_queryset(self, request, queryset, view):
+        from .models import Book
+        from .recommenders.ranking import rank_queryset
+        from .recommenders.related import get_related_table
+
+        book_id = request.GET.get("id", None)
+        if not book_id:
+            return queryset
+
+        base_book = Book.objects.filter(uid=book_id)
+
+        table = get_related_table()
+        sku = base_book.values_list("sku", flat=True).first()
+        if table is not None and sku is not None:
+            from .recommenders.store import get_store
 
-#         queryset = queryset.filter(
-#             categories__in=list(base_book.values_list("categories", flat=True))
-#         ).exclude(uid=book_id)
+            store = get_store()
+            row = store.sku_rows[sku] if 0 <= sku < len(store.sku_rows) else -1
+            rows, _ = table.related(row, self.related_limit)
+            if len(rows):
+                return rank_queryset(
+                    queryset.exclude(uid=book_id), store.skus[rows].tolist()
+                )
 
-#         queryset = cb.run(base_book, queryset)
+        queryset = queryset.filter(
+            categories__in=list(base_book.values_list("categories", flat=True))
+        ).exclude(uid=book_id)
 
-#         return queryset
+        # Imported here, so the embeddings are only loaded when first used
+        from .recommenders.CB_model import cb
+
+        return cb.run(base_book, queryset, self.related_limit)
 
 
 class PriceFilter(filters.BaseFilterBackend):
@@ -32,9 +57,15 @@ class PriceFilter(filters.BaseFilterBackend):
 
 class RatingFilter(filters.BaseFilterBackend):
     def filter_queryset(self, request, queryset, view):
-        rate_num = int(request.GET.get("rate", 0))
+        from django.db.models import F
 
-        return [obj for obj in queryset if obj.rating >= rate_num]
+        rate_num = int(request.GET.get("rate", 0))
+        if rate_num <= 0:
+            return queryset
+        # Book.rating is rating_sum // rating_count, 0 without ratings
+        return queryset.filter(
+            rating_count__gt=0, rating_sum__gte=F("rating_count") * rate_num
+        )
 
 
 class AuthorFilters(filters.BaseFilterBackend):
@@ -0,0 +1,68 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from product.recommenders import ann, store
+
+
+class Command(BaseCommand):
+    help = "Report recall@k and latency of the IVF index against exact search"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--store", default=store.STORE_DIR)
+        parser.add_argument(
+            "--sizes",
+            default="10000,100000,500000",
+            help="Catalog sizes, padded with synthetic vectors beyond the store",
+        )
+        parser.add_argument("--nprobe", default="1,4,16,64")
+        parser.add_argument("--k", type=int, default=10)
+        parser.add_argument("--queries", type=int, default=100)
+
+    def handle(self, *args, **options):
+        item_store = store.EmbeddingStore(options["store"])
+        rng = np.random.default_rng(0)
+        k = options["k"]
+
+        for size in [int(size) for size in options["sizes"].split(",")]:
+            vectors = self._catalog(item_store, size, rng)
+            start = time.time()
+            index = ann.IVFIndex(vectors, "cosine").train()
+            self.stdout.write(
+                f"{size} items, {index.nlist} lists, trained in {time.time() - start:.1f}s"
+            )
+
+            queries = vectors[
+                rng.choice(size, min(options["queries"], size), replace=False)
+            ]
+            truth, exact_latencies = [], []
+            for query in queries:
+                start = time.perf_counter()
+                truth.append(index.exact(query, k)[0])
+                exact_latencies.append((time.perf_counter() - start) * 1000)
+            self._report("exact", 1.0, np.array(exact_latencies), k)
+
+            for nprobe in [int(nprobe) for nprobe in options["nprobe"].split(",")]:
+                if nprobe > index.nlist:
+                    continue
+                recall, latencies = index.recall(queries, k, nprobe, truth)
+                self._report(f"nprobe {nprobe}", recall, latencies, k)
+
+    def _catalog(self, item_store, size, rng):
+        vectors = np.asarray(item_store.vectors[:size], dtype=np.float32)
+        if len(vectors) >= size:
+            return vectors
+        # Synthetic items: noisy copies of random store items, so the data
+        # stays clustered like the real embeddings
+        missing = size - len(vectors)
+        base = vectors[rng.integers(len(vectors), size=missing)]
+        noise = rng.normal(scale=vectors.std() * 0.5, size=base.shape)
+        return np.concatenate([vectors, (base + noise).astype(np.float32)])
+
+    def _report(self, name, recall, latencies, k):
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        self.stdout.write(
+            f"    {name:10} recall@{k} {recall:.3f}  p50 {p50:7.2f}ms"
+            f"  p95 {p95:7.2f}ms  p99 {p99:7.2f}ms"
+        )
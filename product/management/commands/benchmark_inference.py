@@ -0,0 +1,98 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from product.recommenders.batcher import MicroBatcher
+from product.recommenders.serving import (
+    BCFNET_CHECKPOINT,
+    BCFNET_CONFIG,
+    load_recommender,
+)
+
+
+class Command(BaseCommand):
+    help = "Compare BCFNet request latency of the NumPy engine and Keras"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--weights", default=os.path.splitext(BCFNET_CHECKPOINT)[0] + ".npz"
+        )
+        parser.add_argument(
+            "--checkpoint", default=None, help="Keras checkpoint, skipped if not given"
+        )
+        parser.add_argument("--sizes", default="8,32,128,500")
+        parser.add_argument("--repeat", type=int, default=50)
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=0,
+            help="Also compare throughput with and without micro-batching "
+            "for this many concurrent callers",
+        )
+        parser.add_argument("--window-ms", type=float, default=3)
+        parser.add_argument("--max-batch-size", type=int, default=32)
+
+    def handle(self, *args, **options):
+        models = {"numpy": load_recommender("bcfnet", options["weights"])}
+        if options["checkpoint"]:
+            from product.recommenders.keras_models import BCFNet
+
+            models["keras"] = BCFNet(**BCFNET_CONFIG)
+            models["keras"].load(options["checkpoint"])
+
+        rng = np.random.default_rng(0)
+        sizes = [int(size) for size in options["sizes"].split(",")]
+        items = rng.normal(
+            size=(max(sizes), BCFNET_CONFIG["item_size"])
+        ).astype(np.float32)
+        user = rng.random(BCFNET_CONFIG["user_size"])
+        user /= user.sum()
+
+        for name, model in models.items():
+            model.cache_items(items)
+            for size in sizes:
+                rows = np.arange(size)
+                full = self._latency(
+                    lambda: model.predict(user, items[:size]), options["repeat"]
+                )
+                cached = self._latency(
+                    lambda: model.predict_cached(user, rows), options["repeat"]
+                )
+                self.stdout.write(
+                    f"{name:6} {size:5} items  predict p50 {full[0]:7.2f}ms"
+                    f" p95 {full[1]:7.2f}ms  cached p50 {cached[0]:7.2f}ms"
+                    f" p95 {cached[1]:7.2f}ms"
+                )
+                if options["concurrency"]:
+                    self._throughput(model, user, rows, options)
+
+    def _throughput(self, model, user, rows, options):
+        batcher = MicroBatcher(
+            model.predict_cached_many,
+            window=options["window_ms"] / 1000,
+            max_batch_size=options["max_batch_size"],
+            log_every=0,
+        )
+        requests = options["repeat"] * options["concurrency"]
+        for name, function in (
+            ("unbatched", model.predict_cached),
+            ("batched", batcher),
+        ):
+            with ThreadPoolExecutor(options["concurrency"]) as pool:
+                start = time.perf_counter()
+                list(pool.map(lambda _: function(user, rows), range(requests)))
+                elapsed = time.perf_counter() - start
+            self.stdout.write(f"    {name:9} {requests / elapsed:9.1f} requests/sec")
+        self.stdout.write(f"    batcher {batcher.metrics()}")
+
+    def _latency(self, function, repeat):
+        function()
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            timings.append((time.perf_counter() - start) * 1000)
+        return np.percentile(timings, [50, 95])
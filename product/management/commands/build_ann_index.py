@@ -0,0 +1,46 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from product.recommenders import ann, store
+
+
+class Command(BaseCommand):
+    help = "Build the IVF index of the embedding store and tune nprobe"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--store", default=store.STORE_DIR)
+        parser.add_argument("--path", default=ann.IVF_DIR)
+        parser.add_argument(
+            "--nlist", type=int, default=None, help="Default about 4 * sqrt(n)"
+        )
+        parser.add_argument("--iterations", type=int, default=10)
+        parser.add_argument("--target-recall", type=float, default=0.95)
+        parser.add_argument("--k", type=int, default=10)
+        parser.add_argument(
+            "--queries", type=int, default=200, help="Catalog items used to tune nprobe"
+        )
+
+    def handle(self, *args, **options):
+        start = time.time()
+        item_store = store.EmbeddingStore(options["store"])
+        index = ann.IVFIndex(
+            item_store.vectors, "cosine", item_store.inverse_norms()
+        ).train(options["nlist"], options["iterations"])
+        self.stdout.write(
+            f"Trained {index.nlist} lists on {len(index)} items ({time.time() - start:.1f}s)"
+        )
+
+        rng = np.random.default_rng(0)
+        size = min(options["queries"], len(item_store))
+        queries = item_store.vectors[
+            np.sort(rng.choice(len(item_store), size, replace=False))
+        ]
+        nprobe, recall = index.tune(queries, options["k"], options["target_recall"])
+        index.save(options["path"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Saved {options['path']}: nprobe {nprobe}, recall@{options['k']} {recall:.3f}"
+            )
+        )
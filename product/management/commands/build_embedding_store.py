@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from product.recommenders import store
+
+
+class Command(BaseCommand):
+    help = "Convert the BERT csv into the memory-mapped embedding store"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--csv", default=store.DATA_FILE)
+        parser.add_argument("--path", default=store.STORE_DIR)
+        parser.add_argument("--chunksize", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        start = time.time()
+        count = store.build_store(
+            options["csv"], options["path"], chunksize=options["chunksize"]
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Stored {count} vectors in {options['path']} ({time.time() - start:.1f}s)"
+            )
+        )
@@ -0,0 +1,70 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from product.recommenders import related, store
+from product.management.commands.precompute_recommendations import THREAD_VARIABLES
+
+
+class Command(BaseCommand):
+    help = "Precompute the most similar books of every book for related products"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--store", default=store.STORE_DIR)
+        parser.add_argument("--path", default=related.RELATED_DIR)
+        parser.add_argument("--num", type=int, default=50)
+        parser.add_argument("--block-size", type=int, default=256)
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="Scoring processes, 0 to score in this process",
+        )
+        parser.add_argument(
+            "--threads", type=int, default=1, help="BLAS threads per worker"
+        )
+        parser.add_argument(
+            "--update-sku",
+            type=int,
+            nargs="+",
+            default=None,
+            help="Only refresh these books in the existing table",
+        )
+        parser.add_argument(
+            "--index",
+            default=None,
+            help="Search this IVF index (build_ann_index) instead of the whole catalog",
+        )
+
+    def handle(self, *args, **options):
+        start = time.time()
+        if options["update_sku"]:
+            rows = store.EmbeddingStore(options["store"]).rows_for(
+                options["update_sku"]
+            )[1]
+            count = related.update_related(rows, options["store"], options["path"])
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Updated {count} rows of {options['path']} ({time.time() - start:.1f}s)"
+                )
+            )
+            return
+
+        if options["workers"]:
+            # Read by the spawned workers before they load NumPy
+            for variable in THREAD_VARIABLES:
+                os.environ[variable] = str(options["threads"])
+        count = related.build_related(
+            options["store"],
+            options["path"],
+            num=options["num"],
+            block_size=options["block_size"],
+            workers=options["workers"],
+            index_path=options["index"],
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Related table of {count} books in {options['path']} ({time.time() - start:.1f}s)"
+            )
+        )
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from product.recommenders import codecs, store
+
+
+class Command(BaseCommand):
+    help = "Write a compressed copy of the embedding store (EMBEDDING_CODEC)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--codec", choices=sorted(codecs.CODECS), default="int8")
+        parser.add_argument("--store", default=store.STORE_DIR)
+        parser.add_argument("--path", default=None, help="Default <store>/<codec>")
+        parser.add_argument(
+            "--subspaces", type=int, default=96, help="Bytes per vector of pq"
+        )
+
+    def handle(self, *args, **options):
+        start = time.time()
+        if options["codec"] == "pq":
+            codec = codecs.PQCodec(subspaces=options["subspaces"])
+        else:
+            codec = codecs.CODECS[options["codec"]]()
+        path = codecs.compress_store(codec, options["store"], options["path"])
+        compressed = codecs.CompressedStore(path)
+        original = store.EmbeddingStore(options["store"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Wrote {path}: {compressed.nbytes / 2 ** 20:.1f}MB instead of "
+                f"{original.nbytes / 2 ** 20:.1f}MB ({time.time() - start:.1f}s)"
+            )
+        )
@@ -0,0 +1,86 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from product.recommenders import codecs, store
+from product.recommenders.ranking import top_k
+
+
+class Command(BaseCommand):
+    help = "Compare memory, top-k fidelity and speed of the embedding codecs"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--store", default=store.STORE_DIR)
+        parser.add_argument("--codecs", default="float16,int8,pq")
+        parser.add_argument("--subspaces", default="48,96,192")
+        parser.add_argument("--k", default="10,50")
+        parser.add_argument("--queries", type=int, default=100)
+        parser.add_argument(
+            "--limit", type=int, default=None, help="Only use the first rows"
+        )
+
+    def handle(self, *args, **options):
+        item_store = store.EmbeddingStore(options["store"])
+        count = min(options["limit"] or len(item_store), len(item_store))
+        vectors = np.asarray(item_store.vectors[:count], dtype=np.float32)
+        inverse_norms = item_store.inverse_norms()[:count]
+        rng = np.random.default_rng(0)
+        queries = vectors[rng.choice(count, min(options["queries"], count), False)]
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1), 1e-12)[:, None]
+        ks = [int(k) for k in options["k"].split(",")]
+
+        reference = (vectors @ queries.T) * inverse_norms[:, None]
+        self._report("float32", vectors.nbytes / count, count, reference, reference, ks)
+        self._throughput(
+            lambda: (vectors @ queries.T) * inverse_norms[:, None], queries
+        )
+
+        for name in options["codecs"].split(","):
+            candidates = [codecs.CODECS[name]()]
+            if name == "pq":
+                candidates = [
+                    codecs.PQCodec(subspaces=int(subspaces))
+                    for subspaces in options["subspaces"].split(",")
+                    if item_store.dim % int(subspaces) == 0
+                ]
+            for codec in candidates:
+                start = time.time()
+                codes = codec.fit(vectors).encode(vectors)
+                label = name if name != "pq" else f"pq/{codec.subspaces}"
+                self.stdout.write(
+                    f"{label}: fit and encoded in {time.time() - start:.1f}s"
+                )
+
+                def score():
+                    return codec.scores(codes, queries) * inverse_norms[:, None]
+
+                self._report(label, codes.nbytes / count, count, score(), reference, ks)
+                self._throughput(score, queries)
+
+    def _report(self, name, bytes_per_vector, count, scores, reference, ks):
+        overlaps = []
+        for k in ks:
+            overlap = np.mean(
+                [
+                    len(np.intersect1d(top_k(found, k), top_k(expected, k)))
+                    / min(k, count)
+                    for found, expected in zip(scores.T, reference.T)
+                ]
+            )
+            overlaps.append(f"top-{k} overlap {overlap:.3f}")
+        self.stdout.write(
+            f"{name:10} {bytes_per_vector:7.1f} bytes/vector  "
+            f"{bytes_per_vector * count / 2 ** 20:8.1f}MB here  "
+            f"{bytes_per_vector * 1e6 / 2 ** 30:6.2f}GB per million  "
+            + "  ".join(overlaps)
+        )
+
+    def _throughput(self, score, queries, repeat=3):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            score()
+        elapsed = (time.perf_counter() - start) / repeat
+        self.stdout.write(
+            f"{'':10} {len(queries) / elapsed:9.1f} queries/sec over the catalog"
+        )
@@ -0,0 +1,152 @@
+import json
+import os
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from product.models import Book
+from product.recommenders import evaluation
+from product.recommenders.serving import (
+    BCFNET_CHECKPOINT,
+    BCFNET_CONFIG,
+    load_recommender,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Evaluate the recommenders on the latest interaction of every user "
+        "(HR@k, NDCG@k, MRR, coverage) and the cf_filter latency, as JSON. "
+        "The checkpoints must be trained without those interactions, "
+        "with train_recommender --holdout-last"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--models", default="bcfnet,zeroshot,content")
+        parser.add_argument("--bcfnet-checkpoint", default=BCFNET_CHECKPOINT)
+        parser.add_argument("--zeroshot-checkpoint", default=None)
+        parser.add_argument("--gru-length", type=int, default=20)
+        parser.add_argument("--k", type=int, default=10)
+        parser.add_argument(
+            "--negatives", type=int, default=99, help="Candidates per held-out item"
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=1024, help="Users scored at a time"
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--latency-sizes",
+            default="10,100,1000",
+            help="Candidate set sizes of the cf_filter latency, empty to skip it",
+        )
+        parser.add_argument("--repeat", type=int, default=100)
+        parser.add_argument("--output", default="evaluation.json")
+
+    def handle(self, *args, **options):
+        start = time.time()
+        runner = evaluation.Evaluation(
+            negatives=options["negatives"],
+            k=options["k"],
+            batch_size=options["batch_size"],
+            gru_length=options["gru_length"],
+            seed=options["seed"],
+        )
+        scorers, checkpoints = {}, {}
+        models = options["models"].split(",")
+        if "bcfnet" in models:
+            model = load_recommender(
+                "bcfnet", options["bcfnet_checkpoint"], **BCFNET_CONFIG
+            )
+            model.cache_items(runner.store.vectors)
+            scorers["bcfnet"] = evaluation.bcfnet_scorer(model, options["batch_size"])
+            checkpoints["bcfnet"] = options["bcfnet_checkpoint"]
+        if "zeroshot" in models:
+            model = load_recommender(
+                "zeroshot",
+                options["zeroshot_checkpoint"],
+                gru_length=options["gru_length"],
+            )
+            model.build_index(runner.store.vectors)
+            scorers["zeroshot"] = evaluation.zeroshot_scorer(
+                model, options["batch_size"]
+            )
+            checkpoints["zeroshot"] = options["zeroshot_checkpoint"]
+        if "content" in models:
+            scorers["content"] = evaluation.content_scorer(runner.store)
+
+        metrics = runner.run(scorers)
+        report = {
+            "checkpoints": checkpoints,
+            "split": {
+                "protocol": "leave-last-out",
+                "k": options["k"],
+                "negatives": options["negatives"],
+                "seed": options["seed"],
+                "catalog": len(runner.stream.candidates),
+            },
+            "models": metrics,
+            "cf_filter": self._cf_filter_latency(options),
+        }
+
+        with open(options["output"], "w") as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+        for name, values in metrics.items():
+            self.stdout.write(
+                f"{name:9} "
+                + "  ".join(
+                    f"{metric} {value:.4f}"
+                    for metric, value in values.items()
+                    if metric not in ("users", "seconds")
+                )
+            )
+        for result in report["cf_filter"]:
+            self.stdout.write(
+                f"cf_filter {result['candidates']:6} candidates  "
+                f"p50 {result['p50_ms']:.2f}ms  p95 {result['p95_ms']:.2f}ms  "
+                f"p99 {result['p99_ms']:.2f}ms  "
+                f"{result['items_per_second']:.0f} items/s"
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Wrote {os.path.abspath(options['output'])} "
+                f"({time.time() - start:.1f}s)"
+            )
+        )
+
+    def _cf_filter_latency(self, options):
+        sizes = [int(size) for size in options["latency_sizes"].split(",") if size]
+        if not sizes:
+            return []
+        from product import recommender
+
+        # Books with an embedding, the candidate sets are drawn from them
+        books = np.array(
+            list(
+                Book.objects.filter(
+                    sku__gte=0, sku__lt=len(recommender.store.sku_rows)
+                ).values_list("id", "sku")
+            ),
+            dtype=np.int64,
+        ).reshape(-1, 2)
+        books = books[recommender.store.sku_rows[books[:, 1]] >= 0, 0]
+        rng = np.random.default_rng(options["seed"])
+        profile = rng.random(BCFNET_CONFIG["user_size"])
+
+        results = []
+        for size in sizes:
+            if size > len(books):
+                self.stderr.write(f"Only {len(books)} books, {size} skipped")
+                continue
+            booklist = Book.objects.filter(
+                id__in=rng.choice(books, size, False).tolist()
+            )
+            # Evaluates the query, as the view does
+            result = evaluation.latency(
+                lambda: list(recommender.cf_filter(profile, booklist, num=10)),
+                options["repeat"],
+            )
+            result["candidates"] = size
+            result["items_per_second"] = size * result["calls_per_second"]
+            results.append(result)
+        return results
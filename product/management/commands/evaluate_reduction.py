@@ -0,0 +1,73 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from product.recommenders import reduction, store
+from product.recommenders.ranking import top_k
+
+
+class Command(BaseCommand):
+    help = "Report the top-k overlap and speedup of reduced content similarity"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--store", default=store.STORE_DIR)
+        parser.add_argument("--methods", default="pca,random")
+        parser.add_argument("--dims", default="64,128,256")
+        parser.add_argument("--k", default="10,50")
+        parser.add_argument("--queries", type=int, default=100)
+        parser.add_argument(
+            "--limit", type=int, default=None, help="Only use the first rows"
+        )
+
+    def handle(self, *args, **options):
+        item_store = store.EmbeddingStore(options["store"])
+        count = min(options["limit"] or len(item_store), len(item_store))
+        vectors = np.asarray(item_store.vectors[:count], dtype=np.float32)
+        vectors = vectors * item_store.inverse_norms()[:count, None]
+        rng = np.random.default_rng(0)
+        queries = rng.choice(count, min(options["queries"], count), replace=False)
+        ks = [int(k) for k in options["k"].split(",")]
+
+        reference, full_time = self._score(vectors, queries)
+        self.stdout.write(
+            f"full {item_store.dim}-d: {len(queries) / full_time:.1f} queries/sec"
+        )
+
+        for method in options["methods"].split(","):
+            for dim in [int(dim) for dim in options["dims"].split(",")]:
+                if dim > item_store.dim:
+                    continue
+                start = time.time()
+                projection = reduction.fit_projection(vectors, dim, method)
+                reduced = reduction.project(vectors, projection)
+                norms = np.linalg.norm(reduced, axis=1)
+                reduced /= np.where(norms == 0, 1, norms)[:, None]
+                fit_time = time.time() - start
+
+                scores, reduced_time = self._score(reduced, queries)
+                overlaps = "  ".join(
+                    f"top-{k} overlap {self._overlap(scores, reference, k):.3f}"
+                    for k in ks
+                )
+                self.stdout.write(
+                    f"{method:6} {dim:4}-d  {overlaps}  speedup "
+                    f"{full_time / reduced_time:5.1f}x  (fit {fit_time:.1f}s)"
+                )
+
+    def _score(self, vectors, queries, repeat=3):
+        # Cosine of the queries against the whole catalog, without themselves
+        start = time.perf_counter()
+        for _ in range(repeat):
+            scores = vectors @ vectors[queries].T
+        elapsed = (time.perf_counter() - start) / repeat
+        scores[queries, np.arange(len(queries))] = -np.inf
+        return scores, elapsed
+
+    def _overlap(self, scores, reference, k):
+        return np.mean(
+            [
+                len(np.intersect1d(top_k(found, k), top_k(expected, k))) / k
+                for found, expected in zip(scores.T, reference.T)
+            ]
+        )
@@ -0,0 +1,32 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from product.recommenders.serving import BCFNET_CHECKPOINT, BCFNET_CONFIG
+
+
+class Command(BaseCommand):
+    help = "Export a Keras checkpoint as .npz weights for the NumPy inference engine"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model", choices=["bcfnet", "zeroshot"], default="bcfnet")
+        parser.add_argument("--checkpoint", default=None)
+        parser.add_argument(
+            "--output", default=None, help="Defaults to the checkpoint path with .npz"
+        )
+        parser.add_argument("--gru-length", type=int, default=20)
+
+    def handle(self, *args, **options):
+        from product.recommenders.keras_models import BCFNet, ZeroShot
+
+        if options["model"] == "bcfnet":
+            model = BCFNet(**BCFNET_CONFIG)
+            checkpoint = options["checkpoint"] or BCFNET_CHECKPOINT
+        else:
+            model = ZeroShot(gru_length=options["gru_length"])
+            checkpoint = options["checkpoint"] or model.backup_path
+        model.load(checkpoint)
+
+        output = options["output"] or os.path.splitext(checkpoint)[0] + ".npz"
+        model.export_weights(output)
+        self.stdout.write(self.style.SUCCESS(f"Exported {checkpoint} to {output}"))
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from product.recommenders import reduction, store
+
+
+class Command(BaseCommand):
+    help = "Write a reduced copy of the embedding store (CONTENT_REDUCTION)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--method", choices=reduction.METHODS, default="pca")
+        parser.add_argument("--dim", type=int, default=128)
+        parser.add_argument("--store", default=store.STORE_DIR)
+        parser.add_argument(
+            "--path", default=None, help="Default <store>/<method>_<dim>"
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        start = time.time()
+        path = reduction.reduce_store(
+            options["dim"],
+            options["method"],
+            options["store"],
+            options["path"],
+            options["seed"],
+        )
+        self.stdout.write(
+            self.style.SUCCESS(f"Wrote {path} ({time.time() - start:.1f}s)")
+        )
@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from product.models import Book
+from product.recommenders import store
+from utils.services import product as product_services
+
+
+class Command(BaseCommand):
+    help = (
+        "Embed the books queued on creation or edit and append them to the "
+        "embedding store (EMBEDDING_ENCODER)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--store", default=store.STORE_DIR)
+        parser.add_argument(
+            "--batch-size", type=int, default=1024, help="Books encoded at a time"
+        )
+        parser.add_argument("--limit", type=int, default=None)
+        parser.add_argument(
+            "--missing",
+            action="store_true",
+            help="First queue every book without a sku, e.g. after a bulk import",
+        )
+        parser.add_argument(
+            "--no-indexes",
+            action="store_true",
+            help="Don't update the related table and the IVF index",
+        )
+
+    def handle(self, *args, **options):
+        start = time.time()
+        if options["missing"]:
+            product_services.enqueue_embedding(
+                Book.objects.filter(sku__lt=0).values_list("id", flat=True)
+            )
+        count = product_services.ingest_embedding_queue(
+            batch_size=options["batch_size"],
+            limit=options["limit"],
+            store_path=options["store"],
+            update_indexes=not options["no_indexes"],
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Ingested {count} books into {options['store']} "
+                f"({time.time() - start:.1f}s)"
+            )
+        )
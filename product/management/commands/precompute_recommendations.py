@@ -0,0 +1,194 @@
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+from itertools import islice
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from interaction.models import CATEGORY_SIZE, Interaction, UserProfile
+from product.models import Book, UserRecommendation
+from product.recommenders import batch
+from product.recommenders.serving import weights_file
+from product.recommenders.store import get_store
+from user_account.models import User
+from utils.fields.status import StatusChoices
+from utils.services import recommendation as recommendation_services
+
+THREAD_VARIABLES = (
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "TF_NUM_INTRAOP_THREADS",
+    "TF_NUM_INTEROP_THREADS",
+)
+
+
+class Command(BaseCommand):
+    help = "Precompute the top-N recommendations of every active user"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model", choices=["bcfnet", "zeroshot"], default="bcfnet")
+        parser.add_argument("--checkpoint", default=None)
+        parser.add_argument("--gru-length", type=int, default=20)
+        parser.add_argument("--top", type=int, default=20)
+        parser.add_argument("--chunk-size", type=int, default=256)
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="Scoring processes, 0 to score in this process",
+        )
+        parser.add_argument(
+            "--threads", type=int, default=1, help="BLAS/TensorFlow threads per worker"
+        )
+        parser.add_argument("--start-id", type=int, default=0)
+        parser.add_argument("--end-id", type=int, default=None)
+
+    def handle(self, *args, **options):
+        self.options = options
+        if options["model"] == "zeroshot":
+            self._check_gru_length()
+        self.store = get_store()
+        self.book_of_row = self._book_of_row()
+        candidates = np.flatnonzero(self.book_of_row >= 0)
+        init_args = (
+            options["model"],
+            options["checkpoint"],
+            candidates,
+            options["gru_length"],
+        )
+
+        users = User.objects.filter(
+            status=StatusChoices.ACTIVE, id__gte=options["start_id"]
+        ).order_by("id")
+        if options["end_id"] is not None:
+            users = users.filter(id__lte=options["end_id"])
+        user_ids = users.values_list("id", flat=True).iterator(
+            chunk_size=options["chunk_size"]
+        )
+        chunks = iter(lambda: list(islice(user_ids, options["chunk_size"])), [])
+
+        self.done, self.start = 0, time.time()
+        if not options["workers"]:
+            batch.init_worker(*init_args)
+            for chunk in chunks:
+                self._save(batch.score_chunk(*self._load_chunk(chunk)))
+            return self._report(final=True)
+
+        # Read by the spawned workers before they load NumPy or TensorFlow
+        for variable in THREAD_VARIABLES:
+            os.environ[variable] = str(options["threads"])
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(
+            options["workers"], initializer=batch.init_worker, initargs=init_args
+        ) as pool:
+            # Keep a bounded number of chunks in flight, saved in user id order
+            pending = deque()
+            for chunk in chunks:
+                pending.append(
+                    pool.apply_async(batch.score_chunk, self._load_chunk(chunk))
+                )
+                while len(pending) >= 2 * options["workers"]:
+                    self._save(pending.popleft().get())
+            while pending:
+                self._save(pending.popleft().get())
+        self._report(final=True)
+
+    def _check_gru_length(self):
+        # The NumPy weights keep the gru_length they were exported with
+        path = weights_file(self.options["checkpoint"])
+        if path is None or not path.endswith(".npz"):
+            return
+        with np.load(path) as weights:
+            gru_length = json.loads(str(weights["config"]))["gru_length"]
+        if gru_length != self.options["gru_length"]:
+            raise CommandError(
+                f"{path} is built for --gru-length {gru_length}, "
+                f"not {self.options['gru_length']}"
+            )
+
+    def _book_of_row(self):
+        # Book id of every store row, -1 when no book has the row's sku
+        sku_ids = np.array(
+            list(Book.objects.filter(sku__gte=0).values_list("sku", "id")),
+            dtype=np.int64,
+        ).reshape(-1, 2)
+        sku_ids = sku_ids[sku_ids[:, 0] < len(self.store.sku_rows)]
+        rows = self.store.sku_rows[sku_ids[:, 0]]
+        book_of_row = np.full(len(self.store), -1, dtype=np.int64)
+        book_of_row[rows[rows >= 0]] = sku_ids[rows >= 0, 1]
+        return book_of_row
+
+    def _load_chunk(self, user_ids):
+        position = {user_id: i for i, user_id in enumerate(user_ids)}
+        interactions = Interaction.objects.filter(user_id__in=user_ids)
+
+        rated = np.array(
+            list(
+                interactions.order_by("user_id", "-updated_at").values_list(
+                    "user_id", "book__sku"
+                )
+            ),
+            dtype=np.int64,
+        ).reshape(-1, 2)
+        in_range = (rated[:, 1] >= 0) & (rated[:, 1] < len(self.store.sku_rows))
+        rated = rated[in_range]
+        rated_rows = self.store.sku_rows[rated[:, 1]]
+        rated_rows = [
+            rated_rows[(rated[:, 0] == user_id) & (rated_rows >= 0)]
+            for user_id in user_ids
+        ]
+
+        if self.options["model"] == "bcfnet":
+            user_data = np.zeros((len(user_ids), CATEGORY_SIZE))
+            profiles = UserProfile.objects.filter(user_id__in=user_ids)
+            for profile in profiles:
+                user_data[position[profile.user_id]] = profile.histogram
+            missing = set(user_ids) - {profile.user_id for profile in profiles}
+            for user_id in missing:
+                user_data[position[user_id]] = (
+                    recommendation_services.rebuild_user_profile(user_id).histogram
+                )
+        else:
+            # Newest rated items, oldest first and zero padded at the front
+            length = self.options["gru_length"]
+            user_data = np.zeros((len(user_ids), length, self.store.dim), np.float32)
+            for i, rows in enumerate(rated_rows):
+                rows = rows[:length][::-1]
+                if len(rows):
+                    user_data[i, length - len(rows) :] = self.store.vectors[rows]
+
+        return user_ids, user_data, rated_rows, self.options["top"]
+
+    def _save(self, results):
+        recommendations = [
+            UserRecommendation(
+                user_id=user_id,
+                books=self.book_of_row[rows].tolist(),
+                scores=np.round(scores.astype(float), 6).tolist(),
+            )
+            for user_id, rows, scores in results
+        ]
+        with transaction.atomic():
+            UserRecommendation.objects.filter(
+                user_id__in=[user_id for user_id, _, _ in results]
+            ).delete()
+            UserRecommendation.objects.bulk_create(recommendations)
+        self.done += len(results)
+        self.last_id = results[-1][0] if results else None
+        self._report()
+
+    def _report(self, final=False):
+        elapsed = time.time() - self.start
+        rate = self.done / elapsed if elapsed else 0
+        message = f"{self.done} users, {rate:.1f} users/sec"
+        if getattr(self, "last_id", None) is not None:
+            message += f", resume with --start-id {self.last_id + 1}"
+        if final:
+            self.stdout.write(self.style.SUCCESS(f"Done: {message} ({elapsed:.1f}s)"))
+        else:
+            self.stdout.write(message)
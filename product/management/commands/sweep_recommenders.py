@@ -0,0 +1,162 @@
+import inspect
+import json
+import multiprocessing
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from product.management.commands.precompute_recommendations import THREAD_VARIABLES
+from product.recommenders import sweep
+from product.recommenders.serving import BCFNET_CONFIG
+from product.recommenders.store import META_FILE
+from product.recommenders.training import InteractionStream
+
+DEFAULT_SPACES = {
+    "bcfnet": {
+        "balance_size": [64, 128],
+        "matching_layers": [[256, 128, 64], [512, 256, 128, 64]],
+        "representation_layers": [[256, 128, 64], [512, 256, 128, 64]],
+    },
+    "zeroshot": {"size1": [256, 512], "size2": [128, 256], "gru_length": [10, 20]},
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Train BCFNet or ZeroShot configurations in parallel worker processes "
+        "on one shared training set and rank them in a leaderboard"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model", choices=["bcfnet", "zeroshot"], default="bcfnet")
+        parser.add_argument(
+            "--space",
+            default=None,
+            help='JSON of constructor argument: values, e.g. {"size1": [256, 512]}',
+        )
+        parser.add_argument("--search", choices=["grid", "random"], default="grid")
+        parser.add_argument(
+            "--trials", type=int, default=None, help="Configurations to train"
+        )
+        parser.add_argument("--workers", type=int, default=2)
+        parser.add_argument(
+            "--threads", type=int, default=2, help="BLAS/TensorFlow threads per worker"
+        )
+        parser.add_argument("--epochs", type=int, default=5)
+        parser.add_argument("--batch-size", type=int, default=256)
+        parser.add_argument(
+            "--negative-ratio", type=int, default=4, help="Negatives per interaction"
+        )
+        parser.add_argument(
+            "--validation", type=float, default=0.1, help="Share of users held out"
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", default="./training/sweep")
+        parser.add_argument(
+            "--data",
+            default=None,
+            help="Training set directory, reused when it exists, "
+            "default <output>/data written anew",
+        )
+
+    def handle(self, *args, **options):
+        from product.recommenders.keras_models import BCFNet, ZeroShot
+
+        start = time.time()
+        model_class = BCFNet if options["model"] == "bcfnet" else ZeroShot
+        space = (
+            json.loads(options["space"])
+            if options["space"]
+            else DEFAULT_SPACES[options["model"]]
+        )
+        unknown = set(space) - set(inspect.signature(model_class).parameters)
+        if unknown:
+            raise CommandError(f"Unknown {options['model']} arguments {unknown}")
+        base = BCFNET_CONFIG if options["model"] == "bcfnet" else {}
+        configs = [
+            dict(base, **config)
+            for config in sweep.configurations(
+                space, options["search"], options["trials"], options["seed"]
+            )
+        ]
+
+        os.makedirs(options["output"], exist_ok=True)
+        data_path = options["data"] or os.path.join(options["output"], "data")
+        if not (options["data"] and os.path.exists(os.path.join(data_path, META_FILE))):
+            stream = InteractionStream(
+                options["model"],
+                negative_ratio=options["negative_ratio"],
+                batch_size=options["batch_size"],
+                gru_length=max(space.get("gru_length", [20])),
+                seed=options["seed"],
+            )
+            counts = sweep.write_training_set(
+                stream, data_path, options["validation"], options["seed"]
+            )
+            self.stdout.write(
+                f"Wrote {counts['train']} training and {counts['validation']} "
+                f"validation examples to {data_path} ({time.time() - start:.1f}s)"
+            )
+
+        leaderboard = os.path.join(options["output"], "leaderboard.json")
+        description = {
+            "model": options["model"],
+            "space": space,
+            "search": options["search"],
+            "data": os.path.abspath(data_path),
+            "epochs": options["epochs"],
+            "batch_size": options["batch_size"],
+            "workers": options["workers"],
+            "threads": options["threads"],
+        }
+        trials = [
+            (
+                trial,
+                options["model"],
+                config,
+                data_path,
+                options["output"],
+                options["epochs"],
+                options["batch_size"],
+            )
+            for trial, config in enumerate(configs)
+        ]
+
+        # Read by the spawned workers before they load NumPy or TensorFlow
+        for variable in THREAD_VARIABLES:
+            os.environ[variable] = str(options["threads"])
+        context = multiprocessing.get_context("spawn")
+        results = []
+        with context.Pool(
+            options["workers"],
+            initializer=sweep.init_worker,
+            initargs=(options["threads"],),
+            maxtasksperchild=1,
+        ) as pool:
+            for result in pool.imap_unordered(sweep.run_trial, trials):
+                results.append(result)
+                sweep.write_leaderboard(leaderboard, description, results)
+                self._report(result, len(results), len(trials))
+
+        ranked = sweep.write_leaderboard(leaderboard, description, results)
+        if ranked and "error" not in ranked[0]:
+            self.stdout.write(f"Best: {ranked[0]['config']} {ranked[0]['checkpoint']}")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Wrote {os.path.abspath(leaderboard)} ({time.time() - start:.1f}s)"
+            )
+        )
+
+    def _report(self, result, done, total):
+        if "error" in result:
+            self.stderr.write(
+                f"[{done}/{total}] trial {result['trial']} failed: {result['error']}"
+            )
+            return
+        self.stdout.write(
+            f"[{done}/{total}] trial {result['trial']}  "
+            f"loss {result['loss']:.4f}  "
+            f"val_loss {result.get('val_loss', float('nan')):.4f}  "
+            f"{result['seconds']:.1f}s"
+        )
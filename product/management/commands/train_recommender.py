@@ -0,0 +1,73 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from product.recommenders.serving import BCFNET_CONFIG
+from product.recommenders.training import InteractionStream
+
+
+class Command(BaseCommand):
+    help = "Train BCFNet or ZeroShot on the Interaction table, streamed in chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model", choices=["bcfnet", "zeroshot"], default="bcfnet")
+        parser.add_argument("--epochs", type=int, default=10)
+        parser.add_argument(
+            "--negative-ratio", type=int, default=4, help="Negatives per interaction"
+        )
+        parser.add_argument("--batch-size", type=int, default=256)
+        parser.add_argument(
+            "--chunk-size", type=int, default=65536, help="Interactions read at a time"
+        )
+        parser.add_argument("--gru-length", type=int, default=20)
+        parser.add_argument(
+            "--prefetch", type=int, default=8, help="Batches prepared ahead"
+        )
+        parser.add_argument(
+            "--holdout-last",
+            action="store_true",
+            help="Leave out the interactions evaluate_recommenders holds out",
+        )
+        parser.add_argument("--resume", default=None, help="Start from this checkpoint")
+        parser.add_argument(
+            "--output",
+            default=None,
+            help="Checkpoint to write, default the model's backup path",
+        )
+        parser.add_argument(
+            "--export", action="store_true", help="Also export the .npz weights"
+        )
+
+    def handle(self, *args, **options):
+        from product.recommenders.keras_models import BCFNet, ZeroShot
+
+        start = time.time()
+        if options["model"] == "bcfnet":
+            model = BCFNet(**BCFNET_CONFIG)
+        else:
+            model = ZeroShot(gru_length=options["gru_length"])
+        if options["resume"]:
+            model.load(options["resume"])
+
+        stream = InteractionStream(
+            options["model"],
+            negative_ratio=options["negative_ratio"],
+            batch_size=options["batch_size"],
+            chunk_size=options["chunk_size"],
+            gru_length=options["gru_length"],
+            prefetch=options["prefetch"],
+            holdout_last=options["holdout_last"],
+        )
+        model.fit(stream.dataset(), None, epochs=options["epochs"])
+
+        output = options["output"] or model.backup_path
+        model.store(output)
+        if options["export"]:
+            model.export_weights(os.path.splitext(output)[0] + ".npz")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Trained {options['model']} for {options['epochs']} epochs, "
+                f"saved to {output} ({time.time() - start:.1f}s)"
+            )
+        )
@@ -0,0 +1,31 @@
+# Generated by Django 3.1.3 on 2026-10-17 22:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+import utils.fields.status
+import utils.fields.timestamp
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0002_userrecommendation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmbeddingJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uid', models.UUIDField(default=uuid.uuid4, editable=False, unique=True)),
+                ('status', utils.fields.status.StatusField(choices=[('A', 'Active'), ('W', 'Watting'), ('R', 'Remove')], default='W', max_length=1)),
+                ('created_at', utils.fields.timestamp.TimeStamp(auto_now_add=True)),
+                ('updated_at', utils.fields.timestamp.TimeStamp(auto_now=True)),
+                ('book', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='embedding_job', to='product.book')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.1.3 on 2026-10-17 22:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0003_embeddingjob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['rating_count', 'id'], name='book_rating_count_id'),
+        ),
+    ]
@@ -1,6 +1,7 @@
 from django.db import models
 
 from utils.model import BaseModel
+from user_account.models import User
 
 from django.core import exceptions
 
@@ -54,6 +55,25 @@ class Book(BaseModel):
 
     sku = models.IntegerField(default=-1)
 
+    # Fields encoded into the embedding, see `embedding_text`
+    EMBEDDING_FIELDS = ('name', 'short_description', 'description')
+
+    class Meta:
+        indexes = [
+            # Order of the catalog listing, see KeysetPagination
+            models.Index(fields=['rating_count', 'id'], name='book_rating_count_id'),
+        ]
+
+    @property
+    def embedding_text(self):
+        """
+        Text encoded into the embedding of the book, None when not loaded
+        """
+        fields = self.EMBEDDING_FIELDS
+        if not all(name in self.__dict__ for name in fields):
+            return None
+        return '\n'.join(getattr(self, name) for name in fields if getattr(self, name))
+
     @property
     def rating(self):
         return (self.rating_sum // self.rating_count) if (self.rating_count > 0) else 0
@@ -73,3 +93,31 @@ class Image(BaseModel):
 
     def __str__(self):
         return self.description
+
+
+class EmbeddingJob(BaseModel):
+    """
+    Book waiting for its embedding, consumed by `ingest_embeddings`
+    """
+
+    book = models.OneToOneField(to=Book, on_delete=models.CASCADE, related_name='embedding_job')
+
+    def __str__(self):
+        return str(self.book)
+
+
+class UserRecommendation(BaseModel):
+    """
+    Top-N books of a user, precomputed offline by `precompute_recommendations`
+    """
+
+    user = models.OneToOneField(
+        to=User, on_delete=models.CASCADE, related_name='recommendation'
+    )
+
+    # Ranked Book ids and their scores, best first
+    books = models.JSONField(default=list)
+    scores = models.JSONField(default=list)
+
+    def __str__(self):
+        return str(self.user)
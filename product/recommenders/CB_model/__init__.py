@@ -1,59 +1,112 @@
-# import pandas as pd
-from pandas import read_csv
-
-# from sklearn.metrics.pairwise import cosine_similarity  # linear_kernel
+import os
 
 import numpy as np
-DATA_KEY = "proccessed"
-DATA_FILE = "./product/recommenders/bert_with_description_field.csv"
-
+from django.conf import settings
 
-def to_numpy(x):
-    return np.fromstring(x[3:-2].replace("\n", ""), sep=" ")
+from ..ranking import rank_queryset, top_k
+from ..store import STORE_DIR, get_store
 
 
 class CB_MODEL(object):
-    def __init__(self, threshold=0.5):
-        self._dataset = read_csv(DATA_FILE)
-        self._dataset[DATA_KEY] = self._dataset[DATA_KEY].apply(to_numpy)
-        self._threshold = threshold
+    """
+    Content based filter, cosine similarity over the BERT item embeddings.
+    """
+
+    def __init__(self, block_size=16384, codec=None, path=STORE_DIR):
+        """
+        :param codec: compute the similarities on this compressed copy of the store
+        :param path: embedding store, e.g. a reduced one written by `fit_reduction`
+        """
+        self._path = path
+        self._codec = codec
+        self._block_size = block_size
+
+    def load(self):
+        """
+        Open the store and compute its inverse norms, otherwise done by the
+        first call. The memmapped matrix itself is never copied.
+        """
+        self._store.inverse_norms()
+        return self
+
+    @property
+    def _store(self):
+        # The latest store, it changes when books are ingested
+        return get_store(self._path, codec=self._codec)
 
     def __str__(self):
-        return len(self._dataset)
+        return str(len(self._store))
 
     def get_item_vector_by_uid(self, items):
 
-        # Get the table of item
+        # Get the vectors of the items
         # :param items: The list of items (type is product.Models.Book)
-        # :return: Table (with 2 column (id, feature)) of the items
-        return self._dataset[
-            self._dataset["id"].isin(items.values_list("sku", flat=True))
-        ]
-
-    def _similarity(self, v_base_items, v_compare_items):
-        return []
-        # return cosine_similarity(v_base_items, v_compare_items)
-
-    def run(self, rate_items, target_items):
-        v_rate_items = self.get_item_vector_by_uid(rate_items)
-        v_target_items = self.get_item_vector_by_uid(target_items)
-
-        # Implement the CB filter here
-
-        rate_vector = np.array(v_rate_items.feature.to_list())
-        target_vector = np.array(v_target_items.feature.to_list())
-        print(rate_vector)
-        print(target_vector)
-        index = self._similarity(rate_vector, target_vector).flatten().argsort()[::-1]
-
-        # ordering = 'FIELD(`sku`, %s)' % ','.join(str(id) for id in index)
-        skus = v_target_items.iloc[index].id.to_list()
-        clauses = " ".join(
-            ["WHEN sku=%s THEN %s" % (pk, i) for i, pk in enumerate(skus)]
+        # :return: (skus, vectors) of the items that have an embedding
+        return self._store.lookup(items.values_list("sku", flat=True))
+
+    def _similarity(self, base_rows, target_rows, aggregate="mean"):
+        """
+        Cosine similarity of every target item to the base items.
+
+        The targets are scored block by block, so the memory stays bounded by
+        `block_size` rows whatever the number of targets.
+
+        :param base_rows: store rows of the base items, e.g. the rated books
+        :param target_rows: store rows of the candidates
+        :param aggregate: "mean" or "max" similarity over the base items
+        :return: (len(target_rows),) scores
+        """
+        if aggregate not in ("mean", "max"):
+            raise ValueError(f"Unknown aggregate {aggregate}")
+        target_rows = np.asarray(target_rows)
+        scores = np.zeros(len(target_rows), dtype=np.float32)
+        if len(base_rows) == 0:
+            return scores
+        base = self._store.normalized(np.asarray(base_rows))
+        if aggregate == "mean":
+            # The mean of the dot products is the dot product with the mean
+            base = base.mean(axis=0, keepdims=True)
+        base = np.asarray(base, dtype=np.float32)
+
+        for start in range(0, len(target_rows), self._block_size):
+            rows = target_rows[start : start + self._block_size]
+            similarity = self._store.dot(rows, base)
+            scores[start : start + len(rows)] = similarity.max(axis=1)
+        return scores
+
+    def run(
+        self, rate_items, target_items, num=None, with_scores=False, aggregate="mean"
+    ):
+        """
+        Rank the target items by their similarity to the rated items.
+
+        :param rate_items: queryset of the books to compare with
+        :param target_items: queryset of the candidates
+        :param num: number of items to keep, None to rank every candidate
+        :param aggregate: "mean" or "max" similarity over the rated items
+        """
+        _, rate_rows = self._store.rows_for(rate_items.values_list("sku", flat=True))
+        target_skus, target_rows = self._store.rows_for(
+            target_items.values_list("sku", flat=True)
         )
-        ordering = "CASE %s END" % clauses
+        if len(target_rows) == 0:
+            return target_items.none()
 
-        return target_items.extra(select={"ordering": ordering}, order_by=("ordering",))
+        scores = self._similarity(rate_rows, target_rows, aggregate)
+        index = top_k(scores, num)
+
+        return rank_queryset(
+            target_items,
+            target_skus[index].tolist(),
+            scores[index] if with_scores else None,
+        )
 
 
-cb = CB_MODEL()
+cb = CB_MODEL(
+    codec=settings.EMBEDDING_CODEC,
+    path=(
+        os.path.join(STORE_DIR, settings.CONTENT_REDUCTION)
+        if settings.CONTENT_REDUCTION
+        else STORE_DIR
+    ),
+)
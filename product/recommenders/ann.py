@@ -0,0 +1,277 @@
+"""
+Inverted file (IVF) index for approximate nearest neighbour search.
+
+The vectors are clustered with k-means, and every vector is listed under
+its closest centroid. A query only scores the vectors of the `nprobe`
+lists whose centroids match it best, so the cost is about
+nprobe / nlist of a brute-force scan.
+
+The index keeps only the centroids and the lists of rows. The vectors stay
+in the matrix they came from (the embedding store or a model's item
+index), which is given again when the index is loaded.
+"""
+import json
+import os
+import time
+
+import numpy as np
+
+from .ranking import top_k
+from .store import STORE_DIR
+
+IVF_DIR = os.path.join(STORE_DIR, "ivf")
+CENTROIDS_FILE = "centroids.npy"
+ROWS_FILE = "rows.npy"
+OFFSETS_FILE = "offsets.npy"
+META_FILE = "meta.json"
+
+
+def _blocks(count, block_size):
+    for start in range(0, count, block_size):
+        yield start, min(start + block_size, count)
+
+
+def kmeans(data, k, iterations=10, seed=0, spherical=True, block_size=16384):
+    """
+    Lloyd's k-means, on unit vectors (cosine) when `spherical`.
+
+    :param data: (n, d) float32 training vectors, already normalized if spherical
+    :return: (k, d) float32 centroids
+    """
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), k, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = _assign(data, centroids, spherical, block_size)
+        order = np.argsort(assignment, kind="stable")
+        counts = np.bincount(assignment, minlength=k)
+        # Sum of the members of every cluster, from the data sorted by cluster
+        sums = np.zeros_like(centroids)
+        present = counts > 0
+        sums[present] = np.add.reduceat(
+            data[order], np.cumsum(counts)[present] - counts[present]
+        )
+        empty = counts == 0
+        # Restart the empty clusters from random points
+        sums[empty] = data[rng.choice(len(data), empty.sum(), replace=False)]
+        counts[empty] = 1
+        centroids = sums / counts[:, None]
+        if spherical:
+            centroids /= np.maximum(np.linalg.norm(centroids, axis=1), 1e-12)[:, None]
+    return centroids.astype(np.float32)
+
+
+def _assign(data, centroids, spherical=True, block_size=16384):
+    # Closest centroid: highest dot product on the sphere, lowest L2 otherwise
+    bias = 0 if spherical else -0.5 * (centroids ** 2).sum(axis=1)
+    assignment = np.empty(len(data), dtype=np.int64)
+    for start, stop in _blocks(len(data), block_size):
+        scores = np.asarray(data[start:stop], dtype=np.float32) @ centroids.T + bias
+        assignment[start:stop] = scores.argmax(axis=1)
+    return assignment
+
+
+class IVFIndex(object):
+    """
+    :param vectors: (n, d) matrix searched by the index, may be a memmap
+    :param metric: "cosine" or "dot"
+    :param inverse_norms: 1 / norm of every row for "cosine", computed if None
+    """
+
+    def __init__(self, vectors, metric="cosine", inverse_norms=None):
+        if metric not in ("cosine", "dot"):
+            raise ValueError(f"Unknown metric {metric}")
+        self.vectors = vectors
+        self.metric = metric
+        self.inverse_norms = None
+        if metric == "cosine":
+            if inverse_norms is None:
+                norms = np.concatenate(
+                    [
+                        np.linalg.norm(vectors[start:stop], axis=1)
+                        for start, stop in _blocks(len(vectors), 16384)
+                    ]
+                    or [np.zeros(0)]
+                )
+                norms[norms == 0] = np.inf
+                inverse_norms = 1 / norms
+            self.inverse_norms = np.asarray(inverse_norms, dtype=np.float32)
+        self.centroids = None
+        self.rows = None
+        self.offsets = None
+        self.nprobe = 1
+
+    def __len__(self):
+        return 0 if self.rows is None else len(self.rows)
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    def _prepare(self, rows):
+        vectors = np.asarray(self.vectors[rows], dtype=np.float32)
+        if self.metric == "cosine":
+            vectors *= self.inverse_norms[rows, None]
+        return vectors
+
+    def train(self, nlist=None, iterations=10, sample_size=None, seed=0):
+        """
+        Learn the centroids on a sample and list every vector.
+
+        :param nlist: number of lists, default about 4 * sqrt(n)
+        :param sample_size: training vectors, default 32 per list
+        """
+        count = len(self.vectors)
+        nlist = min(nlist or int(4 * np.sqrt(count)) or 1, count)
+        sample_size = min(sample_size or 32 * nlist, count)
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(count, sample_size, replace=False))
+        self.centroids = kmeans(
+            self._prepare(sample),
+            nlist,
+            iterations,
+            seed,
+            spherical=self.metric == "cosine",
+        )
+        self._list(np.arange(count))
+        return self
+
+    def _list(self, rows):
+        assignment = np.concatenate(
+            [
+                _assign(
+                    self._prepare(rows[start:stop]),
+                    self.centroids,
+                    spherical=self.metric == "cosine",
+                )
+                for start, stop in _blocks(len(rows), 16384)
+            ]
+            or [np.zeros(0, dtype=np.int64)]
+        )
+        order = np.argsort(assignment, kind="stable")
+        self.rows = rows[order].astype(np.int32)
+        self.offsets = np.zeros(self.nlist + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=self.nlist), out=self.offsets[1:])
+
+    def add(self, rows, inverse_norms=None, vectors=None):
+        """
+        List rows appended to the matrix since training, without retraining.
+
+        :param vectors: the matrix with the rows appended, when the index was
+            loaded with the old one
+        """
+        if vectors is not None:
+            self.vectors = vectors
+        if inverse_norms is not None:
+            self.inverse_norms = np.asarray(inverse_norms, dtype=np.float32)
+        lists = np.repeat(np.arange(self.nlist), np.diff(self.offsets))
+        rows = np.asarray(rows, dtype=np.int32)
+        assignment = _assign(
+            self._prepare(rows), self.centroids, spherical=self.metric == "cosine"
+        )
+        lists = np.concatenate([lists, assignment])
+        all_rows = np.concatenate([self.rows, rows])
+        order = np.argsort(lists, kind="stable")
+        self.rows = all_rows[order]
+        self.offsets[1:] = np.cumsum(np.bincount(lists, minlength=self.nlist))
+
+    def search(self, query, k=10, nprobe=None):
+        """
+        :param query: (d,) query vector
+        :param nprobe: lists to scan, default `self.nprobe`
+        :return: (rows, scores) of the k best rows found, best first
+        """
+        query = np.asarray(query, dtype=np.float32)
+        if self.metric == "cosine":
+            query = query / max(np.linalg.norm(query), 1e-12)
+        probes = top_k(self.centroids @ query, nprobe or self.nprobe)
+        candidates = np.concatenate(
+            [
+                self.rows[self.offsets[probe] : self.offsets[probe + 1]]
+                for probe in probes
+            ]
+        )
+        scores = self._prepare(candidates) @ query
+        best = top_k(scores, k)
+        return candidates[best], scores[best]
+
+    def exact(self, query, k=10, block_size=65536):
+        """
+        Brute-force `search`, the reference for the recall
+        """
+        query = np.asarray(query, dtype=np.float32)
+        if self.metric == "cosine":
+            query = query / max(np.linalg.norm(query), 1e-12)
+        scores = np.concatenate(
+            [
+                self._prepare(np.arange(start, stop)) @ query
+                for start, stop in _blocks(len(self.vectors), block_size)
+            ]
+        )
+        best = top_k(scores, k)
+        return best, scores[best]
+
+    def recall(self, queries, k=10, nprobe=None, truth=None):
+        """
+        Mean recall@k of `search` against `exact` over the queries.
+
+        :param truth: exact top-k rows of the queries, computed if None
+        :return: (recall, latencies in ms)
+        """
+        if truth is None:
+            truth = [self.exact(query, k)[0] for query in queries]
+        hits, latencies = [], []
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            found, _ = self.search(query, k, nprobe)
+            latencies.append((time.perf_counter() - start) * 1000)
+            hits.append(len(np.intersect1d(found, expected)) / max(len(expected), 1))
+        return float(np.mean(hits)), np.array(latencies)
+
+    def tune(self, queries, k=10, target_recall=0.95):
+        """
+        Set `nprobe` to the smallest power of two that reaches the target recall.
+
+        :return: (nprobe, recall)
+        """
+        truth = [self.exact(query, k)[0] for query in queries]
+        nprobe = 1
+        while True:
+            recall, _ = self.recall(queries, k, nprobe, truth)
+            if recall >= target_recall or nprobe >= self.nlist:
+                self.nprobe = min(nprobe, self.nlist)
+                return self.nprobe, recall
+            nprobe *= 2
+
+    def save(self, path=IVF_DIR):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, CENTROIDS_FILE), self.centroids)
+        np.save(os.path.join(path, ROWS_FILE), self.rows)
+        np.save(os.path.join(path, OFFSETS_FILE), self.offsets)
+        with open(os.path.join(path, META_FILE), "w") as meta:
+            json.dump(
+                {
+                    "count": len(self),
+                    "nlist": self.nlist,
+                    "nprobe": self.nprobe,
+                    "metric": self.metric,
+                },
+                meta,
+            )
+
+    @classmethod
+    def load(cls, vectors, path=IVF_DIR, inverse_norms=None):
+        """
+        :param vectors: the matrix the index was built on
+        """
+        with open(os.path.join(path, META_FILE)) as meta:
+            meta = json.load(meta)
+        index = cls(vectors, meta["metric"], inverse_norms)
+        index.centroids = np.load(os.path.join(path, CENTROIDS_FILE))
+        index.rows = np.load(os.path.join(path, ROWS_FILE))
+        index.offsets = np.load(os.path.join(path, OFFSETS_FILE))
+        index.nprobe = meta["nprobe"]
+        if meta["count"] != len(vectors):
+            raise ValueError(
+                f"Index of {meta['count']} rows for a matrix of {len(vectors)} rows"
+            )
+        return index
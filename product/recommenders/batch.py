@@ -0,0 +1,97 @@
+"""
+Worker side of `precompute_recommendations`.
+
+The functions here run in spawned processes, so this module must not import
+Django models or TensorFlow at import time.
+"""
+import numpy as np
+
+from .ranking import top_k, top_k_rows
+
+# Bound of the (user, candidate) pairs scored in one forward pass, every pair
+# gathers its item activations
+MAX_PAIRS = 1 << 18
+
+_model = None
+_model_name = None
+_candidates = None
+
+
+def init_worker(model_name, checkpoint, candidates, gru_length=20):
+    """
+    Load the model once per worker process.
+
+    :param model_name: "bcfnet" or "zeroshot"
+    :param checkpoint: checkpoint or .npz weights to load, None for the deployed one
+    :param candidates: store rows that may be recommended
+    :param gru_length: history length of the zeroshot user input
+    """
+    global _model, _model_name, _candidates
+    import django
+
+    django.setup()
+
+    from product import recommender
+
+    if model_name == "bcfnet":
+        _model = recommender.bcfRecommender
+        if checkpoint:
+            _model = recommender.load_recommender(
+                "bcfnet", checkpoint, **recommender.BCFNET_CONFIG
+            )
+            _model.cache_items(recommender.store.vectors)
+    else:
+        _model = recommender.load_recommender(
+            "zeroshot", checkpoint, gru_length=gru_length
+        )
+        _model.build_index(recommender.store.vectors)
+    _model_name = model_name
+    _candidates = candidates
+
+
+def score_chunk(user_ids, user_data, rated_rows, top):
+    """
+    :param user_ids: ids of the users of the chunk
+    :param user_data: (n, 100) category counts for bcfnet,
+        (n, gru_length, 768) histories for zeroshot
+    :param rated_rows: store rows already rated by every user
+    :param top: number of items to keep per user
+    :return: list of (user_id, rows, scores), best first
+    """
+    if _model_name == "bcfnet":
+        return _score_bcfnet(user_ids, user_data, rated_rows, top)
+
+    scores = _model.score_users(user_data, batch_size=len(user_data))[:, _candidates]
+    for i, rated in enumerate(rated_rows):
+        scores[i, np.isin(_candidates, rated)] = -np.inf
+    best = top_k_rows(scores, top)
+    return [
+        _finite(user_id, _candidates[rows], user_scores[rows])
+        for user_id, rows, user_scores in zip(user_ids, best, scores)
+    ]
+
+
+def _score_bcfnet(user_ids, user_data, rated_rows, top):
+    totals = user_data.sum(axis=1, keepdims=True)
+    user_input = user_data / np.where(totals > 0, totals, 1)
+    # The whole chunk in one call, unless the pairs would not fit in memory
+    group = max(1, MAX_PAIRS // max(len(_candidates), 1))
+    results = []
+    for start in range(0, len(user_ids), group):
+        scores = _model.predict_cached_many(
+            [(user, _candidates) for user in user_input[start : start + group]],
+            batch_size=8192,
+        )
+        for user_id, user_scores, rated in zip(
+            user_ids[start : start + group], scores, rated_rows[start : start + group]
+        ):
+            user_scores[np.isin(_candidates, rated)] = -np.inf
+            best = top_k(user_scores, top)
+            results.append(_finite(user_id, _candidates[best], user_scores[best]))
+    return results
+
+
+def _finite(user_id, rows, scores):
+    # Rated items are scored -inf, drop them when there are not enough candidates
+    keep = np.isfinite(scores)
+    return user_id, rows[keep], scores[keep]
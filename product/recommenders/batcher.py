@@ -0,0 +1,121 @@
+"""
+Micro-batching of concurrent inference requests.
+
+Requests submitted from several threads within `window` seconds (or until
+`max_batch_size` requests are waiting) are handed to `batch_function` as one
+list, so the model runs a single stacked forward pass for all of them.
+"""
+import logging
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher(object):
+    """
+    :param batch_function: called with a list of argument tuples, returns
+        the list of results in the same order
+    :param window: seconds to wait for more requests after the first one
+    :param max_batch_size: run as soon as this many requests are waiting
+    :param log_every: log the metrics every this many batches, 0 to disable
+    """
+
+    def __init__(self, batch_function, window=0.003, max_batch_size=32, log_every=1000):
+        self.batch_function = batch_function
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.log_every = log_every
+        self.batch_sizes = Counter()
+        self.wait_times = deque(maxlen=10000)
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def submit(self, *args):
+        """
+        Queue one request and return a Future of its result
+        """
+        future = Future()
+        with self._condition:
+            if self._thread is None or not self._thread.is_alive():
+                # Started lazily, so it also exists in forked server workers
+                self._thread = threading.Thread(
+                    target=self._run, name="micro-batcher", daemon=True
+                )
+                self._thread.start()
+            self._queue.append((time.perf_counter(), args, future))
+            self._condition.notify()
+        return future
+
+    def __call__(self, *args):
+        return self.submit(*args).result()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                deadline = self._queue[0][0] + self.window
+                while len(self._queue) < self.max_batch_size:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch = [
+                    self._queue.popleft()
+                    for _ in range(min(len(self._queue), self.max_batch_size))
+                ]
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        start = time.perf_counter()
+        with self._condition:
+            # Read by `metrics` from the request threads
+            self.batch_sizes[len(batch)] += 1
+            self.wait_times.extend(start - queued for queued, _, _ in batch)
+            batches = sum(self.batch_sizes.values())
+        try:
+            results = list(self.batch_function([args for _, args, _ in batch]))
+            if len(results) != len(batch):
+                # Pairing them would leave some futures waiting forever
+                raise ValueError(
+                    f"batch_function returned {len(results)} results "
+                    f"for {len(batch)} requests"
+                )
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+        else:
+            for (_, _, future), result in zip(batch, results):
+                future.set_result(result)
+        if self.log_every and batches % self.log_every == 0:
+            logger.info("Micro-batcher: %s", self.metrics())
+
+    def metrics(self):
+        """
+        Batch size distribution and queue wait percentiles (ms) so far
+        """
+        with self._condition:
+            batch_sizes = dict(self.batch_sizes)
+            waits = np.array(self.wait_times) * 1000
+        batches = sum(batch_sizes.values())
+        requests = sum(size * count for size, count in batch_sizes.items())
+        return {
+            "batches": batches,
+            "requests": requests,
+            "mean_batch_size": requests / batches if batches else 0,
+            "batch_sizes": dict(sorted(batch_sizes.items())),
+            "wait_ms": dict(
+                zip(
+                    ("p50", "p95", "p99"),
+                    np.percentile(waits, [50, 95, 99]).round(3).tolist()
+                    if len(waits)
+                    else (0, 0, 0),
+                )
+            ),
+        }
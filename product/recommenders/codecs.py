@@ -0,0 +1,306 @@
+"""
+Compressed forms of the item embedding matrix.
+
+Every codec encodes (n, dim) float32 vectors into compact codes and scores
+codes against queries without decoding the whole matrix:
+
+- float16: 2 bytes per value
+- int8: per-dimension scalar quantization, 1 byte per value
+- pq: product quantization, 1 byte per `dim / subspaces` values, scored
+  with asymmetric distance computation (a lookup table per query)
+
+`compress_store` writes a compressed copy of the embedding store that
+`CompressedStore` serves with the `EmbeddingStore` interface.
+"""
+import json
+import os
+import time
+
+import numpy as np
+
+from .ann import kmeans
+from .store import (
+    META_FILE,
+    SKUS_FILE,
+    STORE_DIR,
+    EmbeddingStore,
+    meta_version,
+    write_meta,
+)
+
+CODES_FILE = "codes.npy"
+CODEC_FILE = "codec.npz"
+NORMS_FILE = "inverse_norms.npy"
+
+
+class Float16Codec(object):
+    name = "float16"
+
+    def fit(self, vectors):
+        return self
+
+    def encode(self, vectors):
+        return np.asarray(vectors, dtype=np.float16)
+
+    def decode(self, codes):
+        return np.asarray(codes, dtype=np.float32)
+
+    def scores(self, codes, queries):
+        """
+        :param codes: (n, ...) codes
+        :param queries: (q, dim) float32 queries
+        :return: (n, q) dot products of the encoded vectors with the queries
+        """
+        return self.decode(codes) @ queries.T
+
+    def params(self):
+        return {}
+
+    def load_params(self, params):
+        return self
+
+
+class Int8Codec(Float16Codec):
+    name = "int8"
+
+    def fit(self, vectors, block_size=16384):
+        low = np.full(vectors.shape[1], np.inf, dtype=np.float32)
+        high = np.full(vectors.shape[1], -np.inf, dtype=np.float32)
+        for start in range(0, len(vectors), block_size):
+            block = np.asarray(vectors[start : start + block_size], dtype=np.float32)
+            low = np.minimum(low, block.min(axis=0))
+            high = np.maximum(high, block.max(axis=0))
+        self.scale = np.maximum(high - low, 1e-12) / 255
+        # Value of the code 0
+        self.offset = low + 128 * self.scale
+        return self
+
+    def encode(self, vectors):
+        codes = np.rint((np.asarray(vectors, np.float32) - self.offset) / self.scale)
+        return np.clip(codes, -128, 127).astype(np.int8)
+
+    def decode(self, codes):
+        return codes.astype(np.float32) * self.scale + self.offset
+
+    def scores(self, codes, queries):
+        # codes * scale + offset, folded into the queries
+        scores = codes.astype(np.float32) @ (queries * self.scale).T
+        return scores + queries @ self.offset
+
+    def params(self):
+        return {"scale": self.scale, "offset": self.offset}
+
+    def load_params(self, params):
+        self.scale, self.offset = params["scale"], params["offset"]
+        return self
+
+
+class PQCodec(Float16Codec):
+    """
+    :param subspaces: number of sub-vectors, each coded on one byte
+    """
+
+    name = "pq"
+
+    def __init__(self, subspaces=96, iterations=10, sample_size=65536, seed=0):
+        self.subspaces = subspaces
+        self.iterations = iterations
+        self.sample_size = sample_size
+        self.seed = seed
+
+    def _split(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        return vectors.reshape(len(vectors), self.subspaces, -1)
+
+    def fit(self, vectors):
+        if vectors.shape[1] % self.subspaces:
+            raise ValueError(
+                f"{vectors.shape[1]}-d vectors can't be split in {self.subspaces}"
+            )
+        rng = np.random.default_rng(self.seed)
+        size = min(self.sample_size, len(vectors))
+        sample = self._split(vectors[np.sort(rng.choice(len(vectors), size, False))])
+        clusters = min(256, size)
+        self.codebooks = np.stack(
+            [
+                kmeans(
+                    np.ascontiguousarray(sample[:, j]),
+                    clusters,
+                    self.iterations,
+                    self.seed,
+                    spherical=False,
+                )
+                for j in range(self.subspaces)
+            ]
+        )
+        return self
+
+    def encode(self, vectors):
+        vectors = self._split(vectors)
+        codes = np.empty(vectors.shape[:2], dtype=np.uint8)
+        for j, codebook in enumerate(self.codebooks):
+            # Nearest centroid: argmax of x.c - |c|^2 / 2
+            scores = vectors[:, j] @ codebook.T - 0.5 * (codebook ** 2).sum(axis=1)
+            codes[:, j] = scores.argmax(axis=1)
+        return codes
+
+    def decode(self, codes):
+        codes = np.asarray(codes)
+        vectors = self.codebooks[np.arange(self.subspaces), codes]
+        return vectors.reshape(len(codes), -1)
+
+    def scores(self, codes, queries):
+        # Asymmetric distance: the dot products of every query sub-vector with
+        # every centroid, then one table lookup per code
+        codes = np.asarray(codes)
+        tables = np.einsum("qjd,jcd->jcq", self._split(queries), self.codebooks)
+        scores = np.zeros((len(codes), len(queries)), dtype=np.float32)
+        for j, table in enumerate(tables):
+            scores += table[codes[:, j]]
+        return scores
+
+    def params(self):
+        return {"codebooks": self.codebooks}
+
+    def load_params(self, params):
+        self.codebooks = params["codebooks"]
+        self.subspaces = len(self.codebooks)
+        return self
+
+
+CODECS = {codec.name: codec for codec in (Float16Codec, Int8Codec, PQCodec)}
+
+
+def compress_store(codec, store_path=STORE_DIR, path=None, block_size=16384):
+    """
+    Fit `codec` on the store and write the codes to `path`.
+
+    :param codec: codec instance, e.g. `PQCodec(subspaces=96)`
+    :param path: directory of the compressed store, default `<store>/<codec>`
+    :return: the compressed directory
+    """
+    source = EmbeddingStore(store_path)
+    path = path or os.path.join(store_path, codec.name)
+    os.makedirs(path, exist_ok=True)
+    codec.fit(source.vectors)
+
+    codes = None
+    for start in range(0, len(source), block_size):
+        block = codec.encode(source.vectors[start : start + block_size])
+        if codes is None:
+            codes = np.lib.format.open_memmap(
+                os.path.join(path, CODES_FILE),
+                mode="w+",
+                dtype=block.dtype,
+                shape=(len(source),) + block.shape[1:],
+            )
+        codes[start : start + len(block)] = block
+    if codes is not None:
+        codes.flush()
+
+    np.savez(os.path.join(path, CODEC_FILE), **codec.params())
+    # Cosine uses the norms of the original vectors
+    np.save(os.path.join(path, NORMS_FILE), source.inverse_norms())
+    np.save(os.path.join(path, SKUS_FILE), source.skus)
+    with open(os.path.join(path, META_FILE), "w") as meta:
+        json.dump(dict(source.meta, codec=codec.name, built_at=time.time()), meta)
+    return path
+
+
+def append_compressed(path, skus, vectors, block_size=16384):
+    """
+    Encode rows with the fitted codec and append them to a compressed store,
+    the counterpart of `store.append_store`.
+
+    The codes are copied to a new file, so the stores opened before keep
+    their mapping.
+
+    :return: store rows of the appended vectors
+    """
+    with open(os.path.join(path, META_FILE)) as meta:
+        meta = json.load(meta)
+    with np.load(os.path.join(path, CODEC_FILE)) as params:
+        codec = CODECS[meta["codec"]]().load_params(dict(params))
+    vectors = np.asarray(vectors, dtype=np.float32)
+    count = meta["count"]
+    old_codes = np.load(os.path.join(path, CODES_FILE), mmap_mode="r")[:count]
+    new_codes = codec.encode(vectors)
+
+    tmp_path = os.path.join(path, CODES_FILE + ".tmp.npy")
+    codes = np.lib.format.open_memmap(
+        tmp_path,
+        mode="w+",
+        dtype=new_codes.dtype,
+        shape=(count + len(vectors),) + new_codes.shape[1:],
+    )
+    for start in range(0, count, block_size):
+        stop = min(start + block_size, count)
+        codes[start:stop] = old_codes[start:stop]
+    codes[count:] = new_codes
+    codes.flush()
+    del codes
+    os.replace(tmp_path, os.path.join(path, CODES_FILE))
+
+    norms = np.linalg.norm(vectors, axis=1)
+    norms[norms == 0] = np.inf
+    for name, dtype, rows in (
+        (NORMS_FILE, np.float32, 1 / norms),
+        (SKUS_FILE, np.int64, skus),
+    ):
+        array = np.load(os.path.join(path, name))[:count]
+        tmp_path = os.path.join(path, name + ".tmp.npy")
+        np.save(tmp_path, np.concatenate([array, np.asarray(rows, dtype=dtype)]))
+        os.replace(tmp_path, os.path.join(path, name))
+
+    meta["count"] = count + len(vectors)
+    meta["generation"] = meta.get("generation", 0) + 1
+    write_meta(path, meta)
+    return np.arange(count, count + len(vectors))
+
+
+class DecodedView(object):
+    """
+    Array-like access to compressed vectors, decoded on indexing
+    """
+
+    def __init__(self, codes, codec, dim):
+        self.codes = codes
+        self.codec = codec
+        self.shape = (len(codes), dim)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, rows):
+        return self.codec.decode(self.codes[rows])
+
+
+class CompressedStore(EmbeddingStore):
+    """
+    `EmbeddingStore` over the codes written by `compress_store`.
+
+    `vectors` decodes the rows it is indexed with, and `dot` scores the codes
+    directly.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.version = meta_version(path)
+        with open(os.path.join(path, META_FILE)) as meta:
+            self.meta = json.load(meta)
+        count = self.meta["count"]
+        self.skus = np.load(os.path.join(path, SKUS_FILE))[:count]
+        with np.load(os.path.join(path, CODEC_FILE)) as params:
+            self.codec = CODECS[self.meta["codec"]]().load_params(dict(params))
+        self.codes = np.load(os.path.join(path, CODES_FILE), mmap_mode="r")[:count]
+        self.vectors = DecodedView(self.codes, self.codec, self.meta["dim"])
+        self._inverse_norms = np.load(os.path.join(path, NORMS_FILE))[:count]
+        self._index_skus()
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes
+
+    def dot(self, rows, queries):
+        scores = self.codec.scores(self.codes[rows], queries)
+        return scores * self.inverse_norms()[rows, None]
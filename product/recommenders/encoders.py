@@ -0,0 +1,86 @@
+"""
+Text encoders for the books added after the embedding store was built.
+
+An encoder has a `dim` and `encode(texts, batch_size)`, which returns the
+(len(texts), dim) float32 vectors of the texts. The one used by the
+ingestion is `settings.EMBEDDING_ENCODER`, so a BERT encoder producing the
+same vectors as the store plugs in without touching the pipeline.
+"""
+import re
+import zlib
+
+import numpy as np
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+TOKEN = re.compile(r"\w+")
+
+
+class HashingEncoder(object):
+    """
+    Feature hashing of the word n-grams, no model needed.
+
+    Every n-gram adds +1 or -1 to one of the `dim` columns, both picked by a
+    hash of the n-gram, so the same text always gets the same unit vector and
+    texts sharing words get similar ones.
+
+    :param ngram_range: (min, max) length of the n-grams
+    :param seed: changes the hash, hence every vector
+    """
+
+    def __init__(self, dim=768, ngram_range=(1, 2), seed=0):
+        self.dim = dim
+        self.ngram_range = ngram_range
+        self.seed = seed
+
+    def _hashes(self, text):
+        tokens = TOKEN.findall(text.lower())
+        low, high = self.ngram_range
+        return [
+            zlib.crc32(" ".join(tokens[start : start + n]).encode(), self.seed)
+            for n in range(low, high + 1)
+            for start in range(len(tokens) - n + 1)
+        ]
+
+    def encode(self, texts, batch_size=1024):
+        """
+        :param texts: list of strings
+        :return: (len(texts), dim) float32 unit vectors, null for empty texts
+        """
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for start in range(0, len(texts), batch_size):
+            hashes = [self._hashes(text) for text in texts[start : start + batch_size]]
+            lengths = [len(text_hashes) for text_hashes in hashes]
+            hashes = np.fromiter(
+                (value for text_hashes in hashes for value in text_hashes),
+                dtype=np.int64,
+                count=sum(lengths),
+            )
+            owners = np.repeat(np.arange(len(lengths)), lengths)
+            # The low bits pick the column, the next one the sign
+            columns = hashes % self.dim
+            signs = 1 - 2 * ((hashes // self.dim) & 1)
+            block = np.bincount(
+                owners * self.dim + columns,
+                weights=signs,
+                minlength=len(lengths) * self.dim,
+            ).reshape(len(lengths), self.dim)
+            vectors[start : start + len(lengths)] = block
+        norms = np.linalg.norm(vectors, axis=1)
+        norms[norms == 0] = 1
+        return vectors / norms[:, None]
+
+
+def get_encoder(dim=None):
+    """
+    Instantiate `settings.EMBEDDING_ENCODER`.
+
+    :param dim: dimension of the store the vectors go to, checked if given
+    """
+    encoder = import_string(settings.EMBEDDING_ENCODER)()
+    if dim is not None and encoder.dim != dim:
+        raise ValueError(
+            f"{settings.EMBEDDING_ENCODER} encodes {encoder.dim}-d vectors, "
+            f"the store has {dim}-d vectors"
+        )
+    return encoder
@@ -0,0 +1,246 @@
+"""
+Offline ranking evaluation on a leave-last-out split of the interactions.
+
+The latest interaction of every user with at least one interaction before
+it is held out. Each model ranks the held-out item among `negatives` items
+the user never rated, knowing only the earlier interactions, and the rank
+gives the metrics:
+
+- hr@k: share of users whose held-out item is in the top k
+- ndcg@k: 1 / log2(rank + 2) when in the top k, 0 otherwise
+- mrr: mean of 1 / (rank + 1)
+- coverage@k: share of the catalog recommended in the top k of some user
+
+Ties count against the held-out item, so a constant model scores 0.
+
+The interactions are read and the candidates drawn once, every model scores
+the same users against the same candidates, `batch_size` users at a time.
+"""
+import time
+from functools import partial
+
+import numpy as np
+
+from .training import InteractionStream, sample_negatives
+
+
+def latency(function, repeat=100):
+    """
+    Call `function` `repeat` times.
+
+    :return: dict of the p50, p95 and p99 latencies in ms and the calls per second
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+    p50, p95, p99 = np.percentile(times, [50, 95, 99])
+    return {
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "calls_per_second": 1000 * len(times) / float(np.sum(times)),
+    }
+
+
+def ranks(scores):
+    """
+    :param scores: (n_users, n_candidates) scores, the held-out item first
+    :return: (n_users,) rank of the held-out item, 0 the best
+    """
+    return (scores[:, 1:] >= scores[:, :1]).sum(axis=1)
+
+
+class HeldOutBatch(dict):
+    """
+    Inputs of a batch of held-out users, each computed on first access
+    """
+
+    def __init__(self, factories, **values):
+        super().__init__(values)
+        self.factories = factories
+
+    def __missing__(self, key):
+        self[key] = self.factories[key]()
+        return self[key]
+
+
+class Evaluation(object):
+    """
+    :param store: embedding store, default the served one
+    :param negatives: sampled candidates per held-out item
+    :param k: cut-off of hr, ndcg and coverage
+    :param batch_size: users scored at a time
+    :param queryset: interactions to split, default all of them
+    """
+
+    def __init__(
+        self,
+        store=None,
+        negatives=99,
+        k=10,
+        batch_size=1024,
+        gru_length=20,
+        chunk_size=65536,
+        queryset=None,
+        seed=0,
+    ):
+        self.stream = InteractionStream(
+            chunk_size=chunk_size,
+            gru_length=gru_length,
+            prefetch=0,
+            queryset=queryset,
+            store=store,
+        )
+        self.store = self.stream.store
+        self.negatives = negatives
+        self.k = k
+        self.batch_size = batch_size
+        self.seed = seed
+
+    def batches(self):
+        """
+        :return: iterator of `HeldOutBatch`: `candidates` (users,
+            1 + negatives) store rows, the held-out one first, and the model
+            inputs of the users, `profiles` for BCFNet and `histories` for
+            ZeroShot, `bases` the normalized mean of the rated items for the
+            content model
+        """
+        stream = self.stream
+        stream.load_catalog()
+        rng = np.random.default_rng(self.seed)
+        n_rows = len(self.store)
+        for users, rows in stream.chunks():
+            starts = np.searchsorted(users, np.arange(users.max() + 1))
+            ends = np.append(starts[1:], len(users)) - 1
+            held = np.flatnonzero(ends > starts)
+            seen = np.unique(users * n_rows + rows)
+            _, negatives, positives = sample_negatives(
+                held, seen, stream.candidates, self.negatives, rng, n_rows
+            )
+            # A user is only kept with all their candidates
+            complete = np.bincount(positives, minlength=len(held)) == self.negatives
+            negatives = negatives[complete[positives]].reshape(-1, self.negatives)
+            held = held[complete]
+            if not len(held):
+                continue
+            profiles = stream.category_counts(users, rows, users.max() + 1)
+
+            for start in range(0, len(held), self.batch_size):
+                batch_users = held[start : start + self.batch_size]
+                examples = {
+                    "users": batch_users,
+                    "rows": rows[ends[batch_users]],
+                    "positions": ends[batch_users],
+                    "labels": np.ones(len(batch_users)),
+                }
+                factories = {
+                    "profiles": partial(stream.profiles, profiles, examples),
+                    "histories": partial(stream.histories, rows, starts, examples),
+                    "bases": partial(self._bases, rows, starts, ends, batch_users),
+                }
+                yield HeldOutBatch(
+                    factories,
+                    candidates=np.column_stack(
+                        [examples["rows"], negatives[start : start + len(batch_users)]]
+                    ),
+                )
+
+    def _bases(self, rows, starts, ends, batch_users):
+        # Normalized mean of the normalized vectors rated before the held-out one
+        lengths = ends[batch_users] - starts[batch_users]
+        history = np.repeat(starts[batch_users], lengths) + (
+            np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        )
+        # Every held-out user rated at least one item before
+        bases = np.add.reduceat(
+            self.store.normalized(rows[history]), np.cumsum(lengths) - lengths
+        )
+        norms = np.linalg.norm(bases, axis=1, keepdims=True)
+        return bases / np.where(norms > 0, norms, 1)
+
+    def run(self, scorers):
+        """
+        Evaluate several models on the same split.
+
+        :param scorers: dict of name: function(batch) returning the
+            (users, candidates) scores of a batch of `batches`
+        :return: dict of name: metrics
+        """
+        results = {name: {"ranks": [], "top": [], "seconds": 0.0} for name in scorers}
+        for batch in self.batches():
+            candidates = batch["candidates"]
+            for name, scorer in scorers.items():
+                start = time.perf_counter()
+                scores = np.asarray(scorer(batch), dtype=np.float32)
+                results[name]["seconds"] += time.perf_counter() - start
+                order = np.argsort(-scores, axis=1)[:, : self.k]
+                results[name]["ranks"].append(ranks(scores))
+                results[name]["top"].append(np.take_along_axis(candidates, order, 1))
+        return {
+            name: self.metrics(result["ranks"], result["top"], result["seconds"])
+            for name, result in results.items()
+        }
+
+    def metrics(self, ranks, top, seconds):
+        ranks = np.concatenate(ranks) if ranks else np.zeros(0, dtype=np.int64)
+        top = np.concatenate(top) if top else np.zeros(0, dtype=np.int64)
+        hits = ranks < self.k
+        catalog = max(len(self.stream.candidates), 1)
+        return {
+            "users": len(ranks),
+            f"hr@{self.k}": float(hits.mean()) if len(ranks) else 0.0,
+            f"ndcg@{self.k}": (
+                float((hits / np.log2(ranks + 2)).mean()) if len(ranks) else 0.0
+            ),
+            "mrr": float((1 / (ranks + 1)).mean()) if len(ranks) else 0.0,
+            f"coverage@{self.k}": len(np.unique(top)) / catalog,
+            "seconds": seconds,
+            "users_per_second": len(ranks) / seconds if seconds else 0.0,
+        }
+
+
+def bcfnet_scorer(model, batch_size=None):
+    """
+    :param model: BCFNet or its NumPy engine, with `cache_items` done on the store
+    """
+
+    def score(batch):
+        candidates = batch["candidates"]
+        scores = model.predict_cached_many(
+            list(zip(batch["profiles"], candidates)), batch_size
+        )
+        return np.stack(scores)
+
+    return score
+
+
+def zeroshot_scorer(model, batch_size=None):
+    """
+    :param model: ZeroShot or its NumPy engine, with `build_index` done on the store
+    """
+
+    def score(batch):
+        # sigmoid(dot) is monotonic, the dot products rank the same
+        user_vecs = model._embed_user(batch["histories"], batch_size)
+        candidates = batch["candidates"]
+        items = model._item_index[candidates] * model._item_norms[candidates][..., None]
+        return np.einsum("ud,ucd->uc", user_vecs, items)
+
+    return score
+
+
+def content_scorer(store):
+    """
+    Cosine similarity to the mean of the rated items, as `CB_MODEL.run`
+    """
+
+    def score(batch):
+        candidates = batch["candidates"]
+        items = store.normalized(candidates.ravel()).reshape(
+            candidates.shape + (store.dim,)
+        )
+        return np.einsum("ud,ucd->uc", batch["bases"], items)
+
+    return score
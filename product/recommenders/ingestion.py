@@ -0,0 +1,114 @@
+"""
+Add new or edited items to the embedding store without rebuilding it.
+
+`ingest` encodes the item texts, appends the vectors to the store and to
+the copies derived from it (the compressed stores of `compress_embeddings`
+and the reduced ones of `fit_reduction`), then updates the related table
+and the IVF index when they were built. Serving processes pick the new rows
+up on their next `get_store` call, as the store's meta.json changed.
+"""
+import json
+import logging
+import os
+
+import numpy as np
+
+from .ann import IVF_DIR, IVFIndex
+from .codecs import append_compressed
+from .encoders import get_encoder
+from .reduction import PROJECTION_FILE
+from .related import RELATED_DIR, update_related
+from .store import META_FILE, STORE_DIR, EmbeddingStore, append_store
+
+logger = logging.getLogger(__name__)
+
+
+def _derived_stores(path):
+    # Sub-directories holding a compressed or reduced copy of the store
+    for name in sorted(os.listdir(path)):
+        meta_path = os.path.join(path, name, META_FILE)
+        if not os.path.isfile(meta_path):
+            continue
+        with open(meta_path) as meta:
+            meta = json.load(meta)
+        if "codec" in meta or "method" in meta:
+            yield os.path.join(path, name), meta
+
+
+def append_vectors(skus, vectors, path=STORE_DIR):
+    """
+    Append rows to the store at `path` and to every copy derived from it.
+
+    :return: store rows of the appended vectors
+    """
+    rows = append_store(path, skus, vectors)
+    sync_derived(path)
+    return rows
+
+
+def sync_derived(path=STORE_DIR):
+    """
+    Append to the derived copies the store rows they don't have yet, the
+    rows appended since they were written.
+    """
+    store = EmbeddingStore(path)
+    for derived, meta in _derived_stores(path):
+        if meta["count"] >= len(store):
+            continue
+        skus = store.skus[meta["count"] :]
+        vectors = np.asarray(store.vectors[meta["count"] :], dtype=np.float32)
+        if "codec" in meta:
+            append_compressed(derived, skus, vectors)
+        else:
+            projection = np.load(os.path.join(derived, PROJECTION_FILE))
+            append_vectors(skus, vectors @ projection, derived)
+
+
+def ingest(skus, texts, encoder=None, path=STORE_DIR, batch_size=1024):
+    """
+    Encode the texts and append their vectors to the store.
+
+    :param skus: skus of the items, an item already in the store gets a new row
+    :param texts: text of every item
+    :param encoder: default `settings.EMBEDDING_ENCODER`
+    :param batch_size: texts encoded at a time
+    :return: store rows of the items
+    """
+    encoder = encoder or get_encoder(EmbeddingStore(path).dim)
+    vectors = encoder.encode(list(texts), batch_size)
+    return append_vectors(skus, vectors, path)
+
+
+def update_indexes(path=STORE_DIR, related_path=None, index_path=None):
+    """
+    Add the rows appended to the store to the related table and the IVF
+    index, the ones that were built.
+
+    :param related_path: default `related/` in the store, as `RELATED_DIR`
+    :param index_path: default `ivf/` in the store, as `IVF_DIR`
+    """
+    related_path = related_path or os.path.join(path, os.path.basename(RELATED_DIR))
+    index_path = index_path or os.path.join(path, os.path.basename(IVF_DIR))
+    store = EmbeddingStore(path)
+
+    if _count(related_path) < len(store):
+        update_related([], path, related_path)
+        logger.info("Updated the related table of %s", related_path)
+
+    count = _count(index_path)
+    if count < len(store):
+        inverse_norms = store.inverse_norms()
+        index = IVFIndex.load(store.vectors[:count], index_path, inverse_norms[:count])
+        index.add(np.arange(count, len(store)), inverse_norms, store.vectors)
+        index.save(index_path)
+        logger.info("Added %d rows to the IVF index", len(store) - count)
+
+
+def _count(path):
+    # Rows of a table or an index (both keep a meta.json), infinite when it
+    # was not built
+    try:
+        with open(os.path.join(path, META_FILE)) as meta:
+            return json.load(meta)["count"]
+    except FileNotFoundError:
+        return np.inf
@@ -0,0 +1,313 @@
+from tensorflow.keras import Model
+from tensorflow.keras.layers import (
+    Input,
+    Multiply,
+    Dense,
+    Concatenate,
+    Dropout,
+    GRU,
+    Dot,
+    Activation,
+)
+from tensorflow.keras.metrics import RootMeanSquaredError
+from tensorflow.keras.utils import plot_model
+from tensorflow.keras.callbacks import ModelCheckpoint
+from tensorflow.keras.losses import BinaryCrossentropy
+from functools import reduce
+import json
+import numpy as np
+
+from .serving import ItemCacheMixin, RetrievalMixin
+
+# Order of get_weights() of the layers exported by `CFs.export_weights`
+WEIGHT_NAMES = {
+    "Dense": ("kernel", "bias"),
+    "GRU": ("kernel", "recurrent_kernel", "bias"),
+}
+
+
+class CFs:
+    def __init__(self):
+        self.backup_path = "training/backup.ckpt"
+        self.cp_callback = ModelCheckpoint(
+            filepath=self.backup_path, save_weights_only=True, verbose=1
+        )
+
+    def model_info(self):
+        if self.model:
+            self.model.summary()
+            return plot_model(self.model, to_file="model.png")
+
+    def fit(self, inputs, label, epochs=10, verbose=1):
+        return self.model.fit(
+            inputs, label, epochs=epochs, verbose=verbose, callbacks=[self.cp_callback]
+        )
+
+    def load(self, path=None):
+        if path == None:
+            self.model.load_weights(self.backup_path)
+        else:
+            self.model.load_weights(path)
+
+    def store(self, path=None):
+        if path == None:
+            self.model.save_weights(self.backup_path)
+        else:
+            self.model.save_weights(path)
+
+    def export_weights(self, path):
+        """
+        Save the weights as a NumPy .npz keyed by "<layer name>/<weight name>",
+        with the constructor arguments under "config", for `numpy_engine`.
+        """
+        weights = {"config": np.array(json.dumps(self.config))}
+        for layer in self.model.layers:
+            for name, value in zip(
+                WEIGHT_NAMES.get(type(layer).__name__, ()), layer.get_weights()
+            ):
+                weights[f"{layer.name}/{name}"] = value
+        np.savez(path, **weights)
+
+    def test(self, inputs, label, batch_size=1024):
+        return self.model.evaluate(inputs, label, batch_size=batch_size)
+
+    def _create_inputs(self, user_size, item_size):
+        u_input = Input(shape=[user_size])
+        i_input = Input(shape=[item_size])
+        return [u_input, i_input]
+
+    def _create_mlp(self, layers_size=[], dropout=0, activation="relu", name="mlp"):
+        # Return a function, so the same layers can be applied to several inputs
+        layers = [
+            Dense(size, activation=activation, name=f"{name}_{i}")
+            for i, size in enumerate(layers_size)
+        ]
+        return lambda input: reduce(
+            lambda last, current: Dropout(dropout)(current(last))
+            if dropout
+            else current(last),
+            layers,
+            input,
+        )
+
+
+class ZeroShot(RetrievalMixin, CFs):
+    def __init__(self, size1=512, size2=256, gru_length=20):
+        self.config = dict(size1=size1, size2=size2, gru_length=gru_length)
+        self.backup_path = f"./training/zeroshot__{size1}__{size2}/mdl.ckpt"
+        self.cp_callback = ModelCheckpoint(
+            filepath=self.backup_path, save_weights_only=True, verbose=0
+        )
+        self.gru_length = gru_length
+        user_input = Input(shape=(gru_length, 768))
+        item_input = Input(shape=(768))
+        self.inputs = [user_input, item_input]
+        layer1 = Dense(size1, activation="relu", name="dense_0")
+        layer2 = Dense(size2, activation="relu", name="dense_1")
+        self.layers = [layer1, layer2]
+        self.gru = GRU(size2, name="gru")
+        user_present = self.gru(layer2(layer1(user_input)))
+        item_present = layer2(layer1(item_input))
+        output = Activation(activation="sigmoid")(
+            Dot(axes=1)([user_present, item_present])
+        )
+        self.model = Model(self.inputs, output, name="ZeroShot")
+        self.model.compile(
+            optimizer="adam",
+            loss=BinaryCrossentropy(),
+            metrics=[RootMeanSquaredError()],
+        )
+        self._update_models()
+        self._gen_score_layer(size2)
+
+    def load(self, path=None):
+        super().load(path)
+        self._update_models()
+        self._item_index = None
+
+    def fit(self, inputs, label, epochs=10, verbose=1):
+        history = super().fit(inputs, label, epochs, verbose)
+        self._update_models()
+        self._item_index = None
+        return history
+
+    def _update_models(self):
+        item_function = self.layers[1](self.layers[0](self.inputs[1]))
+        self.item_model = Model(self.inputs[1], item_function)
+        user_function = self.gru(self.layers[1](self.layers[0](self.inputs[0])))
+        self.user_model = Model(self.inputs[0], user_function)
+
+    def _gen_score_layer(self, size):
+        input = [Input(shape=(size)), Input(shape=(size))]
+        output = Activation(activation="sigmoid")(Dot(axes=1)(input))
+        self.score_layer = Model(input, output)
+
+    def predict(self, user_data, item_data):
+        user_vec = self._embed_user(user_data.reshape(1, self.gru_length, 768))
+        item_vec = self._embed_item(item_data)
+        user_vec = np.repeat(user_vec, item_vec.shape[0], axis=0)
+        return self.score_layer.predict([user_vec, item_vec])
+
+    def _embed_item(self, item, batch_size=None):
+        return self.item_model.predict(item, batch_size=batch_size)
+
+    def _embed_user(self, items, batch_size=None):
+        return self.user_model.predict(items, batch_size=batch_size)
+
+
+class BCFNet(ItemCacheMixin, CFs):
+    def __init__(
+        self,
+        user_size=100,
+        item_size=768,
+        representation_layers=[512, 256, 128, 64],
+        balance_size=128,
+        matching_layers=[512, 256, 128, 64],
+        activation="relu",
+    ):
+        def joinLst(x):
+            return "_".join([str(_) for _ in x])
+
+        self.config = dict(
+            user_size=user_size,
+            item_size=item_size,
+            representation_layers=representation_layers,
+            balance_size=balance_size,
+            matching_layers=matching_layers,
+            activation=activation,
+        )
+        self.backup_path = f"./training/bcfnet__{joinLst(representation_layers)}__{joinLst(matching_layers)}__{balance_size}/mdl.ckpt"
+        self.cp_callback = ModelCheckpoint(
+            filepath=self.backup_path, save_weights_only=True, verbose=0
+        )
+        self.user_size = user_size
+        self.inputs = self._create_inputs(user_size, item_size)
+        # Every branch is a (user tower, item tower, merge) triple, in fusion order
+        self._branches = [
+            self._create_representation_model(representation_layers, activation),
+            self._create_balance_model(balance_size),
+            self._create_matchingfunction_model(matching_layers, activation),
+        ]
+        self._output_layer = Dense(1, activation="sigmoid", name="output")
+        output = self._head(self.inputs[0], self._item_towers(self.inputs[1]))
+        self.model = Model(self.inputs, output, name="DeepCF")
+        self.model.compile(
+            optimizer="adam",
+            loss=BinaryCrossentropy(),
+            metrics=[RootMeanSquaredError()],
+        )
+        self._update_models()
+
+    def _attention(self, size, name="attention"):
+        attention = Dense(size, activation="softmax", name=name)
+        return lambda input: Concatenate()([input, attention(input)])
+
+    def _create_balance_model(self, balance_size, activation="relu"):
+        user_embedding_factor = Dense(
+            balance_size, activation=activation, name="balance_user"
+        )
+        item_embedding_factor = Dense(
+            balance_size, activation=activation, name="balance_item"
+        )
+        return (
+            user_embedding_factor,
+            item_embedding_factor,
+            lambda user, item: Multiply()([user, item]),
+        )
+
+    def _create_representation_model(self, representation_layers, activation="relu"):
+        # embedding input
+        embedding_size = representation_layers[0] // 2
+        user_embedding_factor = Dense(
+            embedding_size, activation=activation, name="representation_user"
+        )
+        item_embedding_factor = Dense(
+            embedding_size, activation=activation, name="representation_item"
+        )
+        # attentive_layers
+        attentive_user = self._attention(
+            embedding_size, name="representation_user_attention"
+        )
+        attentive_item = self._attention(
+            embedding_size, name="representation_item_attention"
+        )
+        # mlp
+        user_latent_factor = self._create_mlp(
+            representation_layers, dropout=0.1, name="representation_user_mlp"
+        )
+        item_latent_factor = self._create_mlp(
+            representation_layers, dropout=0.1, name="representation_item_mlp"
+        )
+        return (
+            lambda user: user_latent_factor(
+                attentive_user(user_embedding_factor(user))
+            ),
+            lambda item: item_latent_factor(
+                attentive_item(item_embedding_factor(item))
+            ),
+            lambda user, item: Multiply()([user, item]),
+        )
+
+    def _create_matchingfunction_model(self, matching_layers=[32], activation="relu"):
+        embedding_size = matching_layers[0] // 4
+        user_embedding_factor = Dense(
+            embedding_size, activation=activation, name="matching_user"
+        )
+        item_embedding_factor = Dense(
+            embedding_size, activation=activation, name="matching_item"
+        )
+        attentive_layer = self._attention(
+            embedding_size * 2, name="matching_attention"
+        )
+        mlp = self._create_mlp(matching_layers, dropout=0.1, name="matching_mlp")
+        return (
+            user_embedding_factor,
+            item_embedding_factor,
+            lambda user, item: mlp(attentive_layer(Concatenate()([user, item]))),
+        )
+
+    def _item_towers(self, item):
+        return [item_tower(item) for _, item_tower, _ in self._branches]
+
+    def _head(self, user, item_factors):
+        branches = [
+            merge(user_tower(user), item_factor)
+            for (user_tower, _, merge), item_factor in zip(self._branches, item_factors)
+        ]
+        return self._output_layer(Concatenate()(branches))
+
+    def _update_models(self):
+        # item_model: item input -> item side activation of every branch
+        # head_model: user input + cached item activations -> score
+        item_factors = self._item_towers(self.inputs[1])
+        self.item_model = Model(self.inputs[1], item_factors)
+        factor_inputs = [Input(shape=factor.shape[1:]) for factor in item_factors]
+        self.head_model = Model(
+            [self.inputs[0]] + factor_inputs, self._head(self.inputs[0], factor_inputs)
+        )
+
+    def load(self, path=None):
+        super().load(path)
+        self._item_cache = None
+
+    def fit(self, inputs, label, epochs=10, verbose=1):
+        history = super().fit(inputs, label, epochs, verbose)
+        self._item_cache = None
+        return history
+
+    def predict(self, user_data, item_data):
+        user_vec = np.repeat(
+            user_data.reshape(1, self.user_size), item_data.shape[0], axis=0
+        )
+        return self.model.predict([user_vec, item_data]).flatten()
+
+    def _item_factors(self, item_data, batch_size=None):
+        return self.item_model.predict(item_data, batch_size=batch_size)
+
+    def _score_factors(self, user_data, item_factors, batch_size=None, owners=None):
+        if owners is None:
+            owners = np.zeros(len(item_factors[0]), dtype=np.int64)
+        user_vec = np.asarray(user_data).reshape(-1, self.user_size)[owners]
+        return self.head_model.predict(
+            [user_vec] + item_factors, batch_size=batch_size
+        ).flatten()
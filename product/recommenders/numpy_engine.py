@@ -0,0 +1,158 @@
+"""
+NumPy forward passes of BCFNet and ZeroShot, to serve without TensorFlow.
+
+The weights are the .npz written by `CFs.export_weights` (see the
+`export_numpy_weights` command), keyed by the layer names of `keras_models`.
+Dropout is an identity at inference, so it is skipped.
+"""
+import json
+
+import numpy as np
+
+from .serving import ItemCacheMixin, RetrievalMixin, sigmoid
+
+
+def relu(x):
+    return np.maximum(x, 0)
+
+
+def softmax(x):
+    e = np.exp(x - x.max(axis=-1, keepdims=True))
+    return e / e.sum(axis=-1, keepdims=True)
+
+
+ACTIVATIONS = {
+    "relu": relu,
+    "softmax": softmax,
+    "sigmoid": sigmoid,
+    "tanh": np.tanh,
+    "linear": lambda x: x,
+}
+
+
+class NumpyModel(object):
+    def __init__(self, weights):
+        self.weights = weights
+        self.config = json.loads(str(weights["config"]))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls({key: data[key] for key in data.files})
+
+    def _dense(self, name, x, activation="relu"):
+        x = x @ self.weights[f"{name}/kernel"] + self.weights[f"{name}/bias"]
+        return ACTIVATIONS[activation](x)
+
+    def _attention(self, name, x):
+        return np.concatenate([x, self._dense(name, x, "softmax")], axis=-1)
+
+    def _mlp(self, name, x, depth):
+        for i in range(depth):
+            x = self._dense(f"{name}_{i}", x)
+        return x
+
+    def _batched(self, function, data, batch_size=None):
+        # Bound the size of the intermediate activations on big catalogs
+        batch_size = batch_size or 4096
+        outputs = [
+            function(np.asarray(data[start : start + batch_size], dtype=np.float32))
+            for start in range(0, len(data), batch_size)
+        ]
+        if not outputs:
+            outputs = [function(np.zeros((0,) + data.shape[1:], dtype=np.float32))]
+        if isinstance(outputs[0], list):
+            return [np.concatenate(parts) for parts in zip(*outputs)]
+        return np.concatenate(outputs)
+
+
+class NumpyBCFNet(ItemCacheMixin, NumpyModel):
+    def __init__(self, weights):
+        super().__init__(weights)
+        self.user_size = self.config["user_size"]
+        self.activation = self.config["activation"]
+        self._representation_depth = len(self.config["representation_layers"])
+        self._matching_depth = len(self.config["matching_layers"])
+
+    def _towers(self, side, x):
+        # Same order as BCFNet._branches: representation, balance, matching
+        representation = self._dense(f"representation_{side}", x, self.activation)
+        representation = self._attention(
+            f"representation_{side}_attention", representation
+        )
+        return [
+            self._mlp(
+                f"representation_{side}_mlp", representation, self._representation_depth
+            ),
+            self._dense(f"balance_{side}", x),
+            self._dense(f"matching_{side}", x, self.activation),
+        ]
+
+    def _item_factors(self, item_data, batch_size=None):
+        return self._batched(lambda x: self._towers("item", x), item_data, batch_size)
+
+    def _score_factors(self, user_data, item_factors, batch_size=None, owners=None):
+        users = np.asarray(user_data, dtype=np.float32).reshape(-1, self.user_size)
+        if owners is None:
+            owners = np.zeros(len(item_factors[0]), dtype=np.int64)
+        # The user towers run once per user, then are gathered per item row
+        user_factors = [factor[owners] for factor in self._towers("user", users)]
+        matching = np.concatenate([user_factors[2], item_factors[2]], axis=1)
+        matching = self._attention("matching_attention", matching)
+        fusion = np.concatenate(
+            [
+                user_factors[0] * item_factors[0],
+                user_factors[1] * item_factors[1],
+                self._mlp("matching_mlp", matching, self._matching_depth),
+            ],
+            axis=1,
+        )
+        return self._dense("output", fusion, "sigmoid").flatten()
+
+    def predict(self, user_data, item_data):
+        return self._score_factors(user_data, self._item_factors(item_data))
+
+
+class NumpyZeroShot(RetrievalMixin, NumpyModel):
+    def __init__(self, weights):
+        super().__init__(weights)
+        self.gru_length = self.config["gru_length"]
+        if self.weights["gru/bias"].ndim != 2:
+            raise ValueError("Only GRU(reset_after=True) weights are supported")
+
+    def _embed_item(self, item, batch_size=None):
+        return self._batched(
+            lambda x: self._dense("dense_1", self._dense("dense_0", x)),
+            item,
+            batch_size,
+        )
+
+    def _embed_user(self, items, batch_size=None):
+        return self._batched(
+            lambda x: self._gru(self._dense("dense_1", self._dense("dense_0", x))),
+            items,
+            batch_size,
+        )
+
+    def _gru(self, x):
+        # Keras GRU with reset_after=True, gates ordered z, r, h
+        kernel = self.weights["gru/kernel"]
+        recurrent_kernel = self.weights["gru/recurrent_kernel"]
+        input_bias, recurrent_bias = self.weights["gru/bias"]
+        units = recurrent_kernel.shape[0]
+
+        inputs = x @ kernel + input_bias
+        state = np.zeros((len(x), units), dtype=np.float32)
+        for step in range(x.shape[1]):
+            x_z, x_r, x_h = np.split(inputs[:, step], 3, axis=1)
+            recurrent = state @ recurrent_kernel + recurrent_bias
+            r_z, r_r, r_h = np.split(recurrent, 3, axis=1)
+            update = sigmoid(x_z + r_z)
+            reset = sigmoid(x_r + r_r)
+            candidate = np.tanh(x_h + reset * r_h)
+            state = update * state + (1 - update) * candidate
+        return state
+
+    def predict(self, user_data, item_data):
+        user_vec = self._embed_user(user_data.reshape(1, self.gru_length, -1))[0]
+        return sigmoid(self._embed_item(item_data) @ user_vec)[:, None]
@@ -0,0 +1,79 @@
+"""
+Load the recommender data once in the gunicorn master (see gunicorn.conf.py).
+
+The embedding store is a memmap, so its pages are shared by the OS anyway.
+What each worker used to rebuild privately are the arrays derived from it:
+the inverse norms, the BCFNet item tower cache and the related table.
+Building them before the fork leaves a single copy, shared copy-on-write
+by every worker as long as nobody writes to them.
+"""
+import logging
+import os
+
+from django.conf import settings
+
+from .serving import BCFNET_CHECKPOINT
+from .store import get_store
+
+logger = logging.getLogger(__name__)
+
+
+def warm_up():
+    """
+    Load every process wide recommender object into this process
+    """
+    get_store(codec=settings.EMBEDDING_CODEC).inverse_norms()
+
+    from .CB_model import cb
+    from .related import get_related_table
+
+    cb.load()
+    get_related_table()
+
+    # TensorFlow must not be loaded before a fork, so the Keras backend is
+    # left to the workers
+    if os.path.exists(os.path.splitext(BCFNET_CHECKPOINT)[0] + ".npz"):
+        from product import recommender  # noqa: F401
+    else:
+        logger.warning(
+            "No exported NumPy weights, BCFNet is loaded by every worker instead"
+        )
+
+
+def memory_usage():
+    """
+    Resident, shared and private memory of this process in MB (Linux only).
+
+    :return: dict with `rss`, `shared`, `private` and `pss`, None when
+        /proc is not available
+    """
+    try:
+        with open("/proc/self/smaps_rollup") as smaps:
+            fields = dict(
+                (line.split()[0].rstrip(":"), int(line.split()[1]))
+                for line in smaps
+                if line.split()[-1] == "kB"
+            )
+    except OSError:
+        return None
+    return {
+        "rss": fields["Rss"] / 1024,
+        "shared": (fields["Shared_Clean"] + fields["Shared_Dirty"]) / 1024,
+        "private": (fields["Private_Clean"] + fields["Private_Dirty"]) / 1024,
+        "pss": fields["Pss"] / 1024,
+    }
+
+
+def log_memory(label, log=logger):
+    usage = memory_usage()
+    if usage is None:
+        return
+    log.info(
+        "%s (pid %d): rss %.0fMB, shared %.0fMB, private %.0fMB, pss %.0fMB",
+        label,
+        os.getpid(),
+        usage["rss"],
+        usage["shared"],
+        usage["private"],
+        usage["pss"],
+    )
@@ -0,0 +1,73 @@
+import numpy as np
+
+from django.db.models import Case, FloatField, IntegerField, Value, When
+
+
+def top_k(scores, k=None):
+    """
+    Indices of the k best scores, best first.
+
+    Uses argpartition, so only the k winners are sorted.
+
+    :param scores: 1-d array of scores
+    :param k: number of items to keep, None to rank everything
+    """
+    scores = np.asarray(scores)
+    if k is None or k >= len(scores):
+        return np.argsort(-scores, kind="stable")
+    if k <= 0:
+        return np.zeros(0, dtype=np.intp)
+    best = np.argpartition(-scores, k - 1)[:k]
+    return best[np.argsort(-scores[best], kind="stable")]
+
+
+def top_k_rows(scores, k):
+    """
+    Column indices of the k best scores of every row, best first.
+
+    :param scores: (n, m) array of scores
+    :param k: number of items to keep per row
+    """
+    scores = np.asarray(scores)
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.zeros((len(scores), 0), dtype=np.intp)
+    best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, best, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(best, order, axis=1)
+
+
+def rank_queryset(queryset, keys, scores=None, field="sku"):
+    """
+    Restrict a queryset to the ranked keys and order it by their rank.
+
+    The ordering is a CASE with one WHEN per key. Pass only the winners of a
+    cutoff (e.g. `top_k(scores, num)`): ranking every candidate, as
+    `cf_filter` or `CB_MODEL.run` do with num=None, makes a CASE as long as
+    the candidate set.
+
+    :param queryset: queryset of the candidates
+    :param keys: values of `field` of the winners, best first
+    :param scores: optional scores of the winners, annotated as `score`
+    :param field: field holding the keys
+    """
+    keys = list(keys)
+    if not keys:
+        return queryset.none()
+    queryset = queryset.filter(**{f"{field}__in": keys}).annotate(
+        rank=Case(
+            *[When(**{field: key}, then=Value(i)) for i, key in enumerate(keys)],
+            output_field=IntegerField(),
+        )
+    )
+    if scores is not None:
+        queryset = queryset.annotate(
+            score=Case(
+                *[
+                    When(**{field: key}, then=Value(float(score)))
+                    for key, score in zip(keys, scores)
+                ],
+                output_field=FloatField(),
+            )
+        )
+    return queryset.distinct().order_by("rank")
@@ -0,0 +1,97 @@
+"""
+Lower dimensional copies of the embedding store for content similarity.
+
+A projection maps the 768-d vectors to `dim` dimensions:
+
+- pca: the top eigenvectors of the (uncentered) second moment matrix, the
+  linear map that best preserves the dot products, hence the cosine ranking
+- random: a seeded Gaussian random projection, no fit needed
+
+`reduce_store` writes the projected vectors as a regular embedding store,
+so `CB_MODEL` and `build_related` use it like the full one.
+"""
+import json
+import os
+import time
+
+import numpy as np
+
+from .store import META_FILE, SKUS_FILE, STORE_DIR, VECTORS_FILE, EmbeddingStore
+
+PROJECTION_FILE = "projection.npy"
+METHODS = ("pca", "random")
+
+
+def fit_projection(
+    vectors, dim, method="pca", seed=0, inverse_norms=None, block_size=16384
+):
+    """
+    :param vectors: (n, d) matrix, may be a memmap
+    :param dim: output dimension
+    :param method: "pca" or "random"
+    :param inverse_norms: fit PCA on the unit vectors, as the cosine sees them
+    :return: (d, dim) float32 projection matrix
+    """
+    if method == "random":
+        rng = np.random.default_rng(seed)
+        projection = rng.normal(size=(vectors.shape[1], dim)) / np.sqrt(dim)
+        return projection.astype(np.float32)
+    if method != "pca":
+        raise ValueError(f"Unknown method {method}")
+
+    moment = np.zeros((vectors.shape[1], vectors.shape[1]))
+    for start in range(0, len(vectors), block_size):
+        block = np.asarray(vectors[start : start + block_size], dtype=np.float64)
+        if inverse_norms is not None:
+            block *= inverse_norms[start : start + block_size, None]
+        moment += block.T @ block
+    # eigh returns the eigenvalues in ascending order
+    _, eigenvectors = np.linalg.eigh(moment)
+    return np.ascontiguousarray(eigenvectors[:, ::-1][:, :dim], dtype=np.float32)
+
+
+def project(vectors, projection, block_size=16384):
+    return np.concatenate(
+        [
+            np.asarray(vectors[start : start + block_size], np.float32) @ projection
+            for start in range(0, len(vectors), block_size)
+        ]
+        or [np.zeros((0, projection.shape[1]), dtype=np.float32)]
+    )
+
+
+def reduce_store(dim, method="pca", store_path=STORE_DIR, path=None, seed=0):
+    """
+    Fit a projection on the store and write the projected store.
+
+    :return: directory of the reduced store, default `<store>/<method>_<dim>`
+    """
+    source = EmbeddingStore(store_path)
+    path = path or os.path.join(store_path, f"{method}_{dim}")
+    os.makedirs(path, exist_ok=True)
+    projection = fit_projection(
+        source.vectors, dim, method, seed, source.inverse_norms()
+    )
+
+    tmp_path = os.path.join(path, VECTORS_FILE + ".tmp")
+    with open(tmp_path, "wb") as output:
+        for start in range(0, len(source), 16384):
+            block = source.vectors[start : start + 16384] @ projection
+            output.write(np.ascontiguousarray(block, dtype=np.float32).tobytes())
+    os.replace(tmp_path, os.path.join(path, VECTORS_FILE))
+
+    np.save(os.path.join(path, PROJECTION_FILE), projection)
+    np.save(os.path.join(path, SKUS_FILE), source.skus)
+    with open(os.path.join(path, META_FILE), "w") as meta:
+        json.dump(
+            {
+                "count": len(source),
+                "dim": dim,
+                "dtype": "float32",
+                "method": method,
+                "source_dim": source.dim,
+                "built_at": time.time(),
+            },
+            meta,
+        )
+    return path
@@ -0,0 +1,248 @@
+"""
+Precomputed "related books": the top-N most similar store rows of every row.
+
+The table is two .npy arrays aligned with the embedding store rows,
+`neighbors.npy` (int32 store rows) and `similarities.npy` (float16 cosine),
+best first and padded with -1 / -inf when the catalog is smaller than N.
+They are memory mapped when served, so a lookup is one row read.
+"""
+import multiprocessing
+import os
+
+import numpy as np
+
+from .ranking import top_k_rows
+from .store import STORE_DIR, EmbeddingStore, meta_version, write_meta
+
+RELATED_DIR = os.path.join(STORE_DIR, "related")
+NEIGHBORS_FILE = "neighbors.npy"
+SIMILARITIES_FILE = "similarities.npy"
+
+_store = None
+_index = None
+
+
+def _init_worker(store_path, index_path=None):
+    global _store, _index
+    _store = EmbeddingStore(store_path)
+    _store.inverse_norms()
+    _index = None
+    if index_path:
+        from .ann import IVFIndex
+
+        _index = IVFIndex.load(_store.vectors, index_path, _store.inverse_norms())
+
+
+def _neighbors_of(rows, num, column_block=16384, exclude_self=True):
+    """
+    Top `num` neighbours of the store `rows`, scanning the catalog in blocks.
+
+    :return: ((len(rows), num) int32 rows, (len(rows), num) float32 similarities)
+    """
+    rows = np.asarray(rows)
+    queries = _store.normalized(rows)
+    if _index is not None:
+        return _search_index(rows, queries, num, exclude_self)
+    best_rows = np.full((len(rows), num), -1, dtype=np.int64)
+    best_scores = np.full((len(rows), num), -np.inf, dtype=np.float32)
+    for start in range(0, len(_store), column_block):
+        columns = np.arange(start, min(start + column_block, len(_store)))
+        scores = queries @ _store.normalized(columns).T
+        if exclude_self:
+            scores[rows[:, None] == columns[None, :]] = -np.inf
+        # Keep a running top-num of the blocks seen so far
+        scores = np.concatenate([best_scores, scores], axis=1)
+        candidates = np.concatenate(
+            [best_rows, np.broadcast_to(columns, (len(rows), len(columns)))], axis=1
+        )
+        best = top_k_rows(scores, num)
+        best_rows = np.take_along_axis(candidates, best, axis=1)
+        best_scores = np.take_along_axis(scores, best, axis=1)
+    best_rows[~np.isfinite(best_scores)] = -1
+    return best_rows.astype(np.int32), best_scores
+
+
+def _search_index(rows, queries, num, exclude_self=True):
+    best_rows = np.full((len(rows), num), -1, dtype=np.int32)
+    best_scores = np.full((len(rows), num), -np.inf, dtype=np.float32)
+    for i, (row, query) in enumerate(zip(rows, queries)):
+        found, scores = _index.search(query, num + 1)
+        keep = found != row if exclude_self else np.ones(len(found), dtype=bool)
+        found, scores = found[keep][:num], scores[keep][:num]
+        best_rows[i, : len(found)], best_scores[i, : len(found)] = found, scores
+    return best_rows, best_scores
+
+
+def _build_block(args):
+    start, stop, num = args
+    return start, _neighbors_of(np.arange(start, stop), num)
+
+
+def build_related(
+    store_path=STORE_DIR,
+    path=RELATED_DIR,
+    num=50,
+    block_size=256,
+    workers=None,
+    index_path=None,
+):
+    """
+    Compute the table over the whole store with a process pool.
+
+    :param store_path: directory of the embedding store
+    :param path: directory of the table
+    :param num: neighbours kept per item
+    :param block_size: rows scored per task
+    :param workers: number of processes, 0 to run in this process
+    :param index_path: IVF index of the store (`build_ann_index`) to search
+        approximately instead of scanning the whole catalog for every row
+    :return: number of rows
+    """
+    count = len(EmbeddingStore(store_path))
+    neighbors = np.full((count, num), -1, dtype=np.int32)
+    similarities = np.full((count, num), -np.inf, dtype=np.float16)
+    tasks = [
+        (start, min(start + block_size, count), num)
+        for start in range(0, count, block_size)
+    ]
+
+    if workers == 0:
+        _init_worker(store_path, index_path)
+        results = map(_build_block, tasks)
+        _write_blocks(results, neighbors, similarities)
+    else:
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(
+            workers, initializer=_init_worker, initargs=(store_path, index_path)
+        ) as pool:
+            _write_blocks(
+                pool.imap_unordered(_build_block, tasks), neighbors, similarities
+            )
+
+    save_related(path, neighbors, similarities)
+    return count
+
+
+def _write_blocks(results, neighbors, similarities):
+    for start, (rows, scores) in results:
+        neighbors[start : start + len(rows)] = rows
+        similarities[start : start + len(rows)] = scores
+
+
+def save_related(path, neighbors, similarities):
+    # Written next to the old files and renamed, so readers never see a half
+    # written table and keep their current mapping until they reload
+    os.makedirs(path, exist_ok=True)
+    for name, array in (
+        (NEIGHBORS_FILE, neighbors),
+        (SIMILARITIES_FILE, similarities),
+    ):
+        tmp_path = os.path.join(path, name + ".tmp.npy")
+        np.save(tmp_path, array)
+        os.replace(tmp_path, os.path.join(path, name))
+    write_meta(path, {"count": len(neighbors), "num": neighbors.shape[1]})
+
+
+def update_related(rows, store_path=STORE_DIR, path=RELATED_DIR):
+    """
+    Add or refresh the store `rows` without rebuilding the table.
+
+    Their own neighbours are recomputed, and they are inserted in the lists of
+    the items they are now closer to than the item's current last neighbour.
+    Rows appended to the store since the build are always added. Items that
+    listed a changed row and no longer do keep one neighbour less until the
+    next full build.
+
+    :param rows: store rows of the new or changed items
+    """
+    _init_worker(store_path)
+    table = RelatedTable(path)
+    num = table.neighbors.shape[1]
+    rows = np.union1d(
+        np.asarray(rows, dtype=np.int64), np.arange(len(table), len(_store))
+    )
+
+    neighbors = np.full((len(_store), num), -1, dtype=np.int32)
+    similarities = np.full((len(_store), num), -np.inf, dtype=np.float16)
+    neighbors[: len(table)] = table.neighbors
+    similarities[: len(table)] = table.similarities
+    # A changed item may have moved away from its old neighbours
+    stale = np.isin(neighbors, rows)
+    neighbors[stale], similarities[stale] = -1, -np.inf
+
+    new_rows, new_scores = _neighbors_of(rows, num)
+    neighbors[rows], similarities[rows] = new_rows, new_scores
+
+    queries = _store.normalized(rows)
+    for start in range(0, len(_store), 16384):
+        block = np.arange(start, min(start + 16384, len(_store)))
+        scores = _store.normalized(block) @ queries.T
+        scores[block[:, None] == rows[None, :]] = -np.inf
+        last = similarities[block, -1].astype(np.float32)
+        changed = (scores > last[:, None]).any(axis=1)
+        changed |= stale[block].any(axis=1)
+        changed &= ~np.isin(block, rows)
+        if not changed.any():
+            continue
+        block, scores = block[changed], scores[changed]
+        candidates = np.concatenate(
+            [neighbors[block], np.broadcast_to(rows, (len(block), len(rows)))], axis=1
+        )
+        candidate_scores = np.concatenate(
+            [similarities[block].astype(np.float32), scores], axis=1
+        )
+        best = top_k_rows(candidate_scores, num)
+        best_scores = np.take_along_axis(candidate_scores, best, axis=1)
+        best_rows = np.take_along_axis(candidates, best, axis=1)
+        best_rows[~np.isfinite(best_scores)] = -1
+        neighbors[block], similarities[block] = best_rows, best_scores
+
+    save_related(path, neighbors, similarities)
+    return len(rows)
+
+
+class RelatedTable(object):
+    """
+    Memory mapped view of the table written by `build_related`
+    """
+
+    def __init__(self, path=RELATED_DIR):
+        self.path = path
+        self.version = meta_version(path)
+        self.neighbors = np.load(os.path.join(path, NEIGHBORS_FILE), mmap_mode="r")
+        self.similarities = np.load(
+            os.path.join(path, SIMILARITIES_FILE), mmap_mode="r"
+        )
+
+    def __len__(self):
+        return len(self.neighbors)
+
+    def related(self, row, num=None):
+        """
+        :param row: store row of the item
+        :return: (rows, similarities) of its neighbours, best first
+        """
+        if row < 0 or row >= len(self):
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+        rows = np.asarray(self.neighbors[row, :num])
+        keep = rows >= 0
+        return rows[keep], np.asarray(self.similarities[row, :num], np.float32)[keep]
+
+
+_table = None
+
+
+def get_related_table(path=RELATED_DIR):
+    """
+    Return the process wide table, None when it was not built.
+
+    The table is reopened when `update_related` or a rebuild replaced it.
+    """
+    global _table
+    try:
+        version = meta_version(path)
+    except FileNotFoundError:
+        return None
+    if _table is None or _table.path != path or _table.version != version:
+        _table = RelatedTable(path)
+    return _table
@@ -0,0 +1,230 @@
+"""
+Request-time helpers shared by the Keras models and the NumPy engine.
+
+They only rely on a few tower methods of the model, so the same caching and
+retrieval code runs on both backends.
+"""
+import os
+
+import numpy as np
+
+from .ranking import top_k
+
+BCFNET_CHECKPOINT = "./product/recommenders/bcfnet/mdl.ckpt"
+BCFNET_CONFIG = dict(
+    user_size=100,
+    item_size=768,
+    representation_layers=[512, 256, 128, 64],
+    balance_size=128,
+    matching_layers=[512, 256, 128, 64],
+    activation="relu",
+)
+
+
+def sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+
+class ItemCacheMixin(object):
+    """
+    Precomputed item towers for BCFNet.
+
+    Needs `_item_factors(item_data, batch_size)`, the item side activation of
+    every branch, and `_score_factors(user_data, item_factors, batch_size,
+    owners)`, where row i of the items is scored for user `owners[i]`.
+    """
+
+    _item_cache = None
+
+    def cache_items(self, item_data, batch_size=4096, dtype=np.float32, start=0):
+        """
+        Run the item towers once over the whole catalog.
+
+        After this, `predict_cached` only runs the user towers and the merge
+        layers at request time.
+
+        :param item_data: (n_items, item_size) matrix, e.g. the embedding store.
+            It is read `batch_size` rows at a time, so a memmap or a
+            compressed store is never loaded whole.
+        :param dtype: dtype of the cache, float16 halves its memory
+        :param start: keep the cached rows before `start` and only run the
+            rows appended to the matrix since
+        """
+        blocks = [
+            [
+                np.asarray(factor, dtype=dtype)
+                for factor in self._item_factors(
+                    np.asarray(item_data[begin : begin + batch_size], np.float32),
+                    batch_size,
+                )
+            ]
+            for begin in range(start, len(item_data), batch_size)
+        ]
+        if start and self._item_cache is not None:
+            blocks.insert(0, [factor[:start] for factor in self._item_cache])
+        # Replaced at once, so concurrent requests see the old or the new cache
+        self._item_cache = [np.concatenate(factors) for factors in zip(*blocks)]
+
+    @property
+    def has_item_cache(self):
+        return self._item_cache is not None
+
+    def predict_cached(self, user_data, rows, batch_size=None):
+        """
+        Score the cached items at `rows` (rows of the matrix given to `cache_items`)
+        """
+        if self._item_cache is None:
+            raise ValueError("Item activations are not cached, call cache_items first")
+        item_factors = [factor[rows] for factor in self._item_cache]
+        return self._score_factors(user_data, item_factors, batch_size)
+
+    def predict_cached_many(self, requests, batch_size=None):
+        """
+        Score several (user_data, rows) requests in one forward pass.
+
+        :return: list of the scores of every request, as `predict_cached`
+        """
+        if self._item_cache is None:
+            raise ValueError("Item activations are not cached, call cache_items first")
+        user_data = np.stack([np.asarray(user).ravel() for user, _ in requests])
+        rows = [np.asarray(rows, dtype=np.int64) for _, rows in requests]
+        lengths = [len(request_rows) for request_rows in rows]
+        owners = np.repeat(np.arange(len(requests)), lengths)
+        item_factors = [factor[np.concatenate(rows)] for factor in self._item_cache]
+        scores = self._score_factors(user_data, item_factors, batch_size, owners)
+        return np.split(scores, np.cumsum(lengths)[:-1])
+
+
+class RetrievalMixin(object):
+    """
+    Precomputed item index for ZeroShot.
+
+    Needs `gru_length`, `_embed_item(items, batch_size)` and
+    `_embed_user(histories, batch_size)`.
+    """
+
+    _item_index = None
+    _ann = None
+
+    def build_index(self, item_data, normalize=False, batch_size=4096):
+        """
+        Embed the whole catalog once for `retrieve`.
+
+        :param item_data: (n_items, 768) matrix, e.g. the embedding store
+        :param normalize: rank by cosine instead of the model's dot product.
+            The returned scores are still the model's sigmoid(dot) output.
+        """
+        index = np.asarray(self._embed_item(item_data, batch_size), dtype=np.float32)
+        self._item_norms = np.ones(len(index), dtype=np.float32)
+        if normalize:
+            self._item_norms = np.linalg.norm(index, axis=1)
+            self._item_norms[self._item_norms == 0] = 1
+            index /= self._item_norms[:, None]
+        self._item_index = np.ascontiguousarray(index)
+        self._ann = None
+
+    def build_ann(self, nlist=None, nprobe=8, queries=None, target_recall=None):
+        """
+        Let `retrieve` scan only part of the index, through an IVF index.
+
+        :param nlist: number of inverted lists, default about 4 * sqrt(n_items)
+        :param nprobe: lists scanned per query
+        :param queries: user vectors to tune nprobe for `target_recall` on
+        """
+        from .ann import IVFIndex
+
+        if self._item_index is None:
+            raise ValueError("Items are not indexed, call build_index first")
+        self._ann = IVFIndex(self._item_index, metric="dot").train(nlist)
+        self._ann.nprobe = nprobe
+        if queries is not None and target_recall is not None:
+            self._ann.tune(queries, target_recall=target_recall)
+        return self._ann
+
+    def retrieve(self, user_data, k=10, rows=None):
+        """
+        Rank the indexed items for one user with a single matrix-vector product.
+
+        :param user_data: (gru_length, 768) history of the user
+        :param k: number of items to return
+        :param rows: optional candidate rows of the index, default is all items,
+            searched through the IVF index when `build_ann` was called
+        :return: (rows, scores) of the k best items, best first
+        """
+        return self.retrieve_many([(user_data, k, rows)])[0]
+
+    def retrieve_many(self, requests, batch_size=None):
+        """
+        `retrieve` for several (user_data, k, rows) requests, embedding all
+        the users in one forward pass.
+        """
+        if self._item_index is None:
+            raise ValueError("Items are not indexed, call build_index first")
+        user_data = np.stack(
+            [np.asarray(user).reshape(self.gru_length, -1) for user, _, _ in requests]
+        )
+        user_vecs = self._embed_user(user_data, batch_size)
+        return [
+            self._rank(user_vec, k, rows)
+            for user_vec, (_, k, rows) in zip(user_vecs, requests)
+        ]
+
+    def _rank(self, user_vec, k, rows):
+        if rows is None and self._ann is not None:
+            rows, scores = self._ann.search(user_vec, k)
+            return rows, sigmoid(scores * self._item_norms[rows])
+        if rows is None:
+            rows = np.arange(len(self._item_index))
+            scores = self._item_index @ user_vec
+        else:
+            rows = np.asarray(rows)
+            scores = self._item_index[rows] @ user_vec
+        best = top_k(scores, k)
+        logits = scores[best] * self._item_norms[rows[best]]
+        return rows[best], sigmoid(logits)
+
+    def score_users(self, user_data, batch_size=None):
+        """
+        Score every indexed item for a batch of users.
+
+        :param user_data: (n_users, gru_length, 768) histories
+        :return: (n_users, n_items) sigmoid(dot) scores
+        """
+        if self._item_index is None:
+            raise ValueError("Items are not indexed, call build_index first")
+        user_vec = self._embed_user(user_data, batch_size)
+        return sigmoid((user_vec @ self._item_index.T) * self._item_norms)
+
+
+def weights_file(path):
+    """
+    The .npz next to a checkpoint when it exists, else `path` unchanged
+    """
+    if path is not None and not path.endswith(".npz"):
+        weights = os.path.splitext(path)[0] + ".npz"
+        path = weights if os.path.exists(weights) else path
+    return path
+
+
+def load_recommender(name="bcfnet", path=None, **config):
+    """
+    Load BCFNet or ZeroShot for serving.
+
+    A .npz path (or a .npz next to the checkpoint) is served by the NumPy
+    engine, anything else is loaded as a Keras checkpoint.
+
+    :param name: "bcfnet" or "zeroshot"
+    :param path: .npz weights or checkpoint, None for the default checkpoint
+    :param config: constructor arguments of the Keras model
+    """
+    path = weights_file(path)
+    if path is not None and path.endswith(".npz"):
+        from .numpy_engine import NumpyBCFNet, NumpyZeroShot
+
+        return {"bcfnet": NumpyBCFNet, "zeroshot": NumpyZeroShot}[name].load(path)
+
+    from .keras_models import BCFNet, ZeroShot
+
+    model = {"bcfnet": BCFNet, "zeroshot": ZeroShot}[name](**config)
+    model.load(path)
+    return model
@@ -0,0 +1,276 @@
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+DATA_KEY = "proccessed"
+DATA_FILE = "./product/recommenders/bert_with_description_field.csv"
+STORE_DIR = "./product/recommenders/embeddings"
+
+VECTORS_FILE = "vectors.f32"
+SKUS_FILE = "skus.npy"
+META_FILE = "meta.json"
+
+logger = logging.getLogger(__name__)
+
+
+def to_numpy(x):
+    # The CSV keeps numpy's repr of each vector, so drop brackets and line breaks
+    return np.fromstring(
+        x.replace("[", " ").replace("]", " ").replace("\n", " "), sep=" "
+    )
+
+
+def build_store(csv_path=DATA_FILE, path=STORE_DIR, chunksize=5000):
+    """
+    Convert the BERT csv into a contiguous float32 matrix and a sku index.
+
+    The matrix is written row by row to `vectors.f32`, the sku of each row to
+    `skus.npy` and the shape to `meta.json`, so the csv is parsed only once.
+
+    :param csv_path: csv with the `id` and `proccessed` columns
+    :param path: directory of the store
+    :param chunksize: number of csv rows parsed at a time
+    :return: number of rows written
+    """
+    from pandas import read_csv
+
+    os.makedirs(path, exist_ok=True)
+    tmp_path = os.path.join(path, VECTORS_FILE + ".tmp")
+    skus, dim, count = [], None, 0
+
+    with open(tmp_path, "wb") as output:
+        for chunk in read_csv(csv_path, usecols=["id", DATA_KEY], chunksize=chunksize):
+            block = np.stack(chunk[DATA_KEY].map(to_numpy).to_list())
+            block = np.ascontiguousarray(block, dtype=np.float32)
+            if dim is None:
+                dim = block.shape[1]
+            elif block.shape[1] != dim:
+                raise ValueError(f"Expected {dim}-d vectors, got {block.shape[1]}-d")
+            output.write(block.tobytes())
+            skus.append(chunk["id"].to_numpy(dtype=np.int64))
+            count += len(block)
+
+    os.replace(tmp_path, os.path.join(path, VECTORS_FILE))
+    np.save(os.path.join(path, SKUS_FILE), np.concatenate(skus))
+    with open(os.path.join(path, META_FILE), "w") as meta:
+        json.dump(
+            {"count": count, "dim": dim, "dtype": "float32", "built_at": time.time()},
+            meta,
+        )
+    return count
+
+
+def meta_version(path):
+    # meta.json is replaced by a new file on every change, the inode tells two
+    # changes apart even within the timestamp resolution
+    stat = os.stat(os.path.join(path, META_FILE))
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def write_meta(path, meta):
+    # Replaced atomically, a reader sees either the old or the new count
+    tmp_path = os.path.join(path, META_FILE + ".tmp")
+    with open(tmp_path, "w") as output:
+        json.dump(meta, output)
+    os.replace(tmp_path, os.path.join(path, META_FILE))
+
+
+def append_store(path, skus, vectors):
+    """
+    Append rows to the store written by `build_store`, without rewriting it.
+
+    The vectors are appended to `vectors.f32` and `meta.json` is replaced
+    last with the new count, so the stores opened before keep their rows and
+    `get_store` reopens the store on its next call. A sku already in the
+    store now maps to its new row, the old one is left unused until the next
+    full build.
+
+    :param skus: (k,) skus of the rows
+    :param vectors: (k, dim) vectors
+    :return: store rows of the appended vectors
+    """
+    with open(os.path.join(path, META_FILE)) as meta:
+        meta = json.load(meta)
+    vectors = np.ascontiguousarray(vectors, dtype=meta["dtype"])
+    if vectors.ndim != 2 or vectors.shape[1] != meta["dim"]:
+        raise ValueError(f"Expected {meta['dim']}-d vectors, got {vectors.shape}")
+    count = meta["count"]
+    skus = np.asarray(skus, dtype=np.int64)
+
+    with open(os.path.join(path, VECTORS_FILE), "r+b") as output:
+        # Drops the tail of an append that failed before its meta was written
+        output.truncate(count * meta["dim"] * vectors.itemsize)
+        output.seek(0, os.SEEK_END)
+        output.write(vectors.tobytes())
+
+    old_skus = np.load(os.path.join(path, SKUS_FILE))[:count]
+    tmp_path = os.path.join(path, SKUS_FILE + ".tmp.npy")
+    np.save(tmp_path, np.concatenate([old_skus, skus]))
+    os.replace(tmp_path, os.path.join(path, SKUS_FILE))
+
+    meta["count"] = count + len(vectors)
+    meta["generation"] = meta.get("generation", 0) + 1
+    write_meta(path, meta)
+    return np.arange(count, count + len(vectors))
+
+
+class EmbeddingStore(object):
+    """
+    Read-only view of the item embeddings built by `build_store`.
+
+    `vectors` is a `np.memmap` of shape (count, dim), so opening the store
+    costs nothing and the pages are shared between processes by the OS.
+    """
+
+    def __init__(self, path=STORE_DIR):
+        self.path = path
+        self.version = meta_version(path)
+        with open(os.path.join(path, META_FILE)) as meta:
+            self.meta = json.load(meta)
+        # meta.json is written last by `append_store`, rows past its count
+        # belong to an append still in progress
+        self.skus = np.load(os.path.join(path, SKUS_FILE))[: self.meta["count"]]
+        self.vectors = np.memmap(
+            os.path.join(path, VECTORS_FILE),
+            dtype=self.meta["dtype"],
+            mode="r",
+            shape=(self.meta["count"], self.meta["dim"]),
+        )
+        self._index_skus()
+
+    def _index_skus(self):
+        self.sku_rows = np.full(self.skus.max(initial=-1) + 1, -1, dtype=np.int32)
+        self.sku_rows[self.skus] = np.arange(len(self.skus), dtype=np.int32)
+
+    def __len__(self):
+        return len(self.skus)
+
+    @property
+    def generation(self):
+        """
+        Number of appends since the store was built
+        """
+        return self.meta.get("generation", 0)
+
+    def extends(self, other):
+        """
+        True when this store is `other` with rows appended, so whatever was
+        computed for the rows of `other` is still valid.
+        """
+        return (
+            other is not None
+            and self.path == other.path
+            and self.generation >= other.generation
+            and self.meta.get("built_at") == other.meta.get("built_at")
+            and len(self) >= len(other)
+        )
+
+    @property
+    def dim(self):
+        return self.meta["dim"]
+
+    @property
+    def nbytes(self):
+        return self.vectors.nbytes
+
+    def inverse_norms(self, block_size=16384):
+        """
+        1 / L2 norm of every row (0 for null rows), computed once per process.
+
+        Cosine similarity is a dot product scaled by these, so callers never
+        need a normalized copy of the matrix.
+        """
+        if getattr(self, "_inverse_norms", None) is None:
+            self._inverse_norms = np.zeros(0, dtype=np.float32)
+        if len(self._inverse_norms) < len(self.vectors):
+            # Only the rows appended since the last call are computed
+            done = len(self._inverse_norms)
+            norms = np.zeros(len(self.vectors) - done, dtype=np.float32)
+            for start in range(0, len(norms), block_size):
+                block = self.vectors[done + start : done + start + block_size]
+                norms[start : start + len(block)] = np.linalg.norm(block, axis=1)
+            norms[norms == 0] = np.inf
+            self._inverse_norms = np.concatenate([self._inverse_norms, 1 / norms])
+        return self._inverse_norms
+
+    def normalized(self, rows):
+        """
+        L2 normalized copy of the vectors at `rows`
+        """
+        return self.vectors[rows] * self.inverse_norms()[rows, None]
+
+    def dot(self, rows, queries):
+        """
+        Dot products of the normalized vectors at `rows` with `queries`,
+        the cosine similarity when the queries are unit vectors.
+
+        :param queries: (q, dim) float32 queries
+        :return: (len(rows), q) similarities
+        """
+        return self.normalized(rows) @ queries.T
+
+    def rows_for(self, skus):
+        """
+        :param skus: iterable of skus
+        :return: (skus, rows) of the skus that exist in the store
+        """
+        skus = np.unique(np.fromiter(skus, dtype=np.int64))
+        in_range = (skus >= 0) & (skus < len(self.sku_rows))
+        rows = np.full(len(skus), -1, dtype=np.int32)
+        rows[in_range] = self.sku_rows[skus[in_range]]
+        found = rows >= 0
+        if not found.all():
+            missing = skus[~found]
+            logger.warning(
+                "%d skus have no embedding: %s", len(missing), missing[:10].tolist()
+            )
+        return skus[found], rows[found]
+
+    def lookup(self, skus):
+        """
+        :param skus: iterable of skus
+        :return: (skus, vectors) of the skus that exist in the store
+        """
+        skus, rows = self.rows_for(skus)
+        return skus, self.vectors[rows]
+
+
+_stores = {}
+
+
+def get_store(path=STORE_DIR, codec=None):
+    """
+    Return the process wide store, building it from the csv the first time.
+
+    The store is reopened when its meta.json changed, e.g. after rows were
+    appended by the ingestion, and keeps the inverse norms already computed
+    when it only grew.
+
+    :param codec: serve the compressed copy written by
+        `codecs.compress_store` ("float16", "int8" or "pq") instead
+    """
+    store = _stores.get((path, codec))
+    store_path = os.path.join(path, codec) if codec else path
+    if store is not None:
+        try:
+            if meta_version(store_path) == store.version:
+                return store
+        except FileNotFoundError:
+            return store
+
+    if codec:
+        from .codecs import CompressedStore
+
+        latest = CompressedStore(store_path)
+    else:
+        if not os.path.exists(os.path.join(path, META_FILE)):
+            logger.warning("Embedding store not found, building it from %s", DATA_FILE)
+            build_store(DATA_FILE, path)
+        latest = EmbeddingStore(path)
+    if latest.extends(store) and getattr(latest, "_inverse_norms", None) is None:
+        latest._inverse_norms = getattr(store, "_inverse_norms", None)
+    _stores[path, codec] = latest
+    return latest
@@ -0,0 +1,296 @@
+"""
+Hyperparameter sweep of BCFNet and ZeroShot (see `sweep_recommenders`).
+
+`write_training_set` draws the examples once from an `InteractionStream` and
+writes them as raw arrays, like the embedding store: the store row and the
+label of every example and the user input, the category profile for BCFNet
+or the store rows of the history for ZeroShot. The vectors are not copied,
+`TrainingSet` gathers them batch by batch from the memory mapped store, so
+every trial trains on the same examples and the workers share one copy of
+the pages through the OS.
+
+The ZeroShot histories are written `gru_length` long, the longest of the
+space, and every trial reads its own last `gru_length` columns.
+
+The worker functions run in spawned processes, so this module must not
+import Django models or TensorFlow at import time.
+"""
+import copy
+import itertools
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+from .store import META_FILE, EmbeddingStore
+from .training import gather_histories
+
+SPLITS = ("train", "validation")
+# Users are split into this many buckets by a hash of their id
+USER_BUCKETS = 1000
+USERS_FILE = "users.bin"
+ROWS_FILE = "rows.i64"
+LABELS_FILE = "labels.f32"
+
+logger = logging.getLogger(__name__)
+
+_threads = None
+
+
+def configurations(space, search="grid", trials=None, seed=0):
+    """
+    :param space: dict of constructor argument: list of values
+    :param search: "grid" for every combination in order, "random" for
+        `trials` distinct combinations drawn at random
+    :param trials: maximum number of configurations, default all of them
+    :return: list of dicts of constructor arguments
+    """
+    names = sorted(space)
+    grid = [
+        dict(zip(names, values))
+        for values in itertools.product(*(space[name] for name in names))
+    ]
+    if search == "random":
+        order = np.random.default_rng(seed).permutation(len(grid))
+        grid = [grid[i] for i in order]
+    elif search != "grid":
+        raise ValueError(f"Unknown search {search}")
+    return grid[:trials] if trials else grid
+
+
+def split_streams(stream, validation=0.1, seed=0):
+    """
+    Split `stream` by user, so no user is in both the training and the
+    validation examples.
+
+    :return: dict of split: `InteractionStream` of its users' interactions
+    """
+    from django.db.models import F
+    from django.db.models.functions import Mod
+
+    from interaction.models import Interaction
+
+    queryset = stream.queryset
+    if queryset is None:
+        queryset = Interaction.objects.all()
+    # Knuth's multiplicative hash spreads consecutive ids over the buckets
+    queryset = queryset.annotate(
+        user_bucket=Mod(F("user_id") * 2654435761 + seed, USER_BUCKETS)
+    )
+    cut = int(round(validation * USER_BUCKETS))
+    streams = {}
+    for split, lookup in zip(SPLITS, ("gte", "lt")):
+        streams[split] = copy.copy(stream)
+        streams[split].queryset = queryset.filter(**{f"user_bucket__{lookup}": cut})
+    return streams
+
+
+def write_training_set(stream, path, validation=0.1, seed=0):
+    """
+    Write one epoch of `stream` to `path`, the examples of a `validation`
+    share of the users apart (`split_streams`).
+
+    :param stream: `InteractionStream`, its gru_length is the longest history
+        the trials may use
+    :return: dict of split: number of examples
+    """
+    stream.load_catalog()
+    counts = dict.fromkeys(SPLITS, 0)
+    for split, split_stream in split_streams(stream, validation, seed).items():
+        os.makedirs(os.path.join(path, split), exist_ok=True)
+        outputs = [
+            open(os.path.join(path, split, name), "wb")
+            for name in (USERS_FILE, ROWS_FILE, LABELS_FILE)
+        ]
+        try:
+            users_file, rows_file, labels_file = outputs
+            for user_data, rows, labels in split_stream.example_batches():
+                users_file.write(np.ascontiguousarray(user_data).tobytes())
+                rows_file.write(rows.astype(np.int64).tobytes())
+                labels_file.write(labels.astype(np.float32).tobytes())
+                counts[split] += len(rows)
+        finally:
+            for output in outputs:
+                output.close()
+
+    if stream.model == "bcfnet":
+        user_shape, user_dtype = [stream.user_size], "float32"
+    else:
+        user_shape, user_dtype = [stream.gru_length], "int64"
+    with open(os.path.join(path, META_FILE), "w") as meta:
+        json.dump(
+            {
+                "model": stream.model,
+                "store": os.path.abspath(stream.store.path),
+                "count": counts,
+                "user_shape": user_shape,
+                "user_dtype": user_dtype,
+                "negative_ratio": stream.negative_ratio,
+                "built_at": time.time(),
+            },
+            meta,
+        )
+    return counts
+
+
+class TrainingSet(object):
+    """
+    A split written by `write_training_set`, memory mapped.
+    """
+
+    def __init__(self, path, split="train"):
+        with open(os.path.join(path, META_FILE)) as meta:
+            self.meta = json.load(meta)
+        self.model = self.meta["model"]
+        self.store = EmbeddingStore(self.meta["store"])
+        count = self.meta["count"][split]
+        user_shape = (count, *self.meta["user_shape"])
+        self.users = self._map(
+            path, split, USERS_FILE, self.meta["user_dtype"], user_shape
+        )
+        self.rows = self._map(path, split, ROWS_FILE, np.int64, (count,))
+        self.labels = self._map(path, split, LABELS_FILE, np.float32, (count,))
+        self.epoch = 0
+
+    @staticmethod
+    def _map(path, split, name, dtype, shape):
+        # An empty file can not be memory mapped
+        if not shape[0]:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(
+            os.path.join(path, split, name), dtype=dtype, mode="r", shape=shape
+        )
+
+    def __len__(self):
+        return len(self.labels)
+
+    def batches(self, batch_size=256, gru_length=None, shuffle=True, seed=0):
+        """
+        :param gru_length: history length of the ZeroShot trial, default
+            the written one
+        :param shuffle: visit the batches in a new order every epoch
+        :return: iterator of ((user_input, item_input), labels) batches
+        """
+        gru_length = gru_length or self.meta["user_shape"][0]
+        starts = np.arange(0, len(self), batch_size)
+        if shuffle:
+            np.random.default_rng((seed, self.epoch)).shuffle(starts)
+        self.epoch += 1
+        for start in starts:
+            users = np.asarray(self.users[start : start + batch_size])
+            if self.model == "zeroshot":
+                users = gather_histories(self.store, users[:, -gru_length:])
+            rows = self.rows[start : start + batch_size]
+            items = np.asarray(self.store.vectors[rows], np.float32)
+            yield (users, items), np.asarray(self.labels[start : start + batch_size])
+
+    def dataset(self, batch_size=256, gru_length=None, shuffle=True, seed=0):
+        """
+        The split as a `tf.data.Dataset`, for `model.fit(dataset, None)`
+        """
+        import tensorflow as tf
+
+        gru_length = gru_length or self.meta["user_shape"][0]
+        if self.model == "bcfnet":
+            user_shape = (None, *self.meta["user_shape"])
+        else:
+            user_shape = (None, gru_length, self.store.dim)
+        signature = (
+            (
+                tf.TensorSpec(user_shape, tf.float32),
+                tf.TensorSpec((None, self.store.dim), tf.float32),
+            ),
+            tf.TensorSpec((None,), tf.float32),
+        )
+        return tf.data.Dataset.from_generator(
+            lambda: self.batches(batch_size, gru_length, shuffle, seed),
+            output_signature=signature,
+        ).prefetch(tf.data.AUTOTUNE)
+
+
+def init_worker(threads):
+    """
+    Cap the TensorFlow threads of a worker process, once before any model
+    is built. The BLAS variables are set by the parent before the spawn.
+    """
+    global _threads
+    import tensorflow as tf
+
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(threads)
+    _threads = threads
+
+
+def train_trial(trial, model_name, config, data_path, output, epochs, batch_size):
+    """
+    Train one configuration and score it on the validation split.
+
+    :param trial: number of the trial, prefixes its checkpoint directory
+    :param config: constructor arguments of the model
+    :return: dict of the trial's configuration, checkpoint, losses and timing,
+        with `error` set instead when the training failed
+    """
+    result = {"trial": trial, "model": model_name, "config": config}
+    start = time.time()
+    try:
+        from .keras_models import BCFNet, ZeroShot
+
+        model = (BCFNet if model_name == "bcfnet" else ZeroShot)(**config)
+        # Checkpoints land next to each other under the sweep output
+        name = os.path.basename(os.path.dirname(model.backup_path))
+        model.backup_path = os.path.join(output, f"{trial:03d}__{name}", "mdl.ckpt")
+        model.cp_callback.filepath = model.backup_path
+
+        gru_length = getattr(model, "gru_length", None)
+        train = TrainingSet(data_path)
+        history = model.fit(
+            train.dataset(batch_size, gru_length, seed=trial), None, epochs, verbose=0
+        )
+        result["loss"] = float(history.history["loss"][-1])
+        result["train_seconds"] = time.time() - start
+
+        validation = TrainingSet(data_path, "validation")
+        if len(validation):
+            val_loss, val_rmse = model.model.evaluate(
+                validation.dataset(batch_size, gru_length, shuffle=False), verbose=0
+            )
+            result["val_loss"], result["val_rmse"] = float(val_loss), float(val_rmse)
+        weights = os.path.splitext(model.backup_path)[0] + ".npz"
+        model.export_weights(weights)
+        result.update(
+            checkpoint=model.backup_path,
+            weights=weights,
+            epochs=epochs,
+            examples_per_second=epochs * len(train) / result["train_seconds"],
+        )
+    except Exception as error:
+        logger.exception("Trial %d (%s) failed", trial, config)
+        result["error"] = repr(error)
+    result["threads"] = _threads
+    result["seconds"] = time.time() - start
+    return result
+
+
+def run_trial(arguments):
+    # `train_trial` for Pool.imap_unordered, which passes a single argument
+    return train_trial(*arguments)
+
+
+def write_leaderboard(path, sweep, results):
+    """
+    Write the finished trials, best validation loss first, failed ones last.
+    """
+    ranked = sorted(
+        results,
+        key=lambda result: (
+            "error" in result,
+            result.get("val_loss", result.get("loss", np.inf)),
+        ),
+    )
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as leaderboard:
+        json.dump({"sweep": sweep, "trials": ranked}, leaderboard, indent=2)
+    os.replace(tmp_path, path)
+    return ranked
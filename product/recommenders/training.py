@@ -0,0 +1,407 @@
+"""
+Training data of BCFNet and ZeroShot, streamed from the Interaction table.
+
+`InteractionStream` reads the interactions ordered by user, `chunk_size`
+rows at a time through `QuerySet.iterator` (a server-side cursor on
+PostgreSQL), so a chunk always holds whole users. Every interaction is a
+positive example, and `negative_ratio` items the user never rated are drawn
+per positive. A chunk only keeps store rows; the 768-d vectors are gathered
+from the memory mapped store batch by batch, so the memory stays bounded
+whatever the size of the log.
+
+- bcfnet: ((batch, 100) category profile, (batch, 768) item), label. The
+  profile counts the categories of every item of the user except the
+  scored one, normalized as `cf_filter` does.
+- zeroshot: ((batch, gru_length, 768) items rated before, (batch, 768)
+  item), label. The history is zero padded at the front.
+
+The batches are built by a background thread while the model trains on the
+previous ones.
+"""
+import queue
+import threading
+from itertools import islice
+
+import numpy as np
+
+from .serving import BCFNET_CONFIG
+from .store import get_store
+
+
+def ragged_take(offsets, values, rows):
+    """
+    Concatenated values of several rows of a ragged (CSR) array.
+
+    :param offsets: (n_rows + 1,) start of every row in `values`
+    :param rows: rows to read
+    :return: (owners, values), the position in `rows` of every value
+    """
+    starts, stops = offsets[rows], offsets[np.asarray(rows) + 1]
+    lengths = stops - starts
+    owners = np.repeat(np.arange(len(lengths)), lengths)
+    # Position of every value inside its row
+    inner = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return owners, values[starts[owners] + inner]
+
+
+def sample_negatives(owners, seen, candidates, ratio, rng, n_rows, max_tries=10):
+    """
+    Draw `ratio` unseen items per positive, without a Python loop per item.
+
+    :param owners: (n,) user of every positive
+    :param seen: sorted (user * n_rows + row) keys of the rated items
+    :param candidates: store rows that can be drawn
+    :param n_rows: rows of the store
+    :param ratio: negatives per positive
+    :return: (owners, rows, positives) of the negatives, `positives` being
+        the index in `owners` of the positive each one was drawn for.
+        Draws still clashing after `max_tries` are dropped.
+    """
+    if not len(candidates):
+        ratio = 0
+    positives = np.repeat(np.arange(len(owners)), ratio)
+    owners = owners[positives]
+    rows = candidates[rng.integers(len(candidates), size=len(owners))]
+    clash = np.ones(len(owners), dtype=bool)
+    for _ in range(max_tries):
+        keys = owners[clash] * n_rows + rows[clash]
+        index = np.minimum(np.searchsorted(seen, keys), len(seen) - 1)
+        clash[clash] = seen[index] == keys
+        if not clash.any():
+            break
+        rows[clash] = candidates[rng.integers(len(candidates), size=clash.sum())]
+    keep = ~clash
+    return owners[keep], rows[keep], positives[keep]
+
+
+def gather_histories(store, history_rows):
+    """
+    :param history_rows: (n, length) store rows, -1 for padding
+    :return: (n, length, dim) float32 vectors, zero for padding
+    """
+    rows = np.maximum(history_rows, 0)
+    vectors = np.asarray(store.vectors[rows.ravel()], np.float32)
+    vectors = vectors.reshape(history_rows.shape + (store.dim,))
+    vectors[history_rows < 0] = 0
+    return vectors
+
+
+def prefetch(iterable, size=4):
+    """
+    Iterate `iterable` in a background thread, `size` items ahead.
+
+    Exceptions of the thread are raised in the caller.
+    """
+    if not size:
+        yield from iterable
+        return
+    items = queue.Queue(size)
+    stop = threading.Event()
+    end = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                while not stop.is_set():
+                    try:
+                        items.put((item, None), timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+                if stop.is_set():
+                    return
+            items.put((end, None))
+        except BaseException as error:
+            items.put((end, error))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is end:
+                return
+            yield item
+    finally:
+        # The consumer stopped early, e.g. a Keras epoch ended
+        stop.set()
+
+
+class InteractionStream(object):
+    """
+    :param model: "bcfnet" or "zeroshot"
+    :param negative_ratio: negatives drawn per interaction
+    :param batch_size: examples per batch
+    :param chunk_size: interactions read from the database at a time
+    :param gru_length: history length of zeroshot
+    :param user_size: categories of the bcfnet profile
+    :param prefetch: batches prepared ahead by the background thread,
+        0 to prepare them in the consuming thread
+    :param queryset: interactions to train on, default all of them
+    :param store: embedding store, default the served one
+    :param holdout_last: leave out the latest interaction of every user who
+        has an earlier one, the items `Evaluation` holds out, to train a
+        model that is evaluated afterwards
+    """
+
+    def __init__(
+        self,
+        model="bcfnet",
+        negative_ratio=4,
+        batch_size=256,
+        chunk_size=65536,
+        gru_length=20,
+        user_size=BCFNET_CONFIG["user_size"],
+        prefetch=8,
+        queryset=None,
+        store=None,
+        seed=0,
+        holdout_last=False,
+    ):
+        if model not in ("bcfnet", "zeroshot"):
+            raise ValueError(f"Unknown model {model}")
+        self.model = model
+        self.negative_ratio = negative_ratio
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.gru_length = gru_length
+        self.user_size = user_size
+        self.prefetch = prefetch
+        self.queryset = queryset
+        self.store = store or get_store()
+        self.seed = seed
+        self.holdout_last = holdout_last
+        self.epoch = 0
+        self._categories = None
+        self.candidates = None
+
+    def load_catalog(self):
+        """
+        Read the categories of every store row and the rows that have a book,
+        the negatives are drawn from `candidates`.
+        """
+        from product.models import Book
+
+        if self._categories is not None:
+            return
+        sku_rows = self.store.sku_rows
+        pairs = np.array(
+            list(
+                Book.categories.through.objects.filter(book__sku__gte=0)
+                .values_list("book__sku", "category__cf_index")
+                .iterator()
+            ),
+            dtype=np.int64,
+        ).reshape(-1, 2)
+        pairs = pairs[
+            (pairs[:, 0] < len(sku_rows))
+            & (pairs[:, 1] >= 0)
+            & (pairs[:, 1] < self.user_size)
+        ]
+        rows = sku_rows[pairs[:, 0]]
+        pairs, rows = pairs[rows >= 0], rows[rows >= 0]
+        order = np.argsort(rows, kind="stable")
+        offsets = np.zeros(len(self.store) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(self.store)), out=offsets[1:])
+        self._categories = offsets, pairs[order, 1]
+
+        skus = np.fromiter(
+            Book.objects.filter(sku__gte=0, sku__lt=len(sku_rows))
+            .values_list("sku", flat=True)
+            .iterator(),
+            dtype=np.int64,
+        )
+        rows = sku_rows[skus]
+        self.candidates = np.unique(rows[rows >= 0])
+
+    def chunks(self):
+        """
+        :return: iterator of (users, rows), the interactions of whole users,
+            by user and oldest first. `users` are positions in the chunk.
+        """
+        from django.db import connection
+        from interaction.models import Interaction
+
+        queryset = self.queryset
+        if queryset is None:
+            queryset = Interaction.objects.all()
+        interactions = (
+            queryset.order_by("user_id", "created_at", "id")
+            .values_list("user_id", "book__sku")
+            .iterator(chunk_size=self.chunk_size)
+        )
+        try:
+            sku_rows = self.store.sku_rows
+            carry = np.zeros((0, 2), dtype=np.int64)
+            while True:
+                block = np.array(
+                    list(islice(interactions, self.chunk_size)), dtype=np.int64
+                ).reshape(-1, 2)
+                data = np.concatenate([carry, block])
+                carry = data[:0]
+                if len(block) == self.chunk_size:
+                    # The last user may go on in the next block
+                    split = np.searchsorted(data[:, 0], data[-1, 0])
+                    if split == 0:
+                        carry = data
+                        continue
+                    carry, data = data[split:], data[:split]
+                skus = data[:, 1]
+                rows = np.full(len(data), -1, dtype=np.int64)
+                in_range = (skus >= 0) & (skus < len(sku_rows))
+                rows[in_range] = sku_rows[skus[in_range]]
+                users = np.unique(data[:, 0], return_inverse=True)[1]
+                users, rows = users[rows >= 0], rows[rows >= 0]
+                if self.holdout_last and len(rows):
+                    users, rows = self._drop_last(users, rows)
+                if len(rows):
+                    yield users, rows
+                if len(block) < self.chunk_size:
+                    return
+        finally:
+            if threading.current_thread() is not threading.main_thread():
+                # Opened by the prefetching thread, which never reuses it
+                connection.close()
+
+    @staticmethod
+    def _drop_last(users, rows):
+        # Held out as in `Evaluation.batches`: the last interaction of every
+        # user with more than one, so no user is dropped entirely
+        changes = users[1:] != users[:-1]
+        first = np.concatenate([[True], changes])
+        last = np.concatenate([changes, [True]])
+        keep = first | ~last
+        return users[keep], rows[keep]
+
+    def examples(self, users, rows, rng):
+        """
+        Positives and sampled negatives of a chunk, shuffled.
+
+        :return: dict of (n,) arrays: `users`, `rows`, `labels` and
+            `positions`, the chunk interaction the example was made from
+        """
+        n_rows = len(self.store)
+        seen = np.unique(users * n_rows + rows)
+        negative_users, negative_rows, positions = sample_negatives(
+            users, seen, self.candidates, self.negative_ratio, rng, n_rows
+        )
+        examples = {
+            "users": np.concatenate([users, negative_users]),
+            "rows": np.concatenate([rows, negative_rows]),
+            "labels": np.concatenate(
+                [np.ones(len(users)), np.zeros(len(negative_users))]
+            ).astype(np.float32),
+            "positions": np.concatenate([np.arange(len(users)), positions]),
+        }
+        order = rng.permutation(len(examples["rows"]))
+        return {name: values[order] for name, values in examples.items()}
+
+    def category_counts(self, owners, rows, size):
+        """
+        :return: (size, user_size) category counts of the rows, summed per owner
+        """
+        positions, categories = ragged_take(*self._categories, rows)
+        counts = np.bincount(
+            owners[positions] * self.user_size + categories,
+            minlength=size * self.user_size,
+        )
+        return counts.reshape(size, self.user_size).astype(np.float32)
+
+    def example_batches(self):
+        """
+        `batches` before the vectors are read from the store.
+
+        :return: iterator of (user_data, rows, labels) batches, `user_data`
+            being the profiles for bcfnet and the `history_rows` for zeroshot
+        """
+        self.load_catalog()
+        rng = np.random.default_rng((self.seed, self.epoch))
+        self.epoch += 1
+        for users, rows in self.chunks():
+            examples = self.examples(users, rows, rng)
+            if self.model == "bcfnet":
+                profiles = self.category_counts(users, rows, users.max() + 1)
+            else:
+                starts = np.searchsorted(users, np.arange(users.max() + 1))
+            for start in range(0, len(examples["rows"]), self.batch_size):
+                batch = {
+                    name: values[start : start + self.batch_size]
+                    for name, values in examples.items()
+                }
+                if self.model == "bcfnet":
+                    user_data = self.profiles(profiles, batch)
+                else:
+                    user_data = self.history_rows(rows, starts, batch)
+                yield user_data, batch["rows"], batch["labels"]
+
+    def batches(self):
+        """
+        :return: iterator of ((user_input, item_input), labels) batches
+        """
+        for user_data, rows, labels in self.example_batches():
+            if self.model == "zeroshot":
+                user_data = gather_histories(self.store, user_data)
+            items = np.asarray(self.store.vectors[rows], np.float32)
+            yield (user_data, items), labels
+
+    def profiles(self, profiles, batch):
+        """
+        BCFNet user input of a batch of examples.
+
+        :param profiles: `category_counts` of the users of the chunk
+        """
+        user_input = profiles[batch["users"]]
+        # Leave the scored item out of its user's profile
+        positives = np.flatnonzero(batch["labels"] > 0)
+        user_input[positives] -= self.category_counts(
+            np.arange(len(positives)), batch["rows"][positives], len(positives)
+        )
+        totals = user_input.sum(axis=1, keepdims=True)
+        return user_input / np.where(totals > 0, totals, 1)
+
+    def history_rows(self, rows, starts, batch):
+        """
+        Store rows of the gru_length interactions before the example's one,
+        oldest first and padded with -1 at the front.
+
+        :param rows: store rows of the chunk interactions
+        :param starts: first interaction of every user of the chunk
+        """
+        window = batch["positions"][:, None] + np.arange(-self.gru_length, 0)
+        valid = window >= starts[batch["users"]][:, None]
+        return np.where(valid, rows[np.where(valid, window, 0)], -1)
+
+    def histories(self, rows, starts, batch):
+        """
+        ZeroShot user input of a batch of examples, the vectors of the
+        `history_rows`.
+        """
+        return gather_histories(self.store, self.history_rows(rows, starts, batch))
+
+    def __iter__(self):
+        return prefetch(self.batches(), self.prefetch)
+
+    def dataset(self):
+        """
+        The stream as a `tf.data.Dataset`, for `model.fit(dataset, None)`.
+
+        Every epoch reads the interactions again and draws new negatives.
+        """
+        import tensorflow as tf
+
+        if self.model == "bcfnet":
+            user_shape = (None, self.user_size)
+        else:
+            user_shape = (None, self.gru_length, self.store.dim)
+        signature = (
+            (
+                tf.TensorSpec(user_shape, tf.float32),
+                tf.TensorSpec((None, self.store.dim), tf.float32),
+            ),
+            tf.TensorSpec((None,), tf.float32),
+        )
+        return tf.data.Dataset.from_generator(
+            self.__iter__, output_signature=signature
+        ).prefetch(tf.data.AUTOTUNE)
@@ -1,3 +1,4 @@
+from django.db.models import Prefetch, QuerySet, prefetch_related_objects
 from rest_framework import serializers
 
 from .models import Book, Category, Author, Image
@@ -75,7 +76,37 @@ class PublisherSerializer(serializers.ModelSerializer):
         model = Book
         fields = ['publisher']
 
-class ItemSerializer(serializers.ModelSerializer):
+class BookPrefetchMixin:
+    """
+    Relations read by a book serializer, loaded for a whole list by `prefetch`.
+    'images' stands for the images of the book, oldest first, read by `get_image`.
+    """
+    prefetch_lookups = ('images',)
+
+    @classmethod
+    def prefetch(cls, books):
+        """
+        Load everything the serializer reads of `books`, a queryset or a list,
+        in one query per relation instead of one per book.
+        """
+        lookups = [
+            Prefetch('image_set', queryset=Image.objects.order_by('created_at', 'id'), to_attr='images')
+            if lookup == 'images' else lookup
+            for lookup in cls.prefetch_lookups
+        ]
+        if isinstance(books, QuerySet):
+            return books.prefetch_related(*lookups)
+        prefetch_related_objects(books, *lookups)
+        return books
+
+    def get_image(self, instance):
+        images = getattr(instance, 'images', None)
+        if images is None:
+            images = Image.objects.filter(book=instance).order_by('created_at', 'id')[:1]
+        return images[0].url if images else ''
+
+
+class ItemSerializer(BookPrefetchMixin, serializers.ModelSerializer):
     # categories = CategorySerializer(read_only=True, many=True)
     # authors = AuthorSerializer(read_only=True, many=True)
     image = serializers.SerializerMethodField()
@@ -83,21 +114,11 @@ class ItemSerializer(serializers.ModelSerializer):
         model = Book
         fields = ['uid','name', 'rating', 'price', 'image', 'rating_count', 'rating_sum','discount']
 
-    def get_image(self, instance):
-        try: 
-            return Image.objects.get(book=instance).url
-        except:
-            return ''
-
-class ItemInfoSerializer(serializers.ModelSerializer):
+class ItemInfoSerializer(BookPrefetchMixin, serializers.ModelSerializer):
     authors = AuthorSerializer(read_only=True, many=True)
     image = serializers.SerializerMethodField()
     class Meta:
         model = Book
         fields = ('uid','name', 'rating', 'price', 'image', 'rating_count', 'rating_sum','discount', 'description', 'authors', 'number_pages', 'issuing_company', 'publisher')
 
-    def get_image(self, instance):
-        try: 
-            return Image.objects.get(book=instance).url
-        except:
-            return ''
\ No newline at end of file
+    prefetch_lookups = ('images', 'authors')
@@ -0,0 +1,35 @@
+from django.db.models.signals import post_save, pre_save
+from django.dispatch import receiver
+
+from utils.services import product as product_services
+
+from .models import Book
+
+
+@receiver(pre_save, sender=Book)
+def compare_embedding_text(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Only on save, so loading a book costs nothing more: the text fields being
+    # saved are compared with the stored ones
+    if raw or instance._state.adding:
+        return
+    fields = [
+        name
+        for name in Book.EMBEDDING_FIELDS
+        if name in instance.__dict__
+        and (update_fields is None or name in update_fields)
+    ]
+    stored = {}
+    if fields:
+        stored = Book.objects.filter(pk=instance.pk).values(*fields).first()
+    instance._embedding_changed = stored is None or any(
+        stored[name] != getattr(instance, name) for name in fields
+    )
+
+
+@receiver(post_save, sender=Book)
+def queue_embedding_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created or instance.sku < 0 or getattr(instance, '_embedding_changed', True):
+        product_services.enqueue_embedding([instance.pk])
+    instance._embedding_changed = False
@@ -1,3 +1,1029 @@
-from django.test import TestCase
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+from django.test import RequestFactory, SimpleTestCase, TestCase
+
+from utils.services import product as product_services
+from utils.services import recommendation as recommendation_services
+
+from .filters import ContentFilter
+from .models import Author, Book, Category, EmbeddingJob, Image
+from .recommenders import batch, related, sweep
+from .recommenders.ann import IVFIndex
+from .recommenders.batcher import MicroBatcher
+from .recommenders.codecs import Float16Codec, Int8Codec, PQCodec
+from .recommenders.encoders import HashingEncoder
+from .recommenders.evaluation import Evaluation, content_scorer
+from .recommenders.numpy_engine import NumpyBCFNet, NumpyZeroShot
+from .recommenders.ranking import rank_queryset, top_k, top_k_rows
+from .recommenders.reduction import PROJECTION_FILE, fit_projection, reduce_store
+from .recommenders.store import EmbeddingStore, append_store, get_store, write_meta
+from .recommenders.training import InteractionStream, sample_negatives
+from .serializers import ItemSerializer
 
 # Create your tests here.
+
+HAS_TENSORFLOW = importlib.util.find_spec("tensorflow") is not None
+
+
+@unittest.skipUnless(HAS_TENSORFLOW, "tensorflow is not installed")
+class NumpyEngineParityTest(SimpleTestCase):
+    def setUp(self):
+        from tensorflow import keras
+
+        if getattr(keras, "__version__", "2").startswith("3."):
+            self.skipTest("the models are written for tf.keras 2")
+        self.rng = np.random.default_rng(0)
+
+    def _export(self, model, engine_class):
+        for weight in model.model.weights:
+            weight.assign(self.rng.normal(scale=0.05, size=weight.shape))
+        with tempfile.TemporaryDirectory() as path:
+            model.export_weights(os.path.join(path, "mdl.npz"))
+            return engine_class.load(os.path.join(path, "mdl.npz"))
+
+    def test_bcfnet(self):
+        from .recommenders.keras_models import BCFNet
+
+        model = BCFNet(
+            representation_layers=[32, 16], balance_size=8, matching_layers=[32, 16]
+        )
+        engine = self._export(model, NumpyBCFNet)
+        user = self.rng.random(100)
+        items = self.rng.normal(size=(20, 768)).astype(np.float32)
+
+        expected = model.predict(user, items)
+        np.testing.assert_allclose(engine.predict(user, items), expected, atol=1e-5)
+        engine.cache_items(items, batch_size=8)
+        np.testing.assert_allclose(
+            engine.predict_cached(user, [3, 1, 17]), expected[[3, 1, 17]], atol=1e-5
+        )
+
+        other = self.rng.random(100)
+        requests = [(user, [3, 1, 17]), (other, [0, 5])]
+        model.cache_items(items)
+        for scorer in (engine, model):
+            batched = scorer.predict_cached_many(requests)
+            np.testing.assert_allclose(batched[0], expected[[3, 1, 17]], atol=1e-5)
+            np.testing.assert_allclose(
+                batched[1], model.predict(other, items)[[0, 5]], atol=1e-5
+            )
+
+    def test_zeroshot(self):
+        from .recommenders.keras_models import ZeroShot
+
+        model = ZeroShot(size1=32, size2=16, gru_length=4)
+        engine = self._export(model, NumpyZeroShot)
+        user = self.rng.normal(size=(4, 768)).astype(np.float32)
+        items = self.rng.normal(size=(20, 768)).astype(np.float32)
+
+        expected = model.predict(user, items)
+        np.testing.assert_allclose(engine.predict(user, items), expected, atol=1e-5)
+        engine.build_index(items)
+        rows, scores = engine.retrieve(user, k=5)
+        np.testing.assert_allclose(scores, expected[rows, 0], atol=1e-5)
+
+        other = self.rng.normal(size=(4, 768)).astype(np.float32)
+        batched = engine.retrieve_many([(user, 5, None), (other, 3, [2, 4, 6, 8])])
+        np.testing.assert_array_equal(batched[0][0], rows)
+        other_rows, other_scores = engine.retrieve(other, k=3, rows=[2, 4, 6, 8])
+        np.testing.assert_array_equal(batched[1][0], other_rows)
+        np.testing.assert_allclose(batched[1][1], other_scores, atol=1e-6)
+
+        engine.build_ann(nlist=4, nprobe=4)
+        ann_rows, ann_scores = engine.retrieve(user, k=5)
+        np.testing.assert_array_equal(ann_rows, rows)
+        np.testing.assert_allclose(ann_scores, scores, atol=1e-6)
+
+
+class MicroBatcherTest(SimpleTestCase):
+    def test_batches_concurrent_requests(self):
+        batches = []
+
+        def square(requests):
+            batches.append(len(requests))
+            return [x * x for x, in requests]
+
+        batcher = MicroBatcher(square, window=0.05, max_batch_size=4, log_every=0)
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(batcher, range(8)))
+
+        self.assertEqual(results, [x * x for x in range(8)])
+        self.assertEqual(sum(batches), 8)
+        self.assertLess(len(batches), 8)
+        self.assertLessEqual(max(batches), 4)
+        self.assertEqual(batcher.metrics()["requests"], 8)
+
+    def test_propagates_errors(self):
+        def fail(requests):
+            raise ValueError("broken model")
+
+        batcher = MicroBatcher(fail, window=0, log_every=0)
+        with self.assertRaisesMessage(ValueError, "broken model"):
+            batcher(1)
+
+    def test_metrics_while_serving(self):
+        batcher = MicroBatcher(
+            lambda requests: [x for x, in requests], window=0, log_every=0
+        )
+        with ThreadPoolExecutor(8) as pool:
+            served = pool.map(batcher, range(2000))
+            snapshots = [pool.submit(batcher.metrics) for _ in range(200)]
+            self.assertEqual(list(served), list(range(2000)))
+            for snapshot in snapshots:
+                self.assertLessEqual(snapshot.result()["requests"], 2000)
+        self.assertEqual(batcher.metrics()["requests"], 2000)
+
+    def test_result_count_mismatch(self):
+        batcher = MicroBatcher(
+            lambda requests: [0] * (len(requests) - 1), window=0.05, log_every=0
+        )
+        futures = [batcher.submit(x) for x in range(3)]
+        for future in futures:
+            with self.assertRaisesMessage(ValueError, "2 results for 3 requests"):
+                future.result(timeout=5)
+
+
+def bcfnet_weights(rng, user_size, item_size, representation, balance, matching):
+    """
+    Random `NumpyBCFNet` weights of the layer shapes of `BCFNet`
+    """
+    shapes = {"output": (representation[-1] + balance + matching[-1], 1)}
+    for side, size in (("user", user_size), ("item", item_size)):
+        shapes[f"representation_{side}"] = (size, representation[0] // 2)
+        shapes[f"representation_{side}_attention"] = (representation[0] // 2,) * 2
+        shapes[f"balance_{side}"] = (size, balance)
+        shapes[f"matching_{side}"] = (size, matching[0] // 4)
+        for i, layer in enumerate(representation):
+            previous = representation[i - 1] if i else representation[0]
+            shapes[f"representation_{side}_mlp_{i}"] = (previous, layer)
+    shapes["matching_attention"] = (matching[0] // 2,) * 2
+    for i, layer in enumerate(matching):
+        shapes[f"matching_mlp_{i}"] = (matching[i - 1] if i else matching[0], layer)
+
+    weights = {
+        "config": np.array(
+            json.dumps(
+                {
+                    "user_size": user_size,
+                    "activation": "relu",
+                    "representation_layers": representation,
+                    "matching_layers": matching,
+                }
+            )
+        )
+    }
+    for name, shape in shapes.items():
+        weights[f"{name}/kernel"] = rng.normal(scale=0.5, size=shape)
+        weights[f"{name}/bias"] = rng.normal(scale=0.1, size=shape[1])
+    return weights
+
+
+def zeroshot_weights(rng, item_size, hidden, size, gru_length):
+    """
+    Random `NumpyZeroShot` weights of the layer shapes of `ZeroShot`
+    """
+    weights = {"config": np.array(json.dumps({"gru_length": gru_length}))}
+    for name, shape in (("dense_0", (item_size, hidden)), ("dense_1", (hidden, size))):
+        weights[f"{name}/kernel"] = rng.normal(scale=0.5, size=shape)
+        weights[f"{name}/bias"] = rng.normal(scale=0.1, size=shape[1])
+    weights["gru/kernel"] = rng.normal(scale=0.5, size=(size, 3 * size))
+    weights["gru/recurrent_kernel"] = rng.normal(scale=0.5, size=(size, 3 * size))
+    weights["gru/bias"] = rng.normal(scale=0.1, size=(2, 3 * size))
+    return weights
+
+
+class PrecomputeTest(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.items = rng.normal(size=(12, 8)).astype(np.float32)
+        model = NumpyBCFNet(bcfnet_weights(rng, 5, 8, [8, 4], 4, [8, 4]))
+        model.cache_items(self.items)
+        state = (batch._model, batch._model_name, batch._candidates)
+        self.addCleanup(setattr, batch, "_model", state[0])
+        self.addCleanup(setattr, batch, "_model_name", state[1])
+        self.addCleanup(setattr, batch, "_candidates", state[2])
+        batch._model, batch._model_name = model, "bcfnet"
+        batch._candidates = np.arange(1, 12)
+
+    def test_score_chunk(self):
+        user_data = np.array([[1, 0, 3, 0, 0], [0, 0, 0, 0, 0], [2, 2, 0, 0, 1]])
+        rated_rows = [np.array([2, 5]), np.array([], dtype=np.int64), np.arange(12)]
+        with mock.patch.object(batch, "MAX_PAIRS", 20):
+            results = batch.score_chunk([7, 8, 9], user_data, rated_rows, 4)
+
+        self.assertEqual([user_id for user_id, _, _ in results], [7, 8, 9])
+        for (user_id, rows, scores), counts, rated in zip(
+            results, user_data, rated_rows
+        ):
+            total = counts.sum()
+            expected = batch._model.predict_cached(
+                counts / total if total else counts, batch._candidates
+            )
+            allowed = ~np.isin(batch._candidates, rated)
+            best = np.sort(expected[allowed])[::-1][:4]
+            np.testing.assert_allclose(scores, best, atol=1e-6)
+            self.assertFalse(np.isin(rows, rated).any())
+            self.assertFalse(np.isin(rows, [0]).any())
+        # Every candidate rated
+        self.assertEqual(len(results[2][1]), 0)
+
+    def test_gru_length(self):
+        from django.core.management import CommandError, call_command
+
+        with tempfile.TemporaryDirectory() as path:
+            weights = os.path.join(path, "mdl.npz")
+            np.savez(weights, config=np.array(json.dumps({"gru_length": 4})))
+            with self.assertRaisesMessage(CommandError, "--gru-length 4"):
+                call_command(
+                    "precompute_recommendations",
+                    model="zeroshot",
+                    checkpoint=os.path.join(path, "mdl.ckpt"),
+                    gru_length=20,
+                    workers=0,
+                )
+
+    def test_precomputed_recommendation(self):
+        from interaction.models import Interaction
+        from user_account.models import User
+
+        from .models import UserRecommendation
+
+        user = User.objects.create(email="a@b.c", name="")
+        book = Book.objects.create(name="The sea")
+        first = Interaction.objects.create(
+            user=user, book=book, rating=4, content="", header=""
+        )
+        UserRecommendation.objects.create(user=user, books=[3, 1, 2], scores=[])
+        self.assertEqual(
+            recommendation_services.get_precomputed_recommendation(
+                user.pk, first.updated_at, 2
+            ),
+            [3, 1],
+        )
+
+        newer = Interaction.objects.create(
+            user=user,
+            book=Book.objects.create(name="Time"),
+            rating=5,
+            content="",
+            header="",
+        )
+        self.assertIsNone(
+            recommendation_services.get_precomputed_recommendation(
+                user.pk, newer.updated_at
+            )
+        )
+
+
+class RankingTest(TestCase):
+    def test_top_k(self):
+        rng = np.random.default_rng(0)
+        distinct = rng.permutation(20).astype(float)
+        ties = rng.integers(3, size=20).astype(float)
+        for scores in (distinct, ties, np.zeros(0)):
+            expected = np.argsort(-scores, kind="stable")
+            for k in (0, 1, 5, 20, 30, None):
+                best = top_k(scores, k)
+                self.assertEqual(len(best), len(expected[:k]))
+                np.testing.assert_array_equal(scores[best], scores[expected[:k]])
+                self.assertEqual(len(set(best.tolist())), len(best))
+            # Everything ranked: the stable order itself
+            np.testing.assert_array_equal(top_k(scores, None), expected)
+        np.testing.assert_array_equal(top_k(distinct, 5), np.argsort(-distinct)[:5])
+
+    def test_top_k_rows(self):
+        rng = np.random.default_rng(0)
+        for scores in (rng.normal(size=(4, 20)), rng.integers(3, size=(4, 20))):
+            expected = np.argsort(-scores, axis=1, kind="stable")
+            for k in (0, 1, 5, 20, 30):
+                best = top_k_rows(scores, k)
+                self.assertEqual(best.shape, (4, min(k, 20)))
+                np.testing.assert_array_equal(
+                    np.take_along_axis(scores, best, axis=1),
+                    np.take_along_axis(scores, expected[:, :k], axis=1),
+                )
+                for row in best:
+                    self.assertEqual(len(set(row.tolist())), len(row))
+
+    def test_rank_queryset(self):
+        books = [Book.objects.create(name=str(sku), sku=sku) for sku in range(4)]
+        ranked = rank_queryset(Book.objects.all(), [2, 0, 3], [0.9, 0.5, 0.1])
+        self.assertEqual(list(ranked), [books[2], books[0], books[3]])
+        self.assertEqual([book.score for book in ranked], [0.9, 0.5, 0.1])
+        self.assertFalse(rank_queryset(Book.objects.all(), []).exists())
+
+
+class IVFIndexTest(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        centers = rng.normal(size=(8, 16))
+        self.vectors = (
+            centers[rng.integers(8, size=400)] + rng.normal(scale=0.3, size=(400, 16))
+        ).astype(np.float32)
+        self.queries = self.vectors[:20]
+
+    def test_full_probe_is_exact(self):
+        index = IVFIndex(self.vectors).train(nlist=8)
+        for query in self.queries:
+            found, scores = index.search(query, k=5, nprobe=8)
+            expected, expected_scores = index.exact(query, k=5)
+            np.testing.assert_array_equal(found, expected)
+            np.testing.assert_allclose(scores, expected_scores, atol=1e-6)
+
+    def test_tune_and_persist(self):
+        index = IVFIndex(self.vectors[:300]).train(nlist=8)
+        nprobe, recall = index.tune(self.queries, k=5, target_recall=0.9)
+        self.assertGreaterEqual(recall, 0.9)
+
+        # Rows appended to the matrix after training
+        index.vectors = self.vectors
+        index.add(np.arange(300, 400), IVFIndex(self.vectors).inverse_norms)
+        self.assertEqual(len(index), 400)
+        with tempfile.TemporaryDirectory() as path:
+            index.save(path)
+            loaded = IVFIndex.load(self.vectors, path)
+        self.assertEqual(loaded.nprobe, nprobe)
+        query = self.vectors[350]
+        np.testing.assert_array_equal(
+            loaded.search(query, k=3)[0], index.search(query, k=3)[0]
+        )
+
+
+    def test_dot_metric(self):
+        # Unnormalized, as the ZeroShot item index
+        scale = np.random.default_rng(1).uniform(0.5, 4, size=(400, 1))
+        vectors = (self.vectors * scale).astype(np.float32)
+        index = IVFIndex(vectors[:300], metric="dot").train(nlist=8)
+        index.add(np.arange(300, 400), vectors=vectors)
+
+        # Listed under the closest centroid of the L2 k-means
+        distances = ((vectors[:, None] - index.centroids[None]) ** 2).sum(axis=2)
+        lists = np.repeat(np.arange(index.nlist), np.diff(index.offsets))
+        np.testing.assert_array_equal(
+            lists[np.argsort(index.rows)], distances.argmin(axis=1)
+        )
+        for query in self.queries:
+            found, scores = index.search(query, k=5, nprobe=8)
+            expected, expected_scores = index.exact(query, k=5)
+            np.testing.assert_array_equal(found, expected)
+            np.testing.assert_allclose(scores, expected_scores, rtol=1e-5)
+
+    def test_zeroshot_ann(self):
+        rng = np.random.default_rng(0)
+        engine = NumpyZeroShot(zeroshot_weights(rng, 16, 12, 8, gru_length=3))
+        engine.build_index(self.vectors)
+        users = rng.normal(size=(5, 3, 16)).astype(np.float32)
+        expected = [engine.retrieve(user, k=5) for user in users]
+
+        engine.build_ann(nlist=8, nprobe=8)
+        self.assertEqual(engine._ann.metric, "dot")
+        for user, (rows, scores) in zip(users, expected):
+            found, found_scores = engine.retrieve(user, k=5)
+            np.testing.assert_array_equal(found, rows)
+            np.testing.assert_allclose(found_scores, scores, atol=1e-6)
+
+
+class EmbeddingStoreTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = directory.name
+        open(os.path.join(self.path, "vectors.f32"), "wb").close()
+        np.save(os.path.join(self.path, "skus.npy"), np.zeros(0, dtype=np.int64))
+        write_meta(self.path, {"count": 0, "dim": 4, "dtype": "float32"})
+        self.vectors = np.random.default_rng(0).normal(size=(6, 4))
+        # Sparse skus, 1 and 3 never get an embedding
+        append_store(self.path, [4, 0, 2], self.vectors[:3])
+
+    def test_sku_rows(self):
+        store = get_store(self.path)
+        np.testing.assert_array_equal(store.sku_rows, [1, -1, 2, -1, 0])
+
+        append_store(self.path, [9, 5, 6], self.vectors[3:])
+        latest = get_store(self.path)
+        self.assertIsNot(latest, store)
+        self.assertTrue(latest.extends(store))
+        np.testing.assert_array_equal(
+            latest.sku_rows, [1, -1, 2, -1, 0, 4, 5, -1, -1, 3]
+        )
+        np.testing.assert_allclose(
+            latest.vectors[latest.sku_rows[[4, 9]]], self.vectors[[0, 3]], rtol=1e-6
+        )
+        # The store opened before the append does not see the new rows
+        with self.assertLogs("product.recommenders.store", "WARNING"):
+            self.assertEqual(len(store.rows_for([9, 5])[0]), 0)
+
+    def test_missing_skus(self):
+        append_store(self.path, [9], self.vectors[3:4])
+        store = get_store(self.path)
+        with self.assertLogs("product.recommenders.store", "WARNING"):
+            skus, rows = store.rows_for([9, 3, -1, 2, 100, 2, 0])
+        # Unknown, negative and out of range skus are dropped, duplicates merged
+        np.testing.assert_array_equal(skus, [0, 2, 9])
+        np.testing.assert_array_equal(rows, [1, 2, 3])
+
+        with self.assertLogs("product.recommenders.store", "WARNING"):
+            skus, vectors = store.lookup([3, 4, 1000])
+        np.testing.assert_array_equal(skus, [4])
+        np.testing.assert_allclose(vectors, self.vectors[:1], rtol=1e-6)
+
+        with self.assertLogs("product.recommenders.store", "WARNING"):
+            skus, vectors = store.lookup([1, 3])
+        self.assertEqual(vectors.shape, (0, 4))
+        self.assertEqual(len(store.rows_for([])[1]), 0)
+
+
+class ReductionTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "store")
+        os.makedirs(self.path)
+        open(os.path.join(self.path, "vectors.f32"), "wb").close()
+        np.save(os.path.join(self.path, "skus.npy"), np.zeros(0, dtype=np.int64))
+        write_meta(self.path, {"count": 0, "dim": 32, "dtype": "float32"})
+        # Mostly 6 dimensional, as the BERT embeddings live near a subspace
+        rng = np.random.default_rng(0)
+        self.vectors = rng.normal(size=(200, 6)) @ rng.normal(size=(6, 32))
+        self.vectors += 0.05 * rng.normal(size=self.vectors.shape)
+        self.skus = np.arange(200) * 2
+        append_store(self.path, self.skus, self.vectors)
+
+    def neighbors(self, vectors):
+        vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        similarities = vectors @ vectors.T
+        np.fill_diagonal(similarities, -np.inf)
+        return np.argsort(-similarities, axis=1, kind="stable")[:, :5]
+
+    def assertReduced(self, method, dim, overlap):
+        path = reduce_store(dim, method, store_path=self.path)
+        self.assertEqual(path, os.path.join(self.path, f"{method}_{dim}"))
+        reduced = EmbeddingStore(path)
+        self.assertEqual(reduced.vectors.shape, (200, dim))
+        self.assertEqual(reduced.vectors.dtype, np.float32)
+        np.testing.assert_array_equal(reduced.skus, self.skus)
+        self.assertEqual(reduced.meta["source_dim"], 32)
+
+        projection = np.load(os.path.join(path, PROJECTION_FILE))
+        np.testing.assert_allclose(
+            reduced.vectors, self.vectors @ projection, rtol=1e-4, atol=1e-4
+        )
+        expected, found = self.neighbors(self.vectors), self.neighbors(reduced.vectors)
+        shared = [len(set(a) & set(b)) / 5 for a, b in zip(expected, found)]
+        self.assertGreaterEqual(np.mean(shared), overlap)
+
+    def test_pca(self):
+        projection = fit_projection(self.vectors, 8, "pca", block_size=64)
+        self.assertEqual(projection.shape, (32, 8))
+        self.assertEqual(projection.dtype, np.float32)
+        np.testing.assert_allclose(projection.T @ projection, np.eye(8), atol=1e-5)
+        self.assertReduced("pca", 8, 0.9)
+
+    def test_random(self):
+        projection = fit_projection(self.vectors, 16, "random", seed=3)
+        self.assertEqual(projection.shape, (32, 16))
+        self.assertEqual(projection.dtype, np.float32)
+        np.testing.assert_array_equal(
+            projection, fit_projection(self.vectors, 16, "random", seed=3)
+        )
+        self.assertReduced("random", 16, 0.5)
+
+        with self.assertRaises(ValueError):
+            fit_projection(self.vectors, 8, "svd")
+
+
+class CodecTest(SimpleTestCase):
+    def test_scores_match_decoded_vectors(self):
+        rng = np.random.default_rng(0)
+        vectors = rng.normal(size=(300, 32)).astype(np.float32)
+        queries = rng.normal(size=(4, 32)).astype(np.float32)
+        for codec, tolerance in (
+            (Float16Codec(), 1e-2),
+            (Int8Codec(), 0.1),
+            (PQCodec(subspaces=8, sample_size=300), None),
+        ):
+            codes = codec.fit(vectors).encode(vectors)
+            decoded = codec.decode(codes)
+            np.testing.assert_allclose(
+                codec.scores(codes, queries), decoded @ queries.T, atol=1e-4
+            )
+            if tolerance:
+                np.testing.assert_allclose(decoded, vectors, atol=tolerance)
+
+
+class RelatedTableTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store_path = os.path.join(directory.name, "store")
+        self.path = os.path.join(directory.name, "related")
+        os.makedirs(self.store_path)
+        open(os.path.join(self.store_path, "vectors.f32"), "wb").close()
+        np.save(
+            os.path.join(self.store_path, "skus.npy"), np.zeros(0, dtype=np.int64)
+        )
+        write_meta(self.store_path, {"count": 0, "dim": 8, "dtype": "float32"})
+        self.vectors = np.random.default_rng(0).normal(size=(24, 8))
+        append_store(self.store_path, np.arange(20), self.vectors[:20])
+        self.addCleanup(setattr, related, "_table", related._table)
+
+    def assertNeighbors(self, table, count):
+        vectors = self.vectors[:count]
+        vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        similarities = vectors @ vectors.T
+        np.fill_diagonal(similarities, -np.inf)
+        self.assertEqual(len(table), count)
+        for row in range(count):
+            rows, scores = table.related(row)
+            np.testing.assert_array_equal(
+                rows, np.argsort(-similarities[row], kind="stable")[:3]
+            )
+            np.testing.assert_allclose(scores, similarities[row, rows], atol=1e-2)
+
+    def test_build_and_update(self):
+        related.build_related(self.store_path, self.path, num=3, workers=0)
+        table = related.get_related_table(self.path)
+        self.assertNeighbors(table, 20)
+        self.assertIs(related.get_related_table(self.path), table)
+
+        append_store(self.store_path, np.arange(20, 24), self.vectors[20:])
+        self.assertEqual(related.update_related([], self.store_path, self.path), 4)
+        latest = related.get_related_table(self.path)
+        self.assertIsNot(latest, table)
+        self.assertNeighbors(latest, 24)
+
+
+class ContentModelTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = directory.name
+        open(os.path.join(self.path, "vectors.f32"), "wb").close()
+        np.save(os.path.join(self.path, "skus.npy"), np.zeros(0, dtype=np.int64))
+        write_meta(self.path, {"count": 0, "dim": 8, "dtype": "float32"})
+        self.vectors = np.random.default_rng(0).normal(size=(30, 8))
+        self.vectors[7] = 0
+        append_store(self.path, np.arange(30), self.vectors)
+
+    def test_similarity(self):
+        from .recommenders.CB_model import CB_MODEL
+
+        model = CB_MODEL(block_size=4, path=self.path).load()
+        norms = np.linalg.norm(self.vectors, axis=1, keepdims=True)
+        normalized = np.divide(
+            self.vectors, norms, out=np.zeros_like(self.vectors), where=norms > 0
+        )
+        base_rows, target_rows = [3, 7, 11], np.array([0, 5, 7, 12, 29, 3, 18])
+        cosines = normalized[target_rows] @ normalized[base_rows].T
+
+        np.testing.assert_allclose(
+            model._similarity(base_rows, target_rows, "mean"),
+            cosines.mean(axis=1),
+            atol=1e-5,
+        )
+        np.testing.assert_allclose(
+            model._similarity(base_rows, target_rows, "max"),
+            cosines.max(axis=1),
+            atol=1e-5,
+        )
+        np.testing.assert_array_equal(model._similarity([], target_rows), 0)
+        with self.assertRaises(ValueError):
+            model._similarity(base_rows, target_rows, "sum")
+
+
+class ContentFilterTest(TestCase):
+    def test_without_related_table(self):
+        category = Category.objects.create(name="sea", cf_index=0)
+        base = Book.objects.create(name="base")
+        near = Book.objects.create(name="near")
+        Book.objects.create(name="far")
+        base.categories.add(category)
+        near.categories.add(category)
+
+        cb = mock.Mock()
+        request = RequestFactory().get("/", {"id": str(base.uid)})
+        with mock.patch.object(
+            related, "get_related_table", return_value=None
+        ), mock.patch.dict(
+            sys.modules, {"product.recommenders.CB_model": SimpleNamespace(cb=cb)}
+        ):
+            result = ContentFilter().filter_queryset(request, Book.objects.all(), None)
+
+        # Scored on the fly among the books of the same categories
+        self.assertIs(result, cb.run.return_value)
+        base_books, candidates, num = cb.run.call_args[0]
+        self.assertEqual(list(base_books), [base])
+        self.assertEqual(list(candidates), [near])
+        self.assertEqual(num, ContentFilter.related_limit)
+
+
+class IngestionTest(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = directory.name
+        self.encoder = HashingEncoder(dim=16)
+        open(os.path.join(self.path, "vectors.f32"), "wb").close()
+        np.save(os.path.join(self.path, "skus.npy"), np.zeros(0, dtype=np.int64))
+        write_meta(self.path, {"count": 0, "dim": 16, "dtype": "float32"})
+        append_store(self.path, [0, 1], self.encoder.encode(["first", "second"]))
+
+    def test_hashing_encoder(self):
+        vectors = self.encoder.encode(["a sea story", "a sea story", "", "sea"])
+        np.testing.assert_allclose(vectors[0], vectors[1])
+        np.testing.assert_allclose(
+            np.linalg.norm(vectors, axis=1), [1, 1, 0, 1], atol=1e-6
+        )
+        np.testing.assert_allclose(
+            HashingEncoder(dim=16).encode(["a sea story"], batch_size=1)[0], vectors[0]
+        )
+
+    def test_new_and_edited_books(self):
+        store = get_store(self.path)
+        book = Book.objects.create(name="The sea", description="An old man")
+        Book.objects.create(name="Time", description="A brief history")
+        self.assertEqual(EmbeddingJob.objects.count(), 2)
+
+        count = product_services.ingest_embedding_queue(
+            encoder=self.encoder, store_path=self.path, update_indexes=False
+        )
+        self.assertEqual(count, 2)
+        self.assertFalse(EmbeddingJob.objects.exists())
+        book.refresh_from_db()
+        self.assertEqual(book.sku, 2)
+        self.assertEqual(sorted(Book.objects.values_list("sku", flat=True)), [2, 3])
+
+        # Reopened with the appended rows
+        latest = get_store(self.path)
+        self.assertIsNot(latest, store)
+        self.assertTrue(latest.extends(store))
+        self.assertEqual(len(latest), 4)
+        np.testing.assert_allclose(
+            latest.vectors[latest.sku_rows[2]],
+            self.encoder.encode([book.embedding_text])[0],
+        )
+
+        book = Book.objects.get(pk=book.pk)
+        book.price = 10
+        book.save()
+        self.assertFalse(EmbeddingJob.objects.exists())
+        # The stored text is only read when a text field is saved
+        with self.assertNumQueries(1):
+            book.save(update_fields=["price"])
+        book.description = "A young man"
+        book.save()
+        self.assertTrue(EmbeddingJob.objects.filter(book=book).exists())
+        product_services.ingest_embedding_queue(
+            encoder=self.encoder, store_path=self.path, update_indexes=False
+        )
+        latest = get_store(self.path)
+        self.assertEqual(len(latest), 5)
+        self.assertEqual(latest.sku_rows[2], 4)
+
+
+class InteractionStreamTest(TestCase):
+    def setUp(self):
+        from interaction.models import Interaction
+        from user_account.models import User
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        open(os.path.join(directory.name, "vectors.f32"), "wb").close()
+        np.save(os.path.join(directory.name, "skus.npy"), np.zeros(0, dtype=np.int64))
+        write_meta(directory.name, {"count": 0, "dim": 8, "dtype": "float32"})
+        # One-hot vectors, the store row of an item is its argmax
+        append_store(directory.name, np.arange(8), np.eye(8))
+        self.store = EmbeddingStore(directory.name)
+
+        categories = [
+            Category.objects.create(name=str(i), cf_index=i) for i in range(3)
+        ]
+        books = [Book.objects.create(name=str(sku), sku=sku) for sku in range(8)]
+        for book in books:
+            book.categories.add(categories[book.sku % 3])
+        self.rated = {}
+        for email, skus in (("a@b.c", [0, 1, 2, 4]), ("d@e.f", [3]), ("g@h.i", [5, 6])):
+            user = User.objects.create(email=email, name="")
+            for sku in skus:
+                Interaction.objects.create(
+                    user=user, book=books[sku], rating=5, content="", header=""
+                )
+            self.rated[user.id] = skus
+
+    def _stream(self, model):
+        return InteractionStream(
+            model,
+            negative_ratio=2,
+            batch_size=3,
+            chunk_size=3,
+            gru_length=3,
+            user_size=3,
+            prefetch=0,
+            store=self.store,
+        )
+
+    def _examples(self, model):
+        examples = []
+        for (users, items), labels in self._stream(model):
+            examples += zip(users, items.argmax(axis=1), labels)
+        return examples
+
+    def test_sample_negatives(self):
+        owners = np.array([0, 0, 1])
+        seen = np.sort(np.array([0 * 10 + 1, 0 * 10 + 2, 1 * 10 + 3]))
+        negative_owners, rows, positives = sample_negatives(
+            owners, seen, np.arange(1, 5), 3, np.random.default_rng(0), 10
+        )
+        self.assertEqual(len(rows), 9)
+        np.testing.assert_array_equal(negative_owners, owners[positives])
+        self.assertFalse(np.isin(negative_owners * 10 + rows, seen).any())
+
+    def test_bcfnet(self):
+        examples = self._examples("bcfnet")
+        positives = [(user, row) for user, row, label in examples if label == 1]
+        self.assertEqual(len(positives), 7)
+        self.assertEqual(len(examples), 21)
+        for user, row in positives:
+            if row == 0:
+                # Profile of the first user without book 0: 1, 2 and 4
+                np.testing.assert_allclose(user, [0, 2 / 3, 1 / 3])
+
+    def test_holdout_last(self):
+        stream = self._stream("bcfnet")
+        stream.holdout_last = True
+        positives = {
+            row for (_, items), labels in stream for row in items[labels == 1].argmax(1)
+        }
+        # The latest of the first and the last user, the second rated only once
+        self.assertEqual(positives, {0, 1, 2, 3, 5})
+
+    def test_zeroshot(self):
+        examples = self._examples("zeroshot")
+        self.assertEqual(len(examples), 21)
+        for history, row, label in examples:
+            if label == 1 and row == 4:
+                # Rated after 0, 1 and 2
+                np.testing.assert_array_equal(history.argmax(axis=1), [0, 1, 2])
+            if label == 1 and row == 5:
+                np.testing.assert_array_equal(history, 0)
+
+    def test_evaluation(self):
+        def oracle(batch):
+            # The held-out item is the first candidate
+            return batch["candidates"] == batch["candidates"][:, :1]
+
+        evaluation = Evaluation(store=self.store, negatives=2, k=1, chunk_size=3)
+        results = evaluation.run(
+            {
+                "oracle": oracle,
+                "constant": lambda batch: np.zeros(batch["candidates"].shape),
+                "content": content_scorer(self.store),
+            }
+        )
+        # The users with an interaction before their latest one
+        self.assertEqual(results["oracle"]["users"], 2)
+        self.assertEqual(results["oracle"]["hr@1"], 1)
+        self.assertEqual(results["oracle"]["mrr"], 1)
+        self.assertEqual(results["constant"]["hr@1"], 0)
+        self.assertAlmostEqual(results["constant"]["mrr"], 1 / 3)
+        # One-hot vectors, the held-out item is orthogonal to the history
+        self.assertEqual(results["content"]["hr@1"], 0)
+
+    def test_training_set(self):
+        space = {"size1": [8, 16], "gru_length": [2, 3]}
+        self.assertEqual(len(sweep.configurations(space)), 4)
+        self.assertEqual(len(sweep.configurations(space, "random", trials=3)), 3)
+
+        with tempfile.TemporaryDirectory() as path:
+            counts = sweep.write_training_set(self._stream("zeroshot"), path, 0.5)
+            self.assertEqual(sum(counts.values()), 21)
+            train = sweep.TrainingSet(path)
+            self.assertEqual(len(train), counts["train"])
+            examples = [
+                example
+                for (users, items), labels in train.batches(4, gru_length=2)
+                for example in zip(users, items.argmax(axis=1), labels)
+            ]
+            validation = sweep.TrainingSet(path, "validation")
+            validation_rows = {
+                row
+                for (_, items), labels in validation.batches(shuffle=False)
+                for row in items[labels == 1].argmax(axis=1)
+            }
+        self.assertEqual(len(examples), counts["train"])
+        for history, row, label in examples:
+            self.assertEqual(history.shape, (2, 8))
+            if label == 1 and row == 4:
+                # The last 2 of 0, 1 and 2
+                np.testing.assert_array_equal(history.argmax(axis=1), [1, 2])
+
+        # Split by user, every user rated their own items
+        train_rows = {row for _, row, label in examples if label == 1}
+        for skus in self.rated.values():
+            self.assertFalse(set(skus) & train_rows and set(skus) & validation_rows)
+        self.assertEqual(len(train_rows | validation_rows), 7)
+
+
+class RatingFilterTest(TestCase):
+    def test_matches_rating(self):
+        from django.test import RequestFactory
+
+        from .filters import RatingFilter
+
+        for count, total in ((0, 0), (1, 5), (2, 7), (3, 8), (4, 12)):
+            Book.objects.create(
+                name=f"{count} {total}", rating_count=count, rating_sum=total
+            )
+        books = Book.objects.order_by("id")
+        for rate in range(-1, 7):
+            request = RequestFactory().get("/", {"rate": rate})
+            filtered = RatingFilter().filter_queryset(request, books, None)
+            self.assertEqual(
+                list(filtered), [book for book in books if book.rating >= rate]
+            )
+
+
+class ListQueryCountTest(TestCase):
+    def _add_books(self, count):
+        authors = [Author.objects.create(name=str(i)) for i in range(2)]
+        for i in range(count):
+            book = Book.objects.create(name=str(i), rating_count=i)
+            book.authors.set(authors)
+            for j in range(2):
+                Image.objects.create(book=book, url=f"{i}/{j}")
+
+    def _get(self, url, queries):
+        from django.core.cache import cache
+
+        # The listing caches its counts
+        cache.clear()
+        with self.assertNumQueries(queries):
+            response = self.client.get(url)
+        return response.json()["data"]
+
+    def test_list_product(self):
+        # Count, books, images and authors whatever the page size
+        for count in (1, 5):
+            self._add_books(count)
+            data = self._get("/api/product/list_product/", 4)
+            self.assertEqual(len(data["results"]), Book.objects.count())
+        # The first image of every book
+        self.assertEqual(data["results"][0]["image"], "4/0")
+        self.assertEqual(len(data["results"][0]["authors"]), 2)
+
+    def test_related_product(self):
+        for count in (1, 5):
+            self._add_books(count)
+            data = self._get("/api/product/related/", 3)
+            self.assertEqual(len(data["results"]), Book.objects.count())
+
+    def test_item_serializer_list(self):
+        self._add_books(5)
+        books = ItemSerializer.prefetch(list(Book.objects.order_by("id")))
+        with self.assertNumQueries(0):
+            data = ItemSerializer(books, many=True).data
+        self.assertEqual([item["image"] for item in data][:2], ["0/0", "1/0"])
+
+
+class CatalogPaginationTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        # Ties on rating_count, the id breaks them
+        for i in range(7):
+            Book.objects.create(name=str(i), rating_count=i // 3)
+
+    def test_keyset_pages(self):
+        expected = list(
+            Book.objects.order_by("-rating_count", "-id").values_list("name", flat=True)
+        )
+        names, url = [], "/api/product/list_product/?cursor=&page_size=3"
+        while url:
+            # The page and its images and authors, no count
+            with self.assertNumQueries(3):
+                data = self.client.get(url).json()["data"]
+            names += [book["name"] for book in data["results"]]
+            url = data["next"]
+        self.assertEqual(names, expected)
+
+    def test_cached_count(self):
+        url = "/api/product/list_product/"
+        with self.assertNumQueries(4):
+            data = self.client.get(url, {"page_size": 3}).json()["data"]
+        self.assertEqual(data["count"], 7)
+        # Same filters on another page, the count is cached
+        with self.assertNumQueries(3):
+            data = self.client.get(url, {"page_size": 3, "page": 2}).json()["data"]
+        self.assertEqual(data["count"], 7)
+        with self.assertNumQueries(4):
+            data = self.client.get(url, {"max_price": 0}).json()["data"]
+
+
+class ProductFacetsTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        self.categories = [
+            Category.objects.create(name=str(i), cf_index=i) for i in range(2)
+        ]
+        self.author = Author.objects.create(name="author")
+        # (price, publisher, rating_count, rating_sum, category)
+        for i, (price, publisher, count, total, category) in enumerate(
+            (
+                (10000, "a", 0, 0, 0),
+                (60000, "a", 2, 9, 0),
+                (60000, "b", 1, 5, 1),
+                (900000, "b", 3, 6, 1),
+            )
+        ):
+            book = Book.objects.create(
+                name=str(i),
+                price=price,
+                publisher=publisher,
+                rating_count=count,
+                rating_sum=total,
+            )
+            book.categories.add(self.categories[category])
+            if i % 2:
+                book.authors.add(self.author)
+
+    def _facets(self, params=None, queries=1):
+        with self.assertNumQueries(queries):
+            response = self.client.get("/api/product/facets/", params or {})
+        return response.json()["data"]
+
+    def test_facets(self):
+        facets = self._facets()
+        self.assertEqual(facets["total"], 4)
+        self.assertEqual(
+            sorted((item["name"], item["count"]) for item in facets["categories"]),
+            [("0", 2), ("1", 2)],
+        )
+        self.assertEqual(
+            facets["authors"],
+            [{"uid": str(self.author.uid), "name": "author", "count": 2}],
+        )
+        self.assertEqual(
+            sorted((item["name"], item["count"]) for item in facets["publishers"]),
+            [("a", 2), ("b", 2)],
+        )
+        self.assertEqual(
+            facets["prices"],
+            [
+                {"min": 0, "max": 50000, "count": 1},
+                {"min": 50000, "max": 100000, "count": 2},
+                {"min": 500000, "max": None, "count": 1},
+            ],
+        )
+        self.assertEqual(
+            facets["ratings"],
+            [
+                {"rating": 5, "count": 1},
+                {"rating": 4, "count": 1},
+                {"rating": 2, "count": 1},
+                {"rating": 0, "count": 1},
+            ],
+        )
+        # Cached per filter combination
+        self.assertEqual(self._facets(queries=0), facets)
+
+    def test_filtered(self):
+        facets = self._facets(
+            {"category_id": str(self.categories[1].uid), "rate": 4}
+        )
+        self.assertEqual(facets["total"], 1)
+        self.assertEqual(facets["publishers"], [{"name": "b", "count": 1}])
+        self.assertEqual(facets["ratings"], [{"rating": 5, "count": 1}])
+        # Every category of the matching books, not only the filtered one
+        self.assertEqual([item["name"] for item in facets["categories"]], ["1"])
+
+    def test_limit(self):
+        from django.db import connection
+
+        self.categories.append(Category.objects.create(name="2", cf_index=2))
+        Book.objects.get(name="0").categories.add(self.categories[2])
+        features = connection.features
+        # LIMIT in the query where supported, and cut in Python
+        for ranked in (features.supports_slicing_ordering_in_compound, False):
+            with mock.patch.object(
+                features, "supports_slicing_ordering_in_compound", ranked
+            ):
+                facets = product_services.get_facets(Book.objects.all(), limit=1)
+            self.assertEqual(len(facets["categories"]), 1)
+            self.assertEqual(facets["categories"][0]["count"], 2)
+            # Ties are broken by key
+            self.assertEqual(facets["publishers"], [{"name": "a", "count": 2}])
+            # The other facets are not cut
+            self.assertEqual(len(facets["prices"]), 3)
+            self.assertEqual(len(facets["ratings"]), 4)
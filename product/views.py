@@ -1,9 +1,13 @@
 from rest_framework import permissions, decorators, exceptions, generics
 from utils import viewset, http_code
+from utils.viewset import pagination as viewset_pagination
 from rest_framework import filters
-from utils.services import product as product_services
+from utils.services import (
+    product as product_services,
+    recommendation as recommendation_services,
+)
 from . import serializers, models, filters as product_filters
-# from . import recommender
+from .recommenders.ranking import rank_queryset
 
 # from utils.recomender.CB_model import cb as cb_filter
 
@@ -62,7 +66,7 @@ class ProductViewSet(viewset.BaseView):
 class PopularProduct(generics.ListAPIView):
     from rest_framework import pagination
 
-    queryset = models.Book.objects.order_by("-rating_count")
+    queryset = models.Book.objects.order_by("-rating_count", "-id")
     serializer_class = serializers.ItemInfoSerializer
     permission_classes = (permissions.AllowAny,)
     filter_backends = [
@@ -75,6 +79,19 @@ class PopularProduct(generics.ListAPIView):
     ]
     search_fields = ["name"]
 
+    def get_queryset(self):
+        return self.serializer_class.prefetch(super().get_queryset())
+
+    @property
+    def paginator(self):
+        # Infinite scroll clients opt in with ?cursor= for constant time pages
+        if not hasattr(self, "_paginator"):
+            if "cursor" in self.request.query_params:
+                self._paginator = viewset_pagination.KeysetPagination()
+            else:
+                self._paginator = viewset_pagination.CachedCountPagination()
+        return self._paginator
+
     def list(self, request):
         from django.http import JsonResponse
 
@@ -88,6 +105,36 @@ class PopularProduct(generics.ListAPIView):
 
 
 
+class ProductFacets(generics.GenericAPIView):
+    """
+    Counts of the filter sidebar for the filters of `PopularProduct`
+    """
+
+    queryset = models.Book.objects.all()
+    permission_classes = (permissions.AllowAny,)
+    filter_backends = PopularProduct.filter_backends
+    search_fields = PopularProduct.search_fields
+    facets_key = "product:facets:{}"
+    facets_timeout = 60
+
+    def get(self, request):
+        from django.core.cache import cache
+        from django.http import JsonResponse
+
+        try:
+            key = self.facets_key.format(viewset_pagination.filter_key(request))
+            facets = cache.get(key)
+            if facets is None:
+                facets = product_services.get_facets(
+                    self.filter_queryset(self.get_queryset())
+                )
+                cache.set(key, facets, self.facets_timeout)
+            return JsonResponse({"data": facets, "error_code": 0})
+        except Exception as e:
+            print(f"Exception while filtering: {e}")
+        return JsonResponse({"data": None, "error_code": 0})
+
+
 class AuthorView(generics.ListAPIView):
     queryset = models.Author.objects.order_by("name")
     serializer_class = serializers.AuthorSerializer
@@ -156,16 +203,40 @@ class RecommendProduct(generics.ListAPIView):
 
         categories = rated_books.values_list("categories")
 
-        recommend_book = Book.objects.filter(categories__in=categories[:3]).exclude(
-            sku__in=rated_books
-        )
-
-        recommend_book = recommender.cf_filter(
-            categories.values_list("categories__cf_index", flat=True), recommend_book, 8
-        )
+        # Read once, results computed from older interactions are not cached as newer
+        version = recommendation_services.get_interaction_version(user.pk)
+        book_uids = recommendation_services.get_recommendation(user.pk, version)
+        if book_uids is None:
+            book_ids = recommendation_services.get_precomputed_recommendation(
+                user.pk, user_interaction.values_list("updated_at", flat=True).first(), 8
+            )
+            if book_ids:
+                recommend_book = list(
+                    rank_queryset(Book.objects.all(), book_ids, field="id")
+                )
+            else:
+                from . import recommender
+
+                recommend_book = Book.objects.filter(
+                    categories__in=categories[:3]
+                ).exclude(sku__in=rated_books)
+
+                recommend_book = list(
+                    recommender.cf_filter(
+                        recommendation_services.get_user_profile(user.pk),
+                        recommend_book,
+                        8,
+                    )
+                )
+            recommendation_services.set_recommendation(
+                user.pk, [book.uid for book in recommend_book], version
+            )
+        else:
+            recommend_book = rank_queryset(Book.objects.all(), book_uids, field="uid")
 
         try:
 
+            recommend_book = serializers.ItemSerializer.prefetch(recommend_book)
             data = serializers.ItemSerializer(
                             recommend_book, many=True
                         ).data
@@ -176,7 +247,7 @@ class RecommendProduct(generics.ListAPIView):
                     "data": {
                         "recommended_books": data,
                         "rated_book": serializers.ItemSerializer(
-                            rated_books, many=True
+                            serializers.ItemSerializer.prefetch(rated_books), many=True
                         ).data,
                     },
                     "error_code": 0,
@@ -193,9 +264,11 @@ class RelatedProduct(generics.ListAPIView):
     queryset = models.Book.objects.all()
     serializer_class = serializers.ItemSerializer
     permission_classes = (permissions.AllowAny,)
-    filter_backends = [filters.SearchFilter]
+    filter_backends = [filters.SearchFilter, product_filters.ContentFilter]
     search_fields = ["name"]
-    # filter_backends = ()
+
+    def get_queryset(self):
+        return self.serializer_class.prefetch(super().get_queryset())
 
     def list(self, request):
 
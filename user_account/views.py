@@ -25,10 +25,10 @@ class AuthViewSet(viewset.BaseView):
     @decorators.action(methods=["GET"], url_path="list", detail=False)
     def list_user(self, request):
         try:
-            users = User.objects.all()
-            data = user_serializers.UserSerializer(users, many=True).data
-            return self.get_response(
-                data=viewset.paginate_data(request, data),
+            return viewset.paginate_queryset(
+                request,
+                User.objects.order_by("id"),
+                user_serializers.UserSerializer,
                 error_code=http_code.HttpSuccess,
             )
         except Exception as e:
@@ -1,11 +1,23 @@
+import uuid
+
 from product import models, serializers
 from django.core.paginator import Paginator
+from django.db import connection, transaction
+from django.db.models import (
+    Case, CharField, Count, F, IntegerField, Max, Value, When
+)
+from django.db.models.functions import Cast
 from rest_framework import pagination
 
 
 PAGE_NUMBER = 1
 PAGE_SIZE = 10
 
+FACETS = ('categories', 'authors', 'publishers', 'prices', 'ratings')
+FACET_LIMIT = 20
+# Lower bounds of the price buckets of the facets, the last one is open ended
+PRICE_BUCKETS = (0, 50000, 100000, 200000, 500000)
+
 class Pagination(pagination.PageNumberPagination):
 
     # def get_page_size
@@ -34,4 +46,160 @@ def add_new_item(name, price, first_price, short_description, description, numbe
     book.save()
     [book.categories.add(category) for category in categories_list]
     [book.authors.add(author) for author in authors_list]
-    return None
\ No newline at end of file
+    return None
+
+def enqueue_embedding(book_ids):
+    """
+        Queue books for `ingest_embedding_queue`, a queued book is kept once
+
+        @param: book_ids - Primary keys of the new or edited books
+    """
+    models.EmbeddingJob.objects.bulk_create(
+        [models.EmbeddingJob(book_id=book_id) for book_id in book_ids],
+        ignore_conflicts=True,
+    )
+
+
+def ingest_embedding_queue(
+    batch_size=1024, limit=None, encoder=None, store_path=None, update_indexes=True
+):
+    """
+        Embed the queued books and append them to the embedding store
+
+        The books without a sku get the next free ones. Every batch is
+        appended and removed from the queue in one transaction, so an
+        interrupted run resumes from the first batch not appended.
+
+        @param: batch_size - Books encoded and appended at a time
+        @param: limit - Maximum number of books, None for the whole queue
+        @param: encoder - Default settings.EMBEDDING_ENCODER
+        @param: store_path - Default the store of the recommenders
+        @param: update_indexes - Also add the books to the related table and the IVF index
+        @return: Number of books ingested
+    """
+    # Imported here, so saving a book never loads the recommenders
+    from product.recommenders import ingestion
+    from product.recommenders.encoders import get_encoder
+    from product.recommenders.store import STORE_DIR, EmbeddingStore
+
+    store_path = store_path or STORE_DIR
+    encoder = encoder or get_encoder(EmbeddingStore(store_path).dim)
+    done = 0
+    while limit is None or done < limit:
+        size = batch_size if limit is None else min(batch_size, limit - done)
+        with transaction.atomic():
+            jobs = list(
+                models.EmbeddingJob.objects.select_for_update()
+                .select_related('book')
+                .order_by('id')[:size]
+            )
+            if not jobs:
+                break
+            books = [job.book for job in jobs]
+            new_books = [book for book in books if book.sku < 0]
+            if new_books:
+                next_sku = max(
+                    models.Book.objects.aggregate(sku=Max('sku'))['sku'] + 1,
+                    int(EmbeddingStore(store_path).skus.max(initial=-1)) + 1,
+                )
+                for sku, book in enumerate(new_books, next_sku):
+                    book.sku = sku
+                models.Book.objects.bulk_update(new_books, ['sku'])
+            ingestion.ingest(
+                [book.sku for book in books],
+                [book.embedding_text for book in books],
+                encoder,
+                store_path,
+                batch_size,
+            )
+            models.EmbeddingJob.objects.filter(pk__in=[job.pk for job in jobs]).delete()
+        done += len(jobs)
+
+    if done and update_indexes:
+        ingestion.update_indexes(store_path)
+    return done
+
+
+def get_facets(books, limit=FACET_LIMIT):
+    """
+        Count the books of every category, author, publisher, price bucket and
+        rating, for the filter sidebar
+
+        Every facet is a grouped aggregate over the ids of `books`, and the
+        facets are sent as one UNION ALL query.
+
+        @param: books - Filtered Book queryset
+        @param: limit - Most common categories, authors and publishers kept
+        @return: Dict of total, categories, authors, publishers, prices and ratings
+    """
+    book_ids = books.order_by().values('id')
+    in_books = models.Book.objects.filter(id__in=book_ids)
+    ranked = connection.features.supports_slicing_ordering_in_compound
+
+    def facet(queryset, name, key, label, count, limit=None):
+        queryset = queryset.annotate(
+            facet=Value(name, output_field=CharField()),
+            key=Cast(key, CharField()),
+            label=label,
+        ).values('facet', 'key', 'label').annotate(count=Count(count))
+        if limit and ranked:
+            queryset = queryset.order_by('-count', 'key')[:limit]
+        return queryset
+
+    rating = Case(
+        When(rating_count__gt=0, then=F('rating_sum') / F('rating_count')),
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    price_bucket = Case(
+        *[
+            When(price__lt=bound, then=Value(i))
+            for i, bound in enumerate(PRICE_BUCKETS[1:])
+        ],
+        default=Value(len(PRICE_BUCKETS) - 1),
+        output_field=IntegerField(),
+    )
+    no_label = Value('', output_field=CharField())
+    categories = models.Book.categories.through.objects.filter(book_id__in=book_ids)
+    authors = models.Book.authors.through.objects.filter(book_id__in=book_ids)
+    rows = facet(in_books, 'total', no_label, no_label, 'id').union(
+        facet(categories, 'categories', 'category__uid', F('category__name'),
+              'book_id', limit),
+        facet(authors, 'authors', 'author__uid', F('author__name'), 'book_id', limit),
+        facet(in_books, 'publishers', 'publisher', no_label, 'id', limit),
+        facet(in_books, 'prices', price_bucket, no_label, 'id'),
+        facet(in_books, 'ratings', rating, no_label, 'id'),
+        all=True,
+    )
+
+    facets = {'total': 0}
+    facets.update((name, []) for name in FACETS)
+    # Ties in the order of the keys, as the per facet LIMIT picks them
+    for row in sorted(rows, key=lambda row: (-row['count'], row['key'])):
+        if row['facet'] == 'total':
+            facets['total'] = row['count']
+        elif row['facet'] in ('categories', 'authors'):
+            # The text of a uuid depends on the database
+            uid = str(uuid.UUID(row['key']))
+            facets[row['facet']].append(
+                {'uid': uid, 'name': row['label'], 'count': row['count']}
+            )
+        elif row['facet'] == 'publishers':
+            facets['publishers'].append({'name': row['key'], 'count': row['count']})
+        elif row['facet'] == 'prices':
+            bucket = int(row['key'])
+            bounds = PRICE_BUCKETS[bucket : bucket + 2] + (None,)
+            facets['prices'].append(
+                {'min': bounds[0], 'max': bounds[1], 'count': row['count']}
+            )
+        else:
+            facets['ratings'].append(
+                {'rating': int(row['key']), 'count': row['count']}
+            )
+    if limit and not ranked:
+        # The databases without LIMIT in a UNION return every group
+        for name in ('categories', 'authors', 'publishers'):
+            facets[name] = facets[name][:limit]
+    facets['prices'].sort(key=lambda bucket: bucket['min'])
+    facets['ratings'].sort(key=lambda bucket: -bucket['rating'])
+    return facets
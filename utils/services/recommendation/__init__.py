@@ -0,0 +1,193 @@
+import time
+
+import numpy as np
+from django.core.cache import cache
+from django.db import transaction
+
+RECOMMENDATION_TIMEOUT = 60 * 60
+
+VERSION_KEY = "recommendation:version:{}"
+RESULT_KEY = "recommendation:{}:{}"
+
+
+def _new_version():
+    # Start from the clock, so a counter lost by the cache never matches old entries
+    return int(time.time() * 1000)
+
+
+def get_interaction_version(user_id):
+    """
+        Return the interaction version of a user, it changes on every new rating
+
+        @param: user_id - Primary key of the user
+    """
+    key = VERSION_KEY.format(user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _new_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_interaction_version(user_id):
+    """
+        Invalidate the cached recommendations of a user
+
+        @param: user_id - Primary key of the user
+    """
+    key = VERSION_KEY.format(user_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _new_version(), timeout=None)
+
+
+def get_recommendation(user_id, version=None):
+    """
+        Return the cached list of recommended book uids (best first) or None
+
+        @param: user_id - Primary key of the user
+        @param: version - Interaction version to read, default the current one
+    """
+    if version is None:
+        version = get_interaction_version(user_id)
+    return cache.get(RESULT_KEY.format(user_id, version))
+
+
+def set_recommendation(user_id, book_uids, version):
+    """
+        Cache the recommended book uids of a user under an interaction version
+
+        The version must be read before the recommendations are computed, so a
+        rating that arrives meanwhile leaves them under the old version.
+
+        @param: user_id - Primary key of the user
+        @param: book_uids - Ranked uids of the recommended books
+        @param: version - `get_interaction_version` before the computation
+    """
+    cache.set(
+        RESULT_KEY.format(user_id, version),
+        [str(uid) for uid in book_uids],
+        timeout=RECOMMENDATION_TIMEOUT,
+    )
+
+
+def get_precomputed_recommendation(user_id, since=None, num=None):
+    """
+        Return the ranked Book ids precomputed by `precompute_recommendations` or None
+
+        @param: user_id - Primary key of the user
+        @param: since - Ignore results computed before this time (e.g. the last rating)
+        @param: num - Number of books to return, defaults to all
+    """
+    from product.models import UserRecommendation
+
+    recommendation = UserRecommendation.objects.filter(user_id=user_id).first()
+    if recommendation is None or (since and recommendation.updated_at < since):
+        return None
+    return recommendation.books[:num]
+
+
+def _category_counts(cf_indices):
+    from interaction.models import CATEGORY_SIZE
+
+    # None for the interactions with a book without categories
+    cf_indices = np.fromiter(
+        (cf_index for cf_index in cf_indices if cf_index is not None), dtype=np.int64
+    )
+    cf_indices = cf_indices[(cf_indices >= 0) & (cf_indices < CATEGORY_SIZE)]
+    return np.bincount(cf_indices, minlength=CATEGORY_SIZE).astype(np.int32)
+
+
+def get_book_category_counts(book_id):
+    """
+        Return the category counts (CATEGORY_SIZE,) of one book
+
+        @param: book_id - Primary key of the book
+    """
+    from product.models import Book
+
+    return _category_counts(
+        Book.categories.through.objects.filter(book_id=book_id).values_list(
+            "category__cf_index", flat=True
+        )
+    )
+
+
+def rebuild_user_profile(user_id):
+    """
+        Recount the category profile of a user from all of their interactions
+
+        @param: user_id - Primary key of the user
+    """
+    from interaction.models import Interaction, UserProfile
+
+    histogram = _category_counts(
+        Interaction.objects.filter(user_id=user_id).values_list(
+            "book__categories__cf_index", flat=True
+        )
+    )
+    profile, _ = UserProfile.objects.update_or_create(
+        user_id=user_id, defaults={"categories": histogram.tobytes()}
+    )
+    return profile
+
+
+def update_user_profile(user_id, added=None, removed=None):
+    """
+        Apply one interaction change to the category profile of a user
+
+        @param: user_id - Primary key of the user
+        @param: added - Id of the book that was rated
+        @param: removed - Id of the book whose rating was removed
+    """
+    from interaction.models import UserProfile
+
+    with transaction.atomic():
+        profile = UserProfile.objects.select_for_update().filter(user_id=user_id).first()
+        if profile is None:
+            # The interactions are already saved, so a full count includes this change
+            return rebuild_user_profile(user_id)
+        histogram = profile.histogram.copy()
+        if added is not None:
+            histogram += get_book_category_counts(added)
+        if removed is not None:
+            histogram -= get_book_category_counts(removed)
+        profile.histogram = np.maximum(histogram, 0)
+        profile.save(update_fields=["categories", "updated_at"])
+    return profile
+
+
+def remove_from_user_profile(user_id, counts):
+    """
+        Subtract the category counts of a deleted interaction from the profile of
+        a user. A missing profile is left missing, the user may be being deleted;
+        it is counted from the remaining interactions when next read.
+
+        @param: user_id - Primary key of the user
+        @param: counts - `get_book_category_counts` of the book, read before the
+            delete since the categories of a deleted book are deleted with it
+    """
+    from interaction.models import UserProfile
+
+    with transaction.atomic():
+        profile = UserProfile.objects.select_for_update().filter(user_id=user_id).first()
+        if profile is None:
+            return None
+        profile.histogram = np.maximum(profile.histogram - counts, 0)
+        profile.save(update_fields=["categories", "updated_at"])
+    return profile
+
+
+def get_user_profile(user_id):
+    """
+        Return the category counts of a user (CATEGORY_SIZE,) with one primary key lookup
+
+        @param: user_id - Primary key of the user
+    """
+    from interaction.models import UserProfile
+
+    profile = UserProfile.objects.filter(user_id=user_id).first()
+    if profile is None:
+        profile = rebuild_user_profile(user_id)
+    return profile.histogram
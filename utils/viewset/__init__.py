@@ -1,12 +1,17 @@
+import json
+from itertools import islice
+
 from rest_framework import viewsets
 
 from django import http
 
 from utils.serializers import EmptySerializer
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.core.serializers.json import DjangoJSONEncoder
 
 PAGE_SIZE = 10
 PAGE_SIZE_MAX = 50
+STREAM_CHUNK_SIZE = 500
 
 def paginate_data(request, data):
     '''
@@ -69,6 +74,102 @@ def paginate_data(request, data):
     return response_data
 
 
+def paginate_queryset(request, queryset, serializer_class, error_code=0):
+    '''
+    Paginate a queryset in the database, with the response of `paginate_data`.
+
+    Only the requested page is read and serialized. page_size = 0 still
+    returns every row, streamed `STREAM_CHUNK_SIZE` rows at a time so the
+    memory does not grow with the table. The first rows are read before the
+    response is returned, so a failing query raises here; a row failing
+    later can only cut the stream, a body that is not valid JSON means the
+    request failed.
+
+    Params:
+
+    request: request object that contain paginate info (page, page_size).
+
+    queryset: rows to paginate, ordered by primary key when unordered.
+
+    serializer_class: serializer of one row.
+
+    error_code: error_code of the response.
+
+    Return a JsonResponse, a StreamingHttpResponse for page_size = 0:
+
+    {"data": response_data of `paginate_data`, "error_code": error_code}
+    '''
+
+    page = int(request.GET.get('page', 1))
+    page_size = int(request.GET.get('page_size', PAGE_SIZE))
+    if page_size < 0 or page_size > PAGE_SIZE_MAX:
+        raise ValueError()
+    if not queryset.ordered:
+        queryset = queryset.order_by('pk')
+
+    total = queryset.count()
+    if page_size == 0:
+        page_size = total + 1
+        if page == 1:
+            rows = queryset.iterator(chunk_size=STREAM_CHUNK_SIZE)
+            content = _dump_rows(
+                list(islice(rows, STREAM_CHUNK_SIZE)), serializer_class, True
+            )
+            return http.StreamingHttpResponse(
+                _stream_content(
+                    rows, content, serializer_class, total, page_size, error_code
+                ),
+                content_type='application/json',
+            )
+
+    paginator = Paginator(queryset, page_size)
+    # The total is known, the paginator must not count again
+    paginator.count = total
+    total_pages = paginator.num_pages
+
+    if int(total_pages) < page:
+        page_number = page
+        content = []
+    else:
+        current_page = paginator.page(page)
+        page_number = current_page.number
+        content = serializer_class(current_page.object_list, many=True).data
+
+    return http.JsonResponse(
+        data={
+            'data': {
+                "totalRows": total,
+                "totalPages": total_pages,
+                "currentPage": page_number,
+                "content": content,
+                "pageSize": page_size
+            },
+            'error_code': error_code
+        }
+    )
+
+
+def _stream_content(rows, content, serializer_class, total, page_size, error_code):
+    # The response of `paginate_queryset` for a single page holding every row,
+    # `content` being the first rows already serialized
+    header = {
+        "totalRows": total,
+        "totalPages": 1,
+        "currentPage": 1,
+        "pageSize": page_size,
+    }
+    yield '{"data": ' + json.dumps(header)[:-1] + ', "content": [' + content
+    for chunk in iter(lambda: list(islice(rows, STREAM_CHUNK_SIZE)), []):
+        yield _dump_rows(chunk, serializer_class, False)
+    yield ']}, "error_code": ' + json.dumps(error_code) + '}'
+
+
+def _dump_rows(rows, serializer_class, first):
+    content = json.dumps(serializer_class(rows, many=True).data, cls=DjangoJSONEncoder)
+    # The rows of the list without its brackets
+    return ('' if first else ', ') + content[1:-1]
+
+
 class BaseView(viewsets.GenericViewSet):
     serializer_class = EmptySerializer
 
@@ -1,7 +1,172 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import hashlib
+import json
+from functools import partial
+
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q, QuerySet
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.utils.urls import replace_query_param
+
+COUNT_TIMEOUT = 60
+COUNT_KEY = "pagination:count:{}"
+# Above this many rows, the planner estimate is returned instead of a COUNT(*)
+ESTIMATE_THRESHOLD = 100000
 
 
 class LargeResultsSetPagination(PageNumberPagination):
     page_size = 24
     page_size_query_param = 'page_size'
-    max_page_size = 50
\ No newline at end of file
+    max_page_size = 50
+
+
+def estimated_count(queryset):
+    """
+    Number of rows of a queryset estimated by the PostgreSQL planner, without
+    running it. None on the other databases.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql":
+        return None
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def filter_key(request, ignored=()):
+    """
+    Hash of the path and the query parameters of a request, in a stable order
+    and without the `ignored` ones, to cache per filter combination.
+    """
+    params = sorted(
+        (name, sorted(request.query_params.getlist(name)))
+        for name in request.query_params
+        if name not in ignored
+    )
+    key = json.dumps([request.path, params])
+    return hashlib.md5(key.encode()).hexdigest()
+
+
+class CachedCountPaginator(Paginator):
+    """
+    Paginator whose total is cached under `cache_key` for `COUNT_TIMEOUT`
+    seconds, and estimated by the planner for large results.
+    """
+
+    def __init__(self, object_list, per_page, cache_key=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.cache_key = cache_key
+
+    @cached_property
+    def count(self):
+        count = cache.get(self.cache_key) if self.cache_key else None
+        if count is not None:
+            return count
+        if isinstance(self.object_list, QuerySet):
+            count = estimated_count(self.object_list)
+        if count is None or count < ESTIMATE_THRESHOLD:
+            count = Paginator.count.func(self)
+        if self.cache_key:
+            cache.set(self.cache_key, count, COUNT_TIMEOUT)
+        return count
+
+
+class CachedCountPagination(LargeResultsSetPagination):
+    """
+    Page number pagination that counts every filter combination once per
+    `COUNT_TIMEOUT` seconds instead of on every page.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.django_paginator_class = partial(
+            CachedCountPaginator, cache_key=self.count_key(request)
+        )
+        return super().paginate_queryset(queryset, request, view)
+
+    def count_key(self, request):
+        return COUNT_KEY.format(
+            filter_key(request, (self.page_query_param, self.page_size_query_param))
+        )
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination for infinite scroll, on a unique `ordering`.
+
+    The cursor holds the ordering values of the last row of a page and the
+    next page starts after them with a WHERE instead of an OFFSET, so every
+    page costs the same given an index on the ordering. There is no total
+    and no previous page.
+    """
+
+    ordering = ("-rating_count", "-id")
+    page_size = 24
+    page_size_query_param = "page_size"
+    max_page_size = 50
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        queryset = queryset.order_by(*self.ordering)
+        cursor = self.decode_cursor(request)
+        if cursor is not None:
+            queryset = queryset.filter(self.after(cursor))
+        page = list(queryset[: self.page_size + 1])
+        self.has_next = len(page) > self.page_size
+        self.page = page[: self.page_size]
+        return self.page
+
+    def after(self, values):
+        """
+        Rows after `values` in the ordering.
+
+        The redundant bound on the first field keeps the lookup an index range.
+        """
+        fields = [
+            (name.lstrip("-"), "lt" if name.startswith("-") else "gt")
+            for name in self.ordering
+        ]
+        condition = Q()
+        for i, (name, operator) in enumerate(fields):
+            # Equal on the fields before, after on this one
+            equal = {field: value for (field, _), value in zip(fields, values[:i])}
+            condition |= Q(**equal) & Q(**{f"{name}__{operator}": values[i]})
+        first, operator = fields[0]
+        return Q(**{f"{first}__{operator}e": values[0]}) & condition
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            values = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return values
+
+    def encode_cursor(self, instance):
+        values = [getattr(instance, name.lstrip("-")) for name in self.ordering]
+        encoded = base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(self.page[-1])
+
+    def get_previous_link(self):
+        return None